@@ -0,0 +1,57 @@
+from typing import TYPE_CHECKING, List, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from components.DNNExecutionPlan import DNNExecutionPlan
+    from components.DNNNodeConnection import DNNConnection
+
+
+class DNNActivationTape:
+    """
+        Records the activations each connection needs for backpropagation, once per forward pass.
+
+        Every connection in the execution plan owns one preallocated slot for the input it received and
+        one for weight_a @ input (row_res). Slots are only reallocated when the batch size changes.
+    """
+
+    def __init__(self, plan: 'DNNExecutionPlan'):
+        self.plan = plan
+        self.batch_size: int = None
+        self.original_inputs: List['np.ndarray'] = []
+        self.row_results: List['np.ndarray'] = []
+        self.recorded = np.zeros(len(plan.connections), bool)
+        self.__allocate_slots()
+
+    def __allocate_slots(self):
+        batch_shape = () if self.batch_size is None else (self.batch_size,)
+        self.original_inputs = []
+        self.row_results = []
+        for connection in self.plan.connections:
+            in_shape = connection.node_in.internal_shape
+            self.original_inputs.append(np.zeros(batch_shape + tuple(in_shape)))
+            self.row_results.append(np.zeros(batch_shape + (connection.node_out.internal_shape[0], in_shape[1])))
+
+    def begin_pass(self, batch_size: int = None):
+        if not batch_size == self.batch_size:
+            self.batch_size = batch_size
+            self.__allocate_slots()
+        self.recorded[:] = False
+
+    def slot(self, connection: 'DNNConnection') -> Tuple['np.ndarray', 'np.ndarray']:
+        """
+            Returns the (original_input, row_res) slot of connection for it to write into during this pass.
+        """
+        conn_idx = self.plan.connection_index[connection]
+        self.recorded[conn_idx] = True
+        return self.original_inputs[conn_idx], self.row_results[conn_idx]
+
+    def lookup(self, connection: 'DNNConnection') -> Tuple['np.ndarray', 'np.ndarray']:
+        conn_idx = self.plan.connection_index.get(connection)
+        if conn_idx is None or not self.recorded[conn_idx]:
+            raise ValueError("Connection did not transmit during the recorded forward pass")
+        return self.original_inputs[conn_idx], self.row_results[conn_idx]
+
+    def contains(self, connection: 'DNNConnection') -> bool:
+        conn_idx = self.plan.connection_index.get(connection)
+        return conn_idx is not None and bool(self.recorded[conn_idx])
@@ -0,0 +1,48 @@
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from components.DNNMessage import DNNMessage
+
+if TYPE_CHECKING:
+    from components.DNNExecutionPlan import DNNExecutionPlan
+
+
+class DNNBufferPool:
+    """
+        Hands every node and connection of an execution plan preallocated messages to write their results into,
+        so that steady state passes allocate no arrays.
+
+        Each node is given pooled_message for its combined input, and each connection pooled_message for its
+        output along with pooled_row_res for weight_a @ input. Buffers are only reallocated when the batch size
+        changes. Results read from the network, such as extract_output_data, are overwritten by the next pass.
+    """
+
+    def __init__(self, plan: 'DNNExecutionPlan'):
+        self.plan = plan
+        self.batch_size: int = None
+        self.__allocate_buffers()
+
+    def __allocate_buffers(self):
+        batch_shape = () if self.batch_size is None else (self.batch_size,)
+        for node in self.plan.nodes:
+            node.pooled_message = DNNMessage(np.zeros(batch_shape + tuple(node.internal_shape)), False)
+        for connection in self.plan.connections:
+            out_shape = connection.node_out.internal_shape
+            connection.pooled_message = DNNMessage(np.zeros(batch_shape + tuple(out_shape)), False)
+            connection.pooled_row_res = np.zeros(batch_shape + (out_shape[0], connection.node_in.internal_shape[1]))
+
+    def begin_pass(self, batch_size: int = None):
+        if not batch_size == self.batch_size:
+            self.batch_size = batch_size
+            self.__allocate_buffers()
+
+    def release(self):
+        """
+            Detaches the buffers from the plan's nodes and connections, which then allocate per pass again.
+        """
+        for node in self.plan.nodes:
+            node.pooled_message = None
+        for connection in self.plan.connections:
+            connection.pooled_message = None
+            connection.pooled_row_res = None
@@ -0,0 +1,159 @@
+import json
+import os
+import struct
+from typing import TYPE_CHECKING, Iterator, List, Tuple
+
+import numpy as np
+
+from components import default_checkpoint_compaction
+from components.DNNSerialization import save_network, load_network, read_network_header
+
+if TYPE_CHECKING:
+    from components.DNNNetwork import DynamicNeuralNetwork
+
+base_file_name = "base.dnn"
+delta_file_name = "deltas.log"
+delta_magic = b"DNND"
+record_preamble = struct.Struct("<4sI")
+
+
+def _connection_ids(network: 'DynamicNeuralNetwork') -> List[int]:
+    return [c.connection_id for c in network.compile_execution_plan().connections]
+
+
+def _base_sequence(directory: str) -> int:
+    base_path = os.path.join(directory, base_file_name)
+    if not os.path.exists(base_path):
+        return 0
+    return read_network_header(base_path).get("metadata", {}).get("checkpoint_sequence", 0)
+
+
+def _read_records(directory: str) -> Iterator[Tuple[dict, 'np.ndarray']]:
+    """
+        Yields the header and values of every complete record in the log, stopping at a record cut short by a
+        crash while it was being written.
+    """
+    delta_path = os.path.join(directory, delta_file_name)
+    if not os.path.exists(delta_path):
+        return
+    with open(delta_path, "rb") as log_file:
+        log = log_file.read()
+    position = 0
+    while position + record_preamble.size <= len(log):
+        magic, header_len = record_preamble.unpack_from(log, position)
+        header_end = position + record_preamble.size + header_len
+        if not magic == delta_magic or header_end > len(log):
+            break
+        header = json.loads(log[position + record_preamble.size:header_end].decode("utf-8"))
+        values_end = header_end + header["num_values"] * 8
+        if values_end > len(log):
+            break
+        yield header, np.frombuffer(log, "<f8", header["num_values"], header_end)
+        position = values_end
+
+
+class DNNCheckpointer:
+    """
+        Checkpoints a network into a directory as a full base snapshot followed by a log of changes.
+
+        Every checkpoint appends one record to the log, holding the current weights of only those connections
+        whose weights changed since the previous checkpoint, so its size follows the change rather than the model.
+        Records carry whole connections' weights rather than differences, so that replaying them restores the
+        weights exactly. After compact_every records, or once the topology changes, the base is rewritten from the
+        current weights and the log is emptied.
+
+        Records and bases share one increasing sequence, and each base stores its own. Records at or below the
+        base's sequence are left over from before it was written and are never replayed, so a crash between
+        rewriting the base and emptying the log cannot roll weights back.
+    """
+
+    def __init__(self, network: 'DynamicNeuralNetwork', directory: str, interval: int = 1,
+                 compact_every: int = None):
+        self.network = network
+        self.directory = directory
+        self.interval = interval
+        self.compact_every = compact_every if compact_every is not None else default_checkpoint_compaction
+        self.steps = 0
+        self.num_records = 0
+        self.__checkpointed: 'np.ndarray' = None
+        self.__connection_ids: List[int] = []
+        os.makedirs(directory, exist_ok=True)
+        # Continue the sequence of a directory checkpointed before, so that its records stay ordered below ours
+        self.sequence = max([_base_sequence(directory)] +
+                            [header["sequence"] for header, _ in _read_records(directory)])
+        self.compact()
+
+    def step(self) -> bool:
+        """
+            Counts one training step, checkpointing every interval steps. Returns whether a checkpoint was made.
+        """
+        self.steps += 1
+        if self.steps % self.interval == 0:
+            self.checkpoint()
+            return True
+        return False
+
+    def checkpoint(self):
+        if not _connection_ids(self.network) == self.__connection_ids or self.num_records >= self.compact_every:
+            self.compact()
+            return
+        arena = self.network.weight_arena()
+        changed = np.not_equal(arena.weights, self.__checkpointed)
+        if arena.num_weights > 0:
+            changed_connections = np.flatnonzero(np.logical_or.reduceat(changed, arena.offsets[:-1]))
+        else:
+            changed_connections = np.zeros(0, int)
+        positions = np.concatenate([np.arange(arena.offsets[conn_idx], arena.offsets[conn_idx + 1])
+                                    for conn_idx in changed_connections] + [np.zeros(0, int)])
+        values = arena.weights[positions]
+        self.sequence += 1
+        header = json.dumps({"sequence": self.sequence,
+                             "connections": [self.__connection_ids[conn_idx] for conn_idx in changed_connections],
+                             "num_values": int(values.size)}).encode("utf-8")
+        header += b" " * (-len(header) % 8)
+        with open(os.path.join(self.directory, delta_file_name), "ab") as log_file:
+            log_file.write(record_preamble.pack(delta_magic, len(header)) + header)
+            log_file.write(values.astype("<f8", copy=False).tobytes())
+            log_file.flush()
+            os.fsync(log_file.fileno())
+        self.__checkpointed[positions] = values
+        self.num_records += 1
+
+    def compact(self):
+        """
+            Rewrites the base snapshot from the current weights and empties the log.
+        """
+        self.sequence += 1
+        base_path = os.path.join(self.directory, base_file_name)
+        save_network(self.network, base_path + ".tmp", {"checkpoint_sequence": self.sequence})
+        with open(base_path + ".tmp", "rb+") as base_file:
+            os.fsync(base_file.fileno())
+        os.replace(base_path + ".tmp", base_path)
+        # Records left behind by a crash before this point are all at or below the new base's sequence
+        open(os.path.join(self.directory, delta_file_name), "wb").close()
+        self.__checkpointed = self.network.weight_arena().snapshot()
+        self.__connection_ids = _connection_ids(self.network)
+        self.num_records = 0
+
+
+def restore_checkpoint(directory: str) -> 'DynamicNeuralNetwork':
+    """
+        Rebuilds the network as of the last complete checkpoint written into directory by a DNNCheckpointer.
+        A record cut short by a crash while it was being written is ignored.
+    """
+    base_sequence = _base_sequence(directory)
+    network = load_network(os.path.join(directory, base_file_name))
+    arena = network.weight_arena()
+    offsets = {conn_id: (arena.offsets[conn_idx], arena.offsets[conn_idx + 1])
+               for conn_idx, conn_id in enumerate(_connection_ids(network))}
+    for header, values in _read_records(directory):
+        if header["sequence"] <= base_sequence:
+            continue
+        value_idx = 0
+        for conn_id in header["connections"]:
+            start, end = offsets[conn_id]
+            arena.weights[start:end] = values[value_idx:value_idx + end - start]
+            value_idx += end - start
+    for connection in arena.connections:
+        connection.invalidate_factorizations()
+    return network
@@ -0,0 +1,138 @@
+import multiprocessing
+from multiprocessing import shared_memory
+from typing import TYPE_CHECKING, List, Tuple
+
+import numpy as np
+
+from components.DNNNodeConnection import factorization_cache
+
+if TYPE_CHECKING:
+    from multiprocessing.connection import Connection
+    from components.DNNNetwork import DynamicNeuralNetwork
+
+
+def _shard_bounds(batch_size: int, num_workers: int) -> List[Tuple[int, int]]:
+    edges = np.linspace(0, batch_size, num_workers + 1).astype(int)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _worker_main(network: 'DynamicNeuralNetwork', worker_idx: int, arenas: 'np.ndarray', inputs: List['np.ndarray'],
+                 targets: List['np.ndarray'], pipe: 'Connection'):
+    # The network, the arena slots and the staging arrays are all inherited through fork
+    network.bind_weight_arena(arenas[worker_idx])
+    while True:
+        command = pipe.recv()
+        if command[0] == "stop":
+            break
+        _, start, end = command
+        try:
+            # The parent rewrote this replica's weights since the last step
+            factorization_cache.clear()
+            if end > start:
+                network.compute_weight_changes([x[start:end] for x in inputs], [y[start:end] for y in targets])
+            pipe.send(("done", None))
+        except Exception as e:
+            pipe.send(("error", repr(e)))
+    pipe.close()
+
+
+class DNNDataParallelTrainer:
+    """
+        Trains a network on batches split across forked worker processes, each holding a replica of the network.
+
+        Every replica's weight arena lives in one shared memory block, one row per worker. Each step the
+        workers accumulate the weight changes of their shard of the batch into their own row, the parent sums the
+        rows in worker order into its own network and runs a single update_weights, then copies the new weights
+        into every row. All replicas therefore hold bit identical weights after every step, and per step only
+        shard bounds travel through the pipes. Batches are staged in shared memory, so no step may hold more than
+        max_batch_size samples. Requires the fork start method.
+    """
+
+    def __init__(self, network: 'DynamicNeuralNetwork', num_workers: int, max_batch_size: int):
+        if num_workers < 1:
+            raise ValueError("A data parallel trainer requires at least one worker")
+        self.network = network
+        self.num_workers = num_workers
+        self.max_batch_size = max_batch_size
+        self.__segments: List['shared_memory.SharedMemory'] = []
+        self.__workers = []
+        self.__pipes: List['Connection'] = []
+
+        arena = network.weight_arena()
+        self.__arenas = self.__allocate((num_workers, arena.size))
+        self.__arenas[:, :arena.num_weights] = arena.weights
+        self.__arenas[:, arena.num_weights:] = arena.changes
+        self.__inputs = [self.__allocate((max_batch_size,) + tuple(node.internal_shape))
+                         for node in network.input_nodes]
+        self.__targets = [self.__allocate((max_batch_size,) + tuple(node.internal_shape))
+                          for node in network.output_nodes]
+
+        context = multiprocessing.get_context("fork")
+        for worker_idx in range(num_workers):
+            parent_end, child_end = context.Pipe()
+            worker = context.Process(target=_worker_main, daemon=True,
+                                     args=(network, worker_idx, self.__arenas, self.__inputs, self.__targets,
+                                           child_end))
+            worker.start()
+            child_end.close()
+            self.__workers.append(worker)
+            self.__pipes.append(parent_end)
+
+    def __allocate(self, shape: Tuple[int, ...]) -> 'np.ndarray':
+        segment = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1))
+        self.__segments.append(segment)
+        return np.ndarray(shape, float, buffer=segment.buf)
+
+    def train_step(self, input_data: List['np.ndarray'], expected_outputs: List['np.ndarray']):
+        """
+            Performs one backpropagation step on a batch, given as for perform_backpropagation with a leading
+            batch axis on every input and expected output.
+        """
+        batch_size = self.network.validate_input_data(input_data)
+        if batch_size is None or batch_size > self.max_batch_size:
+            raise ValueError("Batches must be stacked and hold at most " + str(self.max_batch_size) + " samples")
+        for staged, in_data in zip(self.__inputs, input_data):
+            staged[:batch_size] = in_data
+        for staged, expected in zip(self.__targets, expected_outputs):
+            staged[:batch_size] = expected
+
+        for pipe, (start, end) in zip(self.__pipes, _shard_bounds(batch_size, self.num_workers)):
+            pipe.send(("step", start, end))
+        errors = [msg for status, msg in (pipe.recv() for pipe in self.__pipes) if status == "error"]
+        arena = self.network.weight_arena()
+        if len(errors) > 0:
+            self.__arenas[:, arena.num_weights:] = 0
+            raise RuntimeError("Data parallel training step failed: " + "; ".join(errors))
+
+        # Reduce in worker order, then hand every replica the weights resulting from the single update
+        np.sum(self.__arenas[:, arena.num_weights:], axis=0, out=arena.changes)
+        self.network.update_weights()
+        self.__arenas[:, :arena.num_weights] = arena.weights
+        self.__arenas[:, arena.num_weights:] = 0
+
+    def replica_weights(self, worker_idx: int) -> 'np.ndarray':
+        return self.__arenas[worker_idx, :self.network.weight_arena().num_weights]
+
+    def close(self):
+        for pipe in self.__pipes:
+            try:
+                pipe.send(("stop",))
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self.__workers:
+            worker.join()
+        for pipe in self.__pipes:
+            pipe.close()
+        self.__workers.clear()
+        self.__pipes.clear()
+        del self.__arenas, self.__inputs, self.__targets
+        for segment in self.__segments:
+            segment.close()
+            segment.unlink()
+        self.__segments.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
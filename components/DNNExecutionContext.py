@@ -0,0 +1,112 @@
+from typing import TYPE_CHECKING, List, Optional
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from components.DNNExecutionPlan import DNNExecutionPlan
+    from components.DNNNetwork import DynamicNeuralNetwork
+
+
+class DNNExecutionContext:
+    """
+        Holds every buffer a forward pass needs, so that inference never writes to the network itself.
+
+        The network's nodes, messages and active node list are left untouched and connection weights are only
+        read, which lets one context per thread run concurrently against a single network. A context owns one
+        activation buffer per node and one row_res buffer per connection of the plan, allocated for the batch
+        size of the last run and reused until it changes.
+    """
+
+    def __init__(self, network: 'DynamicNeuralNetwork', plan: 'DNNExecutionPlan'):
+        self.network = network
+        self.plan = plan
+        self.batch_size: int = None
+        self.node_values: List['np.ndarray'] = []
+        self.row_results: List['np.ndarray'] = []
+        self.__scratch: List['np.ndarray'] = []
+        self.__allocate_buffers()
+        self.__output_indices = []
+        for out_node in plan.output_nodes:
+            out_idx = plan.node_index.get(out_node)
+            if out_idx is None or len(plan.fan_in(out_idx)) == 0:
+                raise ValueError("Output node does not receive data from any input node")
+            self.__output_indices.append(out_idx)
+
+    def __allocate_buffers(self):
+        batch_shape = () if self.batch_size is None else (self.batch_size,)
+        self.node_values = [np.zeros(batch_shape + tuple(node.internal_shape)) for node in self.plan.nodes]
+        self.__scratch = [np.zeros(batch_shape + tuple(node.internal_shape)) for node in self.plan.nodes]
+        self.row_results = []
+        for connection in self.plan.connections:
+            in_shape = connection.node_in.internal_shape
+            self.row_results.append(np.zeros(batch_shape + (connection.node_out.internal_shape[0], in_shape[1])))
+
+    def run(self, input_data: List['np.ndarray']) -> List['np.ndarray']:
+        """
+            Evaluates the network on one sample per input node, batched or not as for add_input_data,
+            and returns one (copied) result per output node.
+        """
+        self.__prepare(self.network.validate_input_data(input_data))
+
+        has_value = np.zeros(len(self.plan.nodes), bool)
+        for in_node, in_data in zip(self.plan.input_nodes, input_data):
+            in_idx = self.plan.node_index[in_node]
+            np.copyto(self.node_values[in_idx], in_data)
+            has_value[in_idx] = True
+        for node_idx in self.plan.forward_order:
+            if not has_value[node_idx]:
+                # Nodes are visited in topological order, so every contribution has arrived by now
+                self.__combine(node_idx)
+                has_value[node_idx] = True
+        for out_idx in self.__output_indices:
+            self.__combine(out_idx)
+        return [self.node_values[out_idx].copy() for out_idx in self.__output_indices]
+
+    def run_outputs(self, input_data: List['np.ndarray'], output_positions: List[int]) -> List['np.ndarray']:
+        """
+            Like run, but only evaluates the nodes the output nodes at output_positions depend on and returns
+            their results, in the order requested.
+        """
+        self.__prepare(self.network.validate_input_data(input_data))
+        subgraph = self.plan.output_subgraph(tuple(output_positions))
+        for in_node, in_data in zip(self.plan.input_nodes, input_data):
+            np.copyto(self.node_values[self.plan.node_index[in_node]], in_data)
+        for node_idx in subgraph:
+            if not hasattr(self.plan.nodes[node_idx], "is_input"):
+                self.__combine(node_idx)
+        return [self.node_values[self.__output_indices[out_pos]].copy() for out_pos in output_positions]
+
+    def run_contribution(self, position: int, in_data: 'np.ndarray') -> List[Optional['np.ndarray']]:
+        """
+            Evaluates only the subgraph reachable from the input node at position, as though every other input
+            were zero. Returns its (copied) contribution to each output node, or None for outputs it does not reach.
+        """
+        self.__prepare(self.network.validate_input(position, in_data))
+        subgraph = self.plan.input_subgraphs[position]
+        in_subgraph = np.zeros(len(self.plan.nodes), bool)
+        in_subgraph[subgraph] = True
+        np.copyto(self.node_values[subgraph[0]], in_data)
+        for node_idx in subgraph[1:]:
+            self.__combine(node_idx, in_subgraph)
+        return [self.node_values[out_idx].copy() if in_subgraph[out_idx] else None
+                for out_idx in self.__output_indices]
+
+    def __prepare(self, batch_size: int):
+        if self.plan.is_stale():
+            raise ValueError("The network's topology changed since this context was created")
+        if not batch_size == self.batch_size:
+            self.batch_size = batch_size
+            self.__allocate_buffers()
+
+    def __combine(self, node_idx: int, in_subgraph: 'np.ndarray' = None):
+        value = self.node_values[node_idx]
+        value.fill(0)
+        scratch = self.__scratch[node_idx]
+        for conn_idx in self.plan.fan_in(node_idx):
+            if in_subgraph is not None and not in_subgraph[self.plan.connection_src[conn_idx]]:
+                continue
+            connection = self.plan.connections[conn_idx]
+            row_res = self.row_results[conn_idx]
+            np.matmul(connection.weight_a, self.node_values[self.plan.connection_src[conn_idx]], out=row_res)
+            np.matmul(row_res, connection.weight_b, out=scratch)
+            value += scratch
@@ -0,0 +1,202 @@
+from collections import deque
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+
+from components.DNNNode import DNNNode
+from components.DNNNodeConnection import DNNConnection
+from components.DNNOutputNode import DNNOutputNode
+
+
+class DNNExecutionPlan:
+    """
+        A flat topological schedule of a network's graph, compiled once and reused by every pass.
+
+        Nodes are numbered in topological order starting from the input nodes. Traversal does not
+        continue past output nodes, matching the forward pass. Connections are numbered so that the
+        outgoing connections of a node are contiguous. Fan-in and fan-out are stored as CSR-style
+        offset/index arrays into the connection numbering.
+    """
+
+    def __init__(self, input_nodes: List['DNNNode'], output_nodes: List['DNNOutputNode']):
+        self.topology_version = DNNConnection.connections_created
+        self.input_nodes = list(input_nodes)
+        self.output_nodes = list(output_nodes)
+        self.nodes: List['DNNNode'] = []
+        self.node_index: Dict['DNNNode', int] = {}
+        self.connections: List['DNNConnection'] = []
+        self.connection_index: Dict['DNNConnection', int] = {}
+        self.__build()
+
+    def __build(self):
+        reachable = self.__collect_reachable()
+        self.nodes = self.__sort_topologically(reachable)
+        self.node_index = {node: i for i, node in enumerate(self.nodes)}
+        self.__num_outgoing = [len(node.outgoing_connections) for node in self.nodes]
+
+        for node in self.nodes:
+            if isinstance(node, DNNOutputNode):
+                continue
+            for connection in node.outgoing_connections:
+                self.connection_index[connection] = len(self.connections)
+                self.connections.append(connection)
+
+        num_connections = len(self.connections)
+        self.connection_src = np.fromiter((self.node_index[c.node_in] for c in self.connections),
+                                          int, num_connections)
+        self.connection_dst = np.fromiter((self.node_index[c.node_out] for c in self.connections),
+                                          int, num_connections)
+
+        self.fan_out_offsets, self.fan_out_indices = self.__build_csr(self.connection_src)
+        self.fan_in_offsets, self.fan_in_indices = self.__build_csr(self.connection_dst)
+
+        self.forward_order = np.array([i for i, node in enumerate(self.nodes)
+                                       if not isinstance(node, DNNOutputNode)], int)
+        self.backward_order = np.array(self.__collect_backward_order(), int)
+        self.backward_levels = self.__collect_backward_levels()
+        self.forward_inputs = np.array([i for i in self.forward_order if hasattr(self.nodes[i], "is_input")], int)
+        self.forward_components = self.__collect_forward_components()
+        self.input_subgraphs = [self.__collect_descendants(self.node_index[node]) for node in self.input_nodes]
+        self.__output_subgraphs: Dict[Tuple[int, ...], 'np.ndarray'] = {}
+
+    def __collect_reachable(self) -> Set['DNNNode']:
+        reachable: Set['DNNNode'] = set(self.input_nodes)
+        frontier = deque(self.input_nodes)
+        while len(frontier) > 0:
+            curr_node = frontier.popleft()
+            if isinstance(curr_node, DNNOutputNode):
+                continue
+            for connection in curr_node.outgoing_connections:
+                if connection.node_out in reachable:
+                    continue
+                reachable.add(connection.node_out)
+                frontier.append(connection.node_out)
+        return reachable
+
+    def __sort_topologically(self, reachable: Set['DNNNode']) -> List['DNNNode']:
+        in_degree: Dict['DNNNode', int] = {node: 0 for node in reachable}
+        for node in reachable:
+            if isinstance(node, DNNOutputNode):
+                continue
+            for connection in node.outgoing_connections:
+                in_degree[connection.node_out] += 1
+
+        ordered: List['DNNNode'] = []
+        ready = deque(node for node in self.input_nodes if in_degree[node] == 0)
+        while len(ready) > 0:
+            curr_node = ready.popleft()
+            ordered.append(curr_node)
+            if isinstance(curr_node, DNNOutputNode):
+                continue
+            for connection in curr_node.outgoing_connections:
+                in_degree[connection.node_out] -= 1
+                if in_degree[connection.node_out] == 0:
+                    ready.append(connection.node_out)
+        if not len(ordered) == len(reachable):
+            raise ValueError("Network graph contains a cycle, no topological schedule exists")
+        return ordered
+
+    def __build_csr(self, endpoints: 'np.ndarray'):
+        order = np.argsort(endpoints, kind="stable")
+        counts = np.bincount(endpoints, minlength=len(self.nodes))
+        offsets = np.zeros(len(self.nodes) + 1, int)
+        np.cumsum(counts, out=offsets[1:])
+        return offsets, order
+
+    def __collect_backward_order(self) -> List[int]:
+        # Only nodes that can reach an output node ever receive error messages.
+        reaches_output = np.zeros(len(self.nodes), bool)
+        for out_node in self.output_nodes:
+            if out_node in self.node_index:
+                reaches_output[self.node_index[out_node]] = True
+        for node_idx in reversed(range(len(self.nodes))):
+            for conn_idx in self.fan_out(node_idx):
+                if reaches_output[self.connection_dst[conn_idx]]:
+                    reaches_output[node_idx] = True
+                    break
+        return [i for i in reversed(range(len(self.nodes)))
+                if reaches_output[i] and not hasattr(self.nodes[i], "is_input")]
+
+    def __collect_forward_components(self) -> List['np.ndarray']:
+        # Internal nodes only exchange data with nodes of their own component, components meet at the input
+        # and output nodes alone. Each component is listed in topological order.
+        is_internal = np.array([not hasattr(node, "is_input") and not isinstance(node, DNNOutputNode)
+                                for node in self.nodes], bool)
+        parent = np.arange(len(self.nodes))
+
+        def find(node_idx: int) -> int:
+            while not parent[node_idx] == node_idx:
+                parent[node_idx] = parent[parent[node_idx]]
+                node_idx = parent[node_idx]
+            return node_idx
+
+        for src, dst in zip(self.connection_src, self.connection_dst):
+            if is_internal[src] and is_internal[dst]:
+                parent[find(dst)] = find(src)
+        components: Dict[int, List[int]] = {}
+        for node_idx in np.flatnonzero(is_internal):
+            components.setdefault(find(node_idx), []).append(node_idx)
+        return [np.array(members, int) for members in sorted(components.values(), key=lambda x: x[0])]
+
+    def __collect_descendants(self, node_idx: int) -> 'np.ndarray':
+        # Every node reachable from node_idx, node_idx included, in topological order
+        reached = np.zeros(len(self.nodes), bool)
+        reached[node_idx] = True
+        for curr_idx in range(node_idx, len(self.nodes)):
+            if reached[curr_idx]:
+                reached[self.connection_dst[self.fan_out(curr_idx)]] = True
+        return np.flatnonzero(reached)
+
+    def __collect_backward_levels(self) -> List['np.ndarray']:
+        # A node's level is its longest distance to an output node. Error only flows from a level to higher
+        # levels, so the nodes of one level never depend on each other.
+        depth = np.full(len(self.nodes), -1, int)
+        for node_idx in self.backward_order:
+            dst_depths = [depth[self.connection_dst[conn_idx]] for conn_idx in self.fan_out(node_idx)]
+            depth[node_idx] = max(dst_depths, default=-1) + 1
+        if len(self.backward_order) == 0:
+            return []
+        order_depths = depth[self.backward_order]
+        return [self.backward_order[order_depths == level] for level in range(np.max(order_depths) + 1)]
+
+    def output_subgraph(self, output_positions: Tuple[int, ...]) -> 'np.ndarray':
+        """
+            Returns every node the output nodes at the given positions depend on, themselves included, in
+            topological order. Computed once per set of positions.
+        """
+        key = tuple(sorted(set(output_positions)))
+        subgraph = self.__output_subgraphs.get(key)
+        if subgraph is not None:
+            return subgraph
+        reached = np.zeros(len(self.nodes), bool)
+        for out_pos in key:
+            out_idx = self.node_index.get(self.output_nodes[out_pos])
+            if out_idx is None:
+                raise ValueError("Output node " + str(out_pos) + " does not receive data from any input node")
+            reached[out_idx] = True
+        for curr_idx in reversed(range(len(self.nodes))):
+            if reached[curr_idx]:
+                reached[self.connection_src[self.fan_in(curr_idx)]] = True
+        subgraph = np.flatnonzero(reached)
+        self.__output_subgraphs[key] = subgraph
+        return subgraph
+
+    def fan_in(self, node_idx: int) -> 'np.ndarray':
+        return self.fan_in_indices[self.fan_in_offsets[node_idx]:self.fan_in_offsets[node_idx + 1]]
+
+    def fan_out(self, node_idx: int) -> 'np.ndarray':
+        return self.fan_out_indices[self.fan_out_offsets[node_idx]:self.fan_out_offsets[node_idx + 1]]
+
+    def is_stale(self) -> bool:
+        """
+            Returns whether connections were added to the plan's nodes since it was compiled. The process wide
+            connection count only tells that some graph changed, this plan's own nodes are then checked.
+        """
+        if self.topology_version == DNNConnection.connections_created:
+            return False
+        for node, num_outgoing in zip(self.nodes, self.__num_outgoing):
+            if not len(node.outgoing_connections) == num_outgoing:
+                return True
+        # Only other graphs changed, so later checks can take the fast path again
+        self.topology_version = DNNConnection.connections_created
+        return False
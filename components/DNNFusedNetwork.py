@@ -0,0 +1,107 @@
+from typing import TYPE_CHECKING, Dict, List, Set, Tuple
+
+import numpy as np
+
+from components.DNNOutputNode import DNNOutputNode
+
+if TYPE_CHECKING:
+    from components.DNNExecutionPlan import DNNExecutionPlan
+    from components.DNNNetwork import DynamicNeuralNetwork
+
+# (source node index, destination node index, weight_a, weight_b), contributing weight_a @ source @ weight_b
+FusedTerm = Tuple[int, int, 'np.ndarray', 'np.ndarray']
+
+
+class DNNFusedNetwork:
+    """
+        An inference only snapshot of a network with internal nodes folded into the connections around them.
+
+        Connections are bilinear and nodes sum their fan-in, so a node v can be removed by replacing every pair
+        of terms u -> v -> w with the single term (A_vw @ A_uv) X (B_uv @ B_vw) from u to w. A node is only
+        removed when that does not increase the number of terms, fan_in * fan_out <= fan_in + fan_out, which
+        always holds along chains. A network of independent chains collapses into a sum of terms per
+        (input, output) pair. Weights are copied when fusing, the snapshot does not follow later training.
+    """
+
+    def __init__(self, network: 'DynamicNeuralNetwork', plan: 'DNNExecutionPlan'):
+        self.network = network
+        self.plan = plan
+        self.__terms: Dict[int, FusedTerm] = {}
+        self.__in_terms: Dict[int, Set[int]] = {i: set() for i in range(len(plan.nodes))}
+        self.__out_terms: Dict[int, Set[int]] = {i: set() for i in range(len(plan.nodes))}
+        self.__next_term = 0
+        for conn_idx, connection in enumerate(plan.connections):
+            self.__add_term(plan.connection_src[conn_idx], plan.connection_dst[conn_idx],
+                            connection.weight_a.copy(), connection.weight_b.copy())
+        self.eliminated_nodes: List[int] = []
+        self.__fuse()
+        self.schedule = self.__build_schedule()
+
+    def __add_term(self, src: int, dst: int, weight_a: 'np.ndarray', weight_b: 'np.ndarray'):
+        term_id = self.__next_term
+        self.__next_term += 1
+        self.__terms[term_id] = (src, dst, weight_a, weight_b)
+        self.__out_terms[src].add(term_id)
+        self.__in_terms[dst].add(term_id)
+
+    def __remove_term(self, term_id: int) -> FusedTerm:
+        term = self.__terms.pop(term_id)
+        self.__out_terms[term[0]].discard(term_id)
+        self.__in_terms[term[1]].discard(term_id)
+        return term
+
+    def __fuse(self):
+        is_internal = [not hasattr(node, "is_input") and not isinstance(node, DNNOutputNode)
+                       for node in self.plan.nodes]
+        changed = True
+        while changed:
+            changed = False
+            for node_idx in range(len(self.plan.nodes)):
+                if not is_internal[node_idx] or node_idx in self.eliminated_nodes:
+                    continue
+                fan_in, fan_out = len(self.__in_terms[node_idx]), len(self.__out_terms[node_idx])
+                if fan_in * fan_out > fan_in + fan_out:
+                    continue
+                in_terms = [self.__remove_term(t) for t in sorted(self.__in_terms[node_idx])]
+                out_terms = [self.__remove_term(t) for t in sorted(self.__out_terms[node_idx])]
+                # A node without fan-out never reaches an output, its terms are simply dropped
+                for src, _, in_a, in_b in in_terms:
+                    for _, dst, out_a, out_b in out_terms:
+                        self.__add_term(src, dst, out_a @ in_a, in_b @ out_b)
+                self.eliminated_nodes.append(node_idx)
+                changed = True
+
+    def __build_schedule(self) -> List[Tuple[int, List[FusedTerm]]]:
+        # Nodes keep their topological numbering, and fused terms only ever point forward in it
+        schedule = []
+        for node_idx in range(len(self.plan.nodes)):
+            if hasattr(self.plan.nodes[node_idx], "is_input") or node_idx in self.eliminated_nodes:
+                continue
+            terms = [self.__terms[t] for t in sorted(self.__in_terms[node_idx])]
+            if len(terms) > 0:
+                schedule.append((node_idx, terms))
+        return schedule
+
+    def __len__(self):
+        return len(self.__terms)
+
+    def run(self, input_data: List['np.ndarray']) -> List['np.ndarray']:
+        """
+            Evaluates the fused network like DNNExecutionContext.run, without touching the network.
+        """
+        self.network.validate_input_data(input_data)
+        values: Dict[int, 'np.ndarray'] = {}
+        for in_node, in_data in zip(self.plan.input_nodes, input_data):
+            values[self.plan.node_index[in_node]] = in_data
+        for node_idx, terms in self.schedule:
+            value = terms[0][2] @ values[terms[0][0]] @ terms[0][3]
+            for src, _, weight_a, weight_b in terms[1:]:
+                value += weight_a @ values[src] @ weight_b
+            values[node_idx] = value
+        outputs = []
+        for out_node in self.plan.output_nodes:
+            out_idx = self.plan.node_index.get(out_node)
+            if out_idx not in values:
+                raise ValueError("Output node does not receive data from any input node")
+            outputs.append(values[out_idx])
+        return outputs
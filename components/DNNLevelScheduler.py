@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, List, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from components.DNNMessage import DNNMessage
+    from components.DNNNode import DNNNode
+
+# A message a node produced for another node, delivered by the scheduler instead of the producing node
+Delivery = Tuple['DNNNode', 'DNNMessage']
+
+
+class DNNLevelScheduler:
+    """
+        Runs a schedule one level at a time, with the tasks of a level running concurrently on a thread pool.
+        A task is identified by an index into the plan, of a node or of a whole component of nodes.
+
+        Tasks of the same level must not depend on each other. Tasks do not deliver messages themselves,
+        they return them and the scheduler delivers them in schedule order once the whole level has finished,
+        so every node receives its messages in the same order no matter the number of workers.
+
+        Given a seed, every task is also handed its own random generator, seeded from the seed and the task's
+        index, so that tasks drawing random numbers do so reproducibly no matter which thread runs them.
+    """
+
+    def __init__(self, num_workers: int):
+        if num_workers < 1:
+            raise ValueError("A level scheduler requires at least one worker")
+        self.num_workers = num_workers
+        self.__executor: 'ThreadPoolExecutor' = None
+
+    def run(self, levels: List['np.ndarray'], task: Callable[..., List[Delivery]], seed: int = None):
+        """
+            Runs task(task_idx) for every task of every level, or task(task_idx, rng) if seed is given.
+        """
+        if seed is not None:
+            seeded_task = task
+
+            def task(task_idx: int) -> List[Delivery]:
+                return seeded_task(task_idx, np.random.default_rng([seed, int(task_idx)]))
+
+        for level in levels:
+            if self.num_workers == 1 or len(level) == 1:
+                level_deliveries = [task(task_idx) for task_idx in level]
+            else:
+                level_deliveries = list(self.__get_executor().map(task, level))
+            for deliveries in level_deliveries:
+                for node, msg in deliveries:
+                    node.receive_incoming_message(msg)
+
+    def __get_executor(self) -> 'ThreadPoolExecutor':
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(self.num_workers, thread_name_prefix="dnn-level")
+        return self.__executor
+
+    def __getstate__(self):
+        # The thread pool is neither copied nor pickled, it is recreated on first use
+        return {"num_workers": self.num_workers}
+
+    def __setstate__(self, state):
+        self.__init__(state["num_workers"])
+
+    def shutdown(self):
+        if self.__executor is not None:
+            self.__executor.shutdown()
+            self.__executor = None
@@ -13,17 +13,21 @@ if TYPE_CHECKING:
 
 class DNNMessage:
 
-    def __init__(self, message_contents: "np.ndarray"):
+    def __init__(self, message_contents: "np.ndarray", track_history: bool = True):
         self.contents = message_contents
-        self.message_history = DNNMessageHistory()
+        # Messages sent while an activation tape records the pass carry no history of their own
+        self.message_history = DNNMessageHistory() if track_history else None
 
     def __copy__(self):
-        ret = DNNMessage(self.contents.copy())
-        ret.message_history = copy(self.message_history)
+        ret = DNNMessage(self.contents.copy(), self.message_history is not None)
+        if self.message_history is not None:
+            ret.message_history = copy(self.message_history)
         return ret
 
     def add_history(self, history: "DNNMessageHistory"):
-        self.message_history.add_history(history)
+        if self.message_history is not None:
+            self.message_history.add_history(history)
 
     def add_to_history(self, connection: Tuple["DNNConnection", "ndarray", "ndarray"]):
-        self.message_history.add_to_history(connection)
+        if self.message_history is not None:
+            self.message_history.add_to_history(connection)
@@ -1,22 +1,43 @@
+from contextlib import contextmanager
 from random import randint
-from typing import List, Tuple, Set
+from typing import Dict, List, Tuple
 
+from numpy import arange
 from numpy import array_equiv
 from numpy import ndarray
+from numpy import subtract
+from numpy.random import Generator, default_rng
 
 from components import default_dnn_max_chain_depth, default_dnn_chains, \
     default_dnn_input_node_connectivity, default_dnn_output_node_connectivity, \
-    dnn_shape_max_cols, dnn_shape_max_rows, dnn_shape_min_cols, dnn_shape_min_rows
+    dnn_shape_max_cols, dnn_shape_max_rows, dnn_shape_min_cols, dnn_shape_min_rows, default_backprop_workers, \
+    default_forward_workers
+from components.DNNActivationTape import DNNActivationTape
+from components.DNNBufferPool import DNNBufferPool
+from components.DNNExecutionContext import DNNExecutionContext
+from components.DNNExecutionPlan import DNNExecutionPlan
+from components.DNNFusedNetwork import DNNFusedNetwork
 from components.DNNInputNode import DNNInputNode
+from components.DNNLevelScheduler import DNNLevelScheduler, Delivery
 from components.DNNNode import DNNNode
 from components.DNNOutputNode import DNNOutputNode
+from components.DNNWeightArena import DNNWeightArena
 
 
 class DynamicNeuralNetwork:
 
     def __init__(self, input_shapes: List[Tuple[int, int]], output_shapes: List[Tuple[int, int]],
                  num_chains: int = None, max_chain_depth: int = None, input_node_connectivity: float = None,
-                 output_node_connectivity: float = None):
+                 output_node_connectivity: float = None, backprop_workers: int = None, forward_workers: int = None):
+        self.__initialize(input_shapes, output_shapes, num_chains, max_chain_depth, input_node_connectivity,
+                          output_node_connectivity, backprop_workers, forward_workers)
+        self.__construct_network()
+        # Numbers every connection, so that replicas of this network agree on connection ids
+        self.compile_execution_plan()
+
+    def __initialize(self, input_shapes: List[Tuple[int, int]], output_shapes: List[Tuple[int, int]],
+                     num_chains: int, max_chain_depth: int, input_node_connectivity: float,
+                     output_node_connectivity: float, backprop_workers: int, forward_workers: int):
         self.input_shapes = input_shapes
         self.output_shapes = output_shapes
         self.num_inputs = len(input_shapes)
@@ -36,8 +57,63 @@ class DynamicNeuralNetwork:
         self.input_nodes: List['DNNInputNode'] = []
         self.output_nodes: List['DNNOutputNode'] = []
         self.active_nodes: List['DNNNode'] = []
-        self.active_nodes_set: Set['DNNNode'] = set()
-        self.__construct_network()
+        self.batch_size: int = None
+        # When set, forward passes keep nothing for backpropagation
+        self.inference_only = False
+        self.__execution_plan: 'DNNExecutionPlan' = None
+        self.__activation_tape: 'DNNActivationTape' = None
+        self.__weight_arena: 'DNNWeightArena' = None
+        self.use_buffer_pool = False
+        self.__buffer_pool: 'DNNBufferPool' = None
+        # Per input node, its contribution to every output node, as kept by propagate_changed_inputs
+        self.__input_contributions: List[List['ndarray']] = None
+        self.__contribution_batch_size: int = None
+        # Used by the network's own stateless evaluations, recreated whenever the topology changes
+        self.__context: 'DNNExecutionContext' = None
+        self.__next_connection_id = 0
+        # Seeds the generators backpropagation hands each node, see seed_backpropagation
+        self.__backprop_rng = default_rng()
+        self.__backprop_scheduler = DNNLevelScheduler(backprop_workers
+                                                      if backprop_workers is not None
+                                                      else default_backprop_workers)
+        self.__forward_scheduler = DNNLevelScheduler(forward_workers
+                                                     if forward_workers is not None
+                                                     else default_forward_workers)
+
+    @classmethod
+    def from_topology(cls, input_shapes: List[Tuple[int, int]], output_shapes: List[Tuple[int, int]],
+                      node_shapes: List[Tuple[int, int]], input_indices: List[int], output_indices: List[int],
+                      connections: List[Tuple[int, int, int]], num_chains: int = None, max_chain_depth: int = None,
+                      input_node_connectivity: float = None, output_node_connectivity: float = None,
+                      backprop_workers: int = None, forward_workers: int = None) -> 'DynamicNeuralNetwork':
+        """
+            Builds a network with the given graph instead of a random one. node_shapes lists every node,
+            input_indices and output_indices give the node standing at each input and output position, and each
+            connection is a (source node, destination node, connection id) triple. Connections are formed in the
+            order given, with freshly drawn weights. The remaining arguments are as for the constructor.
+        """
+        network = cls.__new__(cls)
+        network.__initialize(input_shapes, output_shapes, num_chains, max_chain_depth, input_node_connectivity,
+                             output_node_connectivity, backprop_workers, forward_workers)
+        input_positions = {node_idx: pos for pos, node_idx in enumerate(input_indices)}
+        output_positions = {node_idx: pos for pos, node_idx in enumerate(output_indices)}
+        nodes: List['DNNNode'] = []
+        for node_idx, shape in enumerate(node_shapes):
+            if node_idx in input_positions:
+                nodes.append(DNNInputNode(tuple(shape)))
+            elif node_idx in output_positions:
+                nodes.append(DNNOutputNode(tuple(shape)))
+            else:
+                nodes.append(DNNNode(tuple(shape)))
+        network.input_nodes = [nodes[node_idx] for node_idx in input_indices]
+        network.output_nodes = [nodes[node_idx] for node_idx in output_indices]
+        for src_idx, dst_idx, connection_id in connections:
+            if not nodes[src_idx].add_outgoing_connection(nodes[dst_idx]):
+                raise ValueError("Topology holds connection " + str(connection_id) + " more than once")
+            nodes[src_idx].outgoing_connections[-1].connection_id = connection_id
+            network.__next_connection_id = max(network.__next_connection_id, connection_id + 1)
+        network.compile_execution_plan()
+        return network
 
     @staticmethod
     def __generate_random_shape() -> Tuple[int, int]:
@@ -132,95 +208,328 @@ class DynamicNeuralNetwork:
                 rand_a_node.add_outgoing_connection(output_node)
 
     def add_input_data(self, input_data: List['ndarray']):
+        """
+            Loads one sample per input node. Each entry is either a single (rows, cols) matrix, or a stack of
+            shape (batch, rows, cols) to push a whole minibatch through the network at once. All inputs
+            must agree on whether they are batched, and on the batch size.
+        """
+        try:
+            batch_size = self.validate_input_data(input_data)
+        except ValueError:
+            self.active_nodes.clear()
+            raise
+        if self.use_buffer_pool:
+            self.buffer_pool().begin_pass(batch_size)
+        for in_node, in_data in zip(self.input_nodes, input_data):
+            in_node.add_input_data(in_data)
+            self.active_nodes.append(in_node)
+        self.batch_size = batch_size
+
+    def validate_input_data(self, input_data: List['ndarray']) -> int:
+        """
+            Checks input_data against the input nodes without loading it, returning its batch size
+            (None if unbatched).
+        """
         if not len(input_data) == self.num_inputs:
             raise ValueError("Incorrect number of inputs supplied to network. Expected " +
                              str(self.num_inputs) + " but received " +
                              str(len(input_data))
                              )
+        batch_size = input_data[0].shape[0] if input_data[0].ndim == 3 else None
         for i in range(self.num_inputs):
-            in_data = input_data[i]
-            in_node = self.input_nodes[i]
-            if not array_equiv(in_data.shape, in_node.internal_shape):
-                self.active_nodes.clear()
-                raise ValueError("Incorrect shape in position " + str(i) +
-                                 " expected (" + str(in_node.internal_shape[0]) +
-                                 ", " + str(in_node.internal_shape[1]) + ") but " +
-                                 "received (" + str(in_data.shape[0]) + ', ' +
-                                 str(in_data.shape[1]) + ")"
+            in_batch_size = self.validate_input(i, input_data[i])
+            if not in_batch_size == batch_size:
+                raise ValueError("Inconsistent batch size in position " + str(i) +
+                                 " expected " + str(batch_size) + " but received " + str(in_batch_size)
                                  )
-            in_node.add_input_data(in_data)
-            self.active_nodes.append(in_node)
-            self.active_nodes_set.add(in_node)
+        return batch_size
+
+    def validate_input(self, position: int, in_data: 'ndarray') -> int:
+        """
+            Checks the data for a single input node, returning its batch size (None if unbatched).
+        """
+        in_node = self.input_nodes[position]
+        if in_data.ndim not in (2, 3) or not array_equiv(in_data.shape[-2:], in_node.internal_shape):
+            raise ValueError("Incorrect shape in position " + str(position) +
+                             " expected (" + str(in_node.internal_shape[0]) +
+                             ", " + str(in_node.internal_shape[1]) + ") but " +
+                             "received " + str(in_data.shape)
+                             )
+        return in_data.shape[0] if in_data.ndim == 3 else None
 
     def extract_output_data(self):
+        """
+            Returns one matrix per output node, stacked as (batch, rows, cols) if the inputs were batched.
+        """
         ret_outputs: List['ndarray'] = []
         for out_node in self.output_nodes:
             ret_outputs.append(out_node.extract_output())
         return ret_outputs
 
+    def compile_execution_plan(self) -> 'DNNExecutionPlan':
+        """
+            Returns the topological schedule used by every pass, recompiling it only if connections
+            have been added since it was last compiled.
+        """
+        if self.__execution_plan is None or self.__execution_plan.is_stale() \
+                or not self.__execution_plan.input_nodes == self.input_nodes \
+                or not self.__execution_plan.output_nodes == self.output_nodes:
+            self.__execution_plan = DNNExecutionPlan(self.input_nodes, self.output_nodes)
+            for connection in self.__execution_plan.connections:
+                if connection.connection_id is None:
+                    connection.connection_id = self.__next_connection_id
+                    self.__next_connection_id += 1
+            self.__activation_tape = DNNActivationTape(self.__execution_plan)
+            # Connections of the previous arena keep their views, the new arena copies their values over
+            self.__weight_arena = DNNWeightArena(self.__execution_plan.connections)
+            if self.__buffer_pool is not None:
+                self.__buffer_pool.release()
+                self.__buffer_pool = None
+        return self.__execution_plan
+
+    def weight_arena(self) -> 'DNNWeightArena':
+        """
+            Returns the contiguous buffer holding the weights and weight changes of every connection in the plan.
+        """
+        self.compile_execution_plan()
+        self.__weight_arena.ensure_bound()
+        return self.__weight_arena
+
+    def bind_weight_arena(self, buffer: 'ndarray') -> 'DNNWeightArena':
+        """
+            Moves the weights and weight changes of every connection in the plan into buffer, which must hold
+            weight_arena().size elements.
+        """
+        self.compile_execution_plan()
+        self.__weight_arena = DNNWeightArena(self.__execution_plan.connections, buffer)
+        return self.__weight_arena
+
+    def view_weights(self, weights: 'ndarray') -> 'DNNWeightArena':
+        """
+            Points the weights of every connection in the plan into weights, which must hold
+            weight_arena().num_weights elements in arena layout, without copying them. Read-only weights leave
+            the network usable for inference only.
+        """
+        self.compile_execution_plan()
+        self.__weight_arena = DNNWeightArena(self.__execution_plan.connections, weights=weights)
+        for connection in self.__execution_plan.connections:
+            connection.invalidate_factorizations()
+        self.invalidate_input_contributions()
+        return self.__weight_arena
+
+    def buffer_pool(self) -> 'DNNBufferPool':
+        """
+            Returns the buffer pool of the current execution plan, creating it if needed.
+        """
+        self.compile_execution_plan()
+        if self.__buffer_pool is None:
+            self.__buffer_pool = DNNBufferPool(self.__execution_plan)
+        return self.__buffer_pool
+
+    def enable_buffer_pool(self, enabled: bool = True):
+        """
+            In buffer pool mode nodes and connections write every pass into preallocated arrays, see
+            DNNBufferPool. Arrays returned by extract_output_data are then overwritten by the next pass.
+        """
+        self.use_buffer_pool = enabled
+        if not enabled and self.__buffer_pool is not None:
+            self.__buffer_pool.release()
+            self.__buffer_pool = None
+
+    def activation_tape(self) -> 'DNNActivationTape':
+        """
+            Returns the tape holding the activations recorded by the last forward pass.
+        """
+        self.compile_execution_plan()
+        return self.__activation_tape
+
+    def create_execution_context(self) -> 'DNNExecutionContext':
+        """
+            Returns a new context for running inference against this network without touching its nodes.
+            Contexts share the network's weights, so any number of them may run concurrently on different
+            threads as long as the network is not trained or modified meanwhile.
+        """
+        return DNNExecutionContext(self, self.compile_execution_plan())
+
+    def propagate_changed_inputs(self, changed_inputs: Dict[int, 'ndarray']) -> List['ndarray']:
+        """
+            Returns the outputs for the latest data of every input node, given only the inputs that changed
+            since the previous call, keyed by input position.
+
+            The network is linear, so each output is the sum of the contributions of every input. The
+            contribution of each input to each output is kept, and only the subgraphs of changed inputs are
+            evaluated again. The first call, any call changing the batch size and the first call after
+            update_weights or a topology change require every input.
+        """
+        batch_sizes = {position: self.validate_input(position, in_data)
+                       for position, in_data in changed_inputs.items()}
+        if len(set(batch_sizes.values())) > 1:
+            raise ValueError("Inconsistent batch sizes among changed inputs")
+        batch_size = next(iter(batch_sizes.values()), self.__contribution_batch_size)
+        if self.__context is not None and self.__context.plan is not self.compile_execution_plan():
+            self.invalidate_input_contributions()
+        if self.__input_contributions is None or not batch_size == self.__contribution_batch_size:
+            if not len(changed_inputs) == self.num_inputs:
+                raise ValueError("No contributions are cached for this batch size, every input is required")
+            self.__input_contributions = [None] * self.num_inputs
+            self.__contribution_batch_size = batch_size
+
+        context = self.__get_context()
+        for position, in_data in changed_inputs.items():
+            self.__input_contributions[position] = context.run_contribution(position, in_data)
+        outputs: List['ndarray'] = []
+        for out_pos in range(self.num_outputs):
+            contributions = [c[out_pos] for c in self.__input_contributions if c[out_pos] is not None]
+            if len(contributions) == 0:
+                raise ValueError("Output node does not receive data from any input node")
+            total = contributions[0].copy()
+            for contribution in contributions[1:]:
+                total += contribution
+            outputs.append(total)
+        return outputs
+
+    def invalidate_input_contributions(self):
+        self.__input_contributions = None
+
+    def evaluate_outputs(self, input_data: List['ndarray'], output_positions: List[int]) -> List['ndarray']:
+        """
+            Returns the results of only the output nodes at output_positions, evaluating nothing but the nodes
+            they depend on. The subgraph is computed once per set of outputs and kept on the execution plan.
+        """
+        for out_pos in output_positions:
+            if not 0 <= out_pos < self.num_outputs:
+                raise ValueError("No output node at position " + str(out_pos))
+        return self.__get_context().run_outputs(input_data, output_positions)
+
+    def __get_context(self) -> 'DNNExecutionContext':
+        if self.__context is None or self.__context.plan is not self.compile_execution_plan():
+            self.__context = self.create_execution_context()
+        return self.__context
+
+    def fuse_for_inference(self) -> 'DNNFusedNetwork':
+        """
+            Returns an inference only snapshot of the network's current weights with its chains folded into
+            single terms, see DNNFusedNetwork. It must be fused again after training.
+        """
+        return DNNFusedNetwork(self, self.compile_execution_plan())
+
+    @contextmanager
+    def inference_mode(self):
+        """
+            Context manager under which forward passes neither record activations nor build message
+            history, for serving with add_input_data, propagate_inputs and extract_output_data.
+        """
+        previous = self.inference_only
+        self.inference_only = True
+        try:
+            yield self
+        finally:
+            self.inference_only = previous
+
     def propagate_inputs(self):
-        while not len(self.active_nodes) == 0:
-            curr_node = self.active_nodes.pop(0)
-            self.active_nodes_set.remove(curr_node)
-            curr_node.transmit_data()
-            for connection in curr_node.outgoing_connections:
-                if not isinstance(connection.node_out, DNNOutputNode):
-                    if connection.node_out in self.active_nodes_set:
-                        continue
-                    self.active_nodes.append(connection.node_out)
-                    self.active_nodes_set.add(connection.node_out)
+        if len(self.active_nodes) == 0:
+            return
+        plan = self.compile_execution_plan()
+        tape = None
+        if not self.inference_only:
+            tape = self.activation_tape()
+            tape.begin_pass(self.batch_size)
+        # Output nodes keep their combined buffer after extraction, drop the one left by the previous pass
+        for out_node in self.output_nodes:
+            out_node.outgoing_buffer = None
+        for node_idx in plan.forward_inputs:
+            plan.nodes[node_idx].transmit_data(tape, False)
+
+        def transmit_component(component_idx: int) -> List['Delivery']:
+            # Messages within the component are delivered right away, only this task touches its nodes.
+            # Messages to output nodes are left to the scheduler, since every component may feed them
+            outgoing: List['Delivery'] = []
+            component = plan.forward_components[component_idx]
+            for node_idx in component:
+                deliveries: List['Delivery'] = []
+                plan.nodes[node_idx].transmit_data(tape, False, deliveries)
+                for node, msg in deliveries:
+                    if isinstance(node, DNNOutputNode):
+                        outgoing.append((node, msg))
+                    else:
+                        node.receive_incoming_message(msg)
+            return outgoing
+
+        self.__forward_scheduler.run([arange(len(plan.forward_components))], transmit_component)
+        self.active_nodes.clear()
 
     def perform_backpropagation(self, input_data: List['ndarray'], expected_outputs: List['ndarray']):
+        self.compute_weight_changes(input_data, expected_outputs)
+        self.update_weights()
+
+    def compute_weight_changes(self, input_data: List['ndarray'], expected_outputs: List['ndarray']):
+        """
+            Runs the forward and backward pass of perform_backpropagation, accumulating into the connections'
+            weight changes without applying them.
+        """
+        if self.inference_only:
+            raise ValueError("Cannot perform backpropagation while the network is in inference mode")
         self.add_input_data(input_data)
         self.propagate_inputs()
         outputs = self.extract_output_data()
-        differences = [expected_outputs[i] - outputs[i] for i in range(len(expected_outputs))]
         self.clear_incoming_messages()
 
-        for i in range(len(differences)):
-            self.output_nodes[i].outgoing_buffer.contents = differences[i]
+        for i in range(len(expected_outputs)):
+            # The output is not needed past this point, the error overwrites it in place
+            subtract(expected_outputs[i], outputs[i], out=outputs[i])
             self.output_nodes[i].receive_incoming_message(self.output_nodes[i].outgoing_buffer)
             self.output_nodes[i].outgoing_buffer = None
-            self.active_nodes.append(self.output_nodes[i])
-            self.active_nodes_set.add(self.active_nodes[-1])
-        while not len(self.active_nodes) == 0:
-            curr_node = self.active_nodes.pop(0)
-            self.active_nodes_set.remove(curr_node)
-            curr_node.transmit_error()
-            for connection in curr_node.incoming_connections:
-                if not isinstance(connection.node_in, DNNInputNode):
-                    if connection.node_in in self.active_nodes_set:
-                        continue
-                    self.active_nodes.append(connection.node_in)
-                    self.active_nodes_set.add(connection.node_in)
+        plan = self.compile_execution_plan()
+        tape = self.activation_tape()
+
+        def transmit_node_error(node_idx: int, rng: 'Generator') -> List['Delivery']:
+            deliveries: List['Delivery'] = []
+            plan.nodes[node_idx].transmit_error(tape, deliveries, rng)
+            return deliveries
+
+        # Each connection only accumulates into its own weight changes, and errors sent backwards are
+        # delivered by the scheduler once a level is done, so the nodes of a level can run concurrently.
+        # Every node draws its free variables from its own generator, so results do not depend on threading
+        self.__backprop_scheduler.run(plan.backward_levels, transmit_node_error,
+                                      int(self.__backprop_rng.integers(1 << 63)))
         self.clear_incoming_messages()
-        self.update_weights()
-        pass
+
+    def seed_backpropagation(self, seed: int):
+        """
+            Makes the free variables chosen for rank deficient systems during backpropagation reproducible,
+            with the same results for any number of backprop workers.
+        """
+        self.__backprop_rng = default_rng(seed)
+
+    def set_backprop_workers(self, num_workers: int):
+        """
+            Sets the number of threads backpropagation runs the nodes of each level on.
+        """
+        self.__backprop_scheduler.shutdown()
+        self.__backprop_scheduler = DNNLevelScheduler(num_workers)
+
+    def set_forward_workers(self, num_workers: int):
+        """
+            Sets the number of threads the independent chains of a forward pass are evaluated on.
+        """
+        self.__forward_scheduler.shutdown()
+        self.__forward_scheduler = DNNLevelScheduler(num_workers)
+
+    def shutdown_workers(self):
+        self.__backprop_scheduler.shutdown()
+        self.__forward_scheduler.shutdown()
 
     def clear_incoming_messages(self):
-        for in_node in self.input_nodes:
-            self.active_nodes.append(in_node)
-            self.active_nodes_set.add(in_node)
-        while len(self.active_nodes) > 0:
-            curr_node = self.active_nodes.pop(0)
-            self.active_nodes_set.remove(curr_node)
-            curr_node.incoming_messages.clear()
-            for connection in curr_node.outgoing_connections:
-                if connection.node_out in self.active_nodes_set:
-                    continue
-                self.active_nodes.append(connection.node_out)
-                self.active_nodes_set.add(connection.node_out)
+        for node in self.compile_execution_plan().nodes:
+            node.incoming_messages.clear()
 
     def update_weights(self):
-        for in_node in self.input_nodes:
-            self.active_nodes.append(in_node)
-            self.active_nodes_set.add(in_node)
-        while len(self.active_nodes) > 0:
-            curr_node = self.active_nodes.pop(0)
-            self.active_nodes_set.remove(curr_node)
-            for connection in curr_node.outgoing_connections:
-                connection.update_weights()
-                if connection.node_out in self.active_nodes_set:
-                    continue
-                self.active_nodes.append(connection.node_out)
-                self.active_nodes_set.add(connection.node_out)
+        self.weight_arena().apply_updates()
+        self.invalidate_input_contributions()
+
+    def restore_weights(self, weights: 'ndarray'):
+        """
+            Overwrites every weight with weights, held in arena layout as from weight_arena().snapshot().
+        """
+        self.weight_arena().restore(weights)
+        self.invalidate_input_contributions()
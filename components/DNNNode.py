@@ -1,4 +1,4 @@
-from typing import Tuple, List
+from typing import TYPE_CHECKING, Tuple, List
 
 import numpy as np
 
@@ -6,6 +6,10 @@ from components.DNNMessage import DNNMessage
 from components.DNNMessageHistory import DNNMessageHistory
 from components.DNNNodeConnection import DNNConnection
 
+if TYPE_CHECKING:
+    from components.DNNActivationTape import DNNActivationTape
+    from components.DNNLevelScheduler import Delivery
+
 
 class TransmissionError(ValueError):
     def __init__(self, message):
@@ -20,6 +24,8 @@ class DNNNode:
         self.internal_shape = internal_shape
         self.outgoing_buffer: 'DNNMessage' = None
         self.incoming_messages: List['DNNMessage'] = []
+        # Set by a DNNBufferPool, reused for the combined input on every pass while the pool is active
+        self.pooled_message: 'DNNMessage' = None
         self.__connected_nodes_out = set()
 
     def add_outgoing_connection(self, node_to_connect: "DNNNode") -> bool:
@@ -34,32 +40,46 @@ class DNNNode:
     def receive_incoming_message(self, msg):
         self.incoming_messages.append(msg)
 
-    def combine_incoming_messages(self):
-        self.outgoing_buffer = DNNMessage(np.zeros(self.internal_shape))
+    def combine_incoming_messages(self, track_history: bool = True):
+        pooled = self.pooled_message
+        first_shape = self.incoming_messages[0].contents.shape
+        if not track_history and pooled is not None and pooled.contents.shape == first_shape:
+            np.copyto(pooled.contents, self.incoming_messages[0].contents)
+            for msg_in in self.incoming_messages[1:]:
+                pooled.contents += msg_in.contents
+            self.outgoing_buffer = pooled
+            return
+        # Batched messages carry a leading batch axis, so the buffer takes its shape from the messages
+        self.outgoing_buffer = DNNMessage(np.zeros(first_shape), track_history)
         for msg_in in self.incoming_messages:
             self.outgoing_buffer.contents += msg_in.contents
             self.outgoing_buffer.add_history(msg_in.message_history)
 
-    def transmit_data(self):
+    def transmit_data(self, tape: "DNNActivationTape" = None, track_history: bool = True,
+                      deliveries: List["Delivery"] = None):
         if self.outgoing_buffer is None and len(self.incoming_messages) == 0:
             raise ValueError("Cannot transmit data, no data ready for transmittal")
         elif self.outgoing_buffer is None:
-            self.combine_incoming_messages()
+            self.combine_incoming_messages(tape is None and track_history)
         for out_connection in self.outgoing_connections:
-            out_connection.perform_transmit()
+            out_connection.perform_transmit(tape, track_history, deliveries)
         self.incoming_messages.clear()
         self.outgoing_buffer = None
 
-    def transmit_error(self):
+    def transmit_error(self, tape: "DNNActivationTape" = None, deliveries: List["Delivery"] = None,
+                       rng: "np.random.Generator" = None):
         if len(self.incoming_messages) == 0:
             raise TransmissionError("Cannot transmit error, no errors ready for transmittal")
+        if tape is not None:
+            self.__transmit_taped_error(tape, deliveries, rng)
+            return
         for msg in self.incoming_messages:
             msg_history = msg.message_history
             last_entry = msg_history.last()
             if last_entry is None:
                 raise ValueError("Message's history was empty, this should not happen")
             elif isinstance(last_entry, tuple):
-                last_entry[0].perform_err_transmit(msg)
+                last_entry[0].perform_err_transmit(msg, rng=rng)
             elif isinstance(last_entry, list):
                 err_contents = msg.contents / len(last_entry)
                 for hist in last_entry:
@@ -67,8 +87,21 @@ class DNNNode:
                     err_msg = DNNMessage(err_contents.copy())
                     err_msg.message_history = hist
                     last_connection: "DNNConnection" = hist.last()[0]
-                    last_connection.perform_err_transmit(err_msg)
+                    last_connection.perform_err_transmit(err_msg, rng=rng)
             else:
                 raise ValueError("Unrecognized entry in message history " + str(last_entry))
         self.incoming_messages.clear()
         self.outgoing_buffer = None
+
+    def __transmit_taped_error(self, tape: "DNNActivationTape", deliveries: List["Delivery"] = None,
+                               rng: "np.random.Generator" = None):
+        # Each error is split evenly over the connections that delivered data to this node during the pass
+        recorded_connections = [c for c in self.incoming_connections if tape.contains(c)]
+        if len(recorded_connections) == 0:
+            raise TransmissionError("Cannot transmit error, no incoming connection was recorded on the tape")
+        for msg in self.incoming_messages:
+            err_contents = msg.contents / len(recorded_connections)
+            for connection in recorded_connections:
+                connection.perform_err_transmit(DNNMessage(err_contents, False), tape, deliveries, rng)
+        self.incoming_messages.clear()
+        self.outgoing_buffer = None
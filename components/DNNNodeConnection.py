@@ -1,31 +1,72 @@
 from copy import copy
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, List
 
 import numpy as np
 from numpy.random import uniform
 
 import matrix.MatrixMultiplicationSolver as mms
+from components import default_factorization_cache_size
+from components.DNNMessage import DNNMessage
+from matrix.FactorizationCache import FactorizationCache
 
 if TYPE_CHECKING:
+    from components.DNNActivationTape import DNNActivationTape
+    from components.DNNLevelScheduler import Delivery
     from components.DNNNode import DNNNode
-    from components.DNNMessage import DNNMessage
+
+# Shared by every connection, weight_a and weight_b.T only change in update_weights. Connections own their
+# entries, which are dropped along with discarded connections
+factorization_cache = FactorizationCache(default_factorization_cache_size)
 
 
 class DNNConnection:
+    # Incremented for every connection formed, execution plans check it before comparing their own nodes
+    connections_created = 0
 
     def __init__(self, node_in: "DNNNode", node_out: "DNNNode"):
+        DNNConnection.connections_created += 1
         self.node_in = node_in
         self.node_out = node_out
+        # Stable across replicas of a network, assigned by the network once it compiles a plan holding this connection
+        self.connection_id: int = None
         self.weight_a = uniform(-1, 1, (node_out.internal_shape[0], node_in.internal_shape[0]))
         self.weight_b = uniform(-1, 1, (node_in.internal_shape[1], node_out.internal_shape[1]))
         self.change_weight_a = np.zeros(self.weight_a.shape, float)
         self.change_weight_b = np.zeros(self.weight_b.shape, float)
         # Temporary, in a full system this would be modified to pass more or less error back
         self.weight_change_ratio = .5
-
-    def perform_transmit(self):
+        # Set by a DNNBufferPool, reused for this connection's output on every pass while the pool is active
+        self.pooled_message: 'DNNMessage' = None
+        self.pooled_row_res: 'np.ndarray' = None
+
+    def perform_transmit(self, tape: "DNNActivationTape" = None, track_history: bool = True,
+                         deliveries: List["Delivery"] = None):
+        """
+            Sends node_in's data to node_out. If deliveries is given, the message is appended to it for the
+            caller to deliver instead, which is only supported without message history.
+        """
         if self.node_in.outgoing_buffer is None:
             raise ValueError("Cannot transmit data, incoming node did not contain data to transmit")
+        if tape is None and not track_history:
+            # Inference only, nothing is kept for backpropagation so the input is neither copied nor recorded
+            contents = self.node_in.outgoing_buffer.contents
+            if self.__is_pooled(contents):
+                np.matmul(self.weight_a, contents, out=self.pooled_row_res)
+                self.__send(self.__pooled_result(self.pooled_row_res), deliveries)
+            else:
+                self.__send(DNNMessage(self.weight_a @ contents @ self.weight_b, False), deliveries)
+            return
+        if tape is not None:
+            # Record the activations into this connection's tape slot instead of copying message history
+            contents = self.node_in.outgoing_buffer.contents
+            original_input, row_res = tape.slot(self)
+            np.copyto(original_input, contents)
+            np.matmul(self.weight_a, contents, out=row_res)
+            if self.__is_pooled(contents):
+                self.__send(self.__pooled_result(row_res), deliveries)
+            else:
+                self.__send(DNNMessage(row_res @ self.weight_b, False), deliveries)
+            return
         trans_msg = copy(self.node_in.outgoing_buffer)
         original_input = trans_msg.contents.copy()
         row_res = self.weight_a @ trans_msg.contents
@@ -33,22 +74,55 @@ class DNNConnection:
         trans_msg.message_history.add_to_history((self, original_input, row_res))
         self.node_out.receive_incoming_message(trans_msg)
 
-    def perform_err_transmit(self, err_msg: "DNNMessage"):
+    def __is_pooled(self, contents: 'np.ndarray') -> bool:
+        return self.pooled_row_res is not None and contents.shape[:-2] == self.pooled_row_res.shape[:-2]
+
+    def __pooled_result(self, row_res: 'np.ndarray') -> 'DNNMessage':
+        np.matmul(row_res, self.weight_b, out=self.pooled_message.contents)
+        return self.pooled_message
+
+    def __send(self, msg: "DNNMessage", deliveries: List["Delivery"] = None):
+        if deliveries is not None:
+            deliveries.append((self.node_out, msg))
+        else:
+            self.node_out.receive_incoming_message(msg)
+
+    def perform_err_transmit(self, err_msg: "DNNMessage", tape: "DNNActivationTape" = None,
+                             deliveries: List["Delivery"] = None, rng: "np.random.Generator" = None):
+        """
+            Accumulates this connection's weight changes and sends the remaining error to node_in.
+            If deliveries is given, the error is appended to it for the caller to deliver instead.
+            Free variables of rank deficient systems are drawn from rng, if given.
+        """
         # Todo explore having nodes deeper in the network send more error backwards
-        connection_history = err_msg.message_history.last()
-        row_res = connection_history[-1]
-        original_input = connection_history[-2]
-
-        err_weight_b = self.weight_change_ratio * err_msg.contents
-        err_row_res = err_msg.contents - err_weight_b
+        if tape is not None:
+            original_input, row_res = tape.lookup(self)
+        else:
+            connection_history = err_msg.message_history.last()
+            row_res = connection_history[-1]
+            original_input = connection_history[-2]
+
+        # Unbatched messages are treated as a batch of one, weight changes are accumulated over the batch
+        is_batched = err_msg.contents.ndim == 3
+        err_contents = err_msg.contents if is_batched else err_msg.contents[np.newaxis]
+        if not is_batched:
+            row_res = row_res[np.newaxis]
+            original_input = original_input[np.newaxis]
+
+        err_weight_b = self.weight_change_ratio * err_contents
+        err_row_res = err_contents - err_weight_b
 
         # Calculate needed change in weight_b (half of err_msg.contents)
         # weight_b is on the right hand side, no transposition needed
-        d_weight_b = mms.solveEquation(row_res, err_weight_b)
+        # every sample has its own row_res, so the systems are independent and solved as one stack
+        d_weight_b = mms.solveEquationBatch(row_res, err_weight_b, rng).sum(axis=0)
 
         # Calculate needed change to row_res (half of err_msg.contents)
         # row_res on left hand side, transposition is required
-        d_row_res = mms.solveEquation(self.weight_b.T, err_row_res.T).T
+        weight_b_factorization = factorization_cache.get("weight_b.T", self.weight_b.T, self)
+        d_row_res = mms.solveEquationShared(self.weight_b.T, err_row_res.transpose(0, 2, 1),
+                                            known_factorization=weight_b_factorization,
+                                            rng=rng).transpose(0, 2, 1)
 
         # needed change to row_res is the required change to weight_a and the original input
 
@@ -59,17 +133,24 @@ class DNNConnection:
 
         # Calculate needed change in weight_a (either row_res (if node_in is InputNode) or half of row_res)
         # weight_a is on the left hand side, transposition is required
-        d_weight_a = mms.solveEquation(original_input.T, err_weight_a.T).T
+        d_weight_a = mms.solveEquationBatch(original_input.transpose(0, 2, 1),
+                                            err_weight_a.transpose(0, 2, 1), rng).sum(axis=0).T
 
         if not is_incoming_input:
             # Calculate needed change in trans_msg.contents (if node_in is InputNode)
             # original_input is on the right hand side, transposition is not required
-            d_original_input = mms.solveEquation(self.weight_a, err_original_input)
+            weight_a_factorization = factorization_cache.get("weight_a", self.weight_a, self)
+            d_original_input = mms.solveEquationShared(self.weight_a, err_original_input,
+                                                       known_factorization=weight_a_factorization, rng=rng)
 
             # Send error backward
-            err_msg.contents = d_original_input
-            err_msg.message_history.contained_history.pop()
-            self.node_in.receive_incoming_message(err_msg)
+            err_msg.contents = d_original_input if is_batched else d_original_input[0]
+            if tape is None:
+                err_msg.message_history.contained_history.pop()
+            if deliveries is not None:
+                deliveries.append((self.node_in, err_msg))
+            else:
+                self.node_in.receive_incoming_message(err_msg)
 
         # Get ready to update weights
         self.change_weight_a += d_weight_a
@@ -78,5 +159,13 @@ class DNNConnection:
     def update_weights(self):
         self.weight_b += self.change_weight_b
         self.weight_a += self.change_weight_a
-        self.change_weight_b = np.zeros(self.weight_b.shape, float)
-        self.change_weight_a = np.zeros(self.weight_a.shape, float)
+        self.invalidate_factorizations()
+        self.change_weight_b.fill(0)
+        self.change_weight_a.fill(0)
+
+    def invalidate_factorizations(self):
+        """
+            Drops the cached factorizations of this connection's weights, must be called whenever they change.
+        """
+        factorization_cache.invalidate("weight_b.T", self)
+        factorization_cache.invalidate("weight_a", self)
@@ -15,5 +15,6 @@ class DNNOutputNode(DNNNode):
         if self.outgoing_buffer is None and len(self.incoming_messages) == 0:
             raise ValueError("Cannot extract data, no data ready for extraction")
         elif self.outgoing_buffer is None:
-            self.combine_incoming_messages()
+            # History is only combined when the messages carry any, as on the message history path
+            self.combine_incoming_messages(self.incoming_messages[0].message_history is not None)
         return self.outgoing_buffer.contents
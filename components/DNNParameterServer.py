@@ -0,0 +1,288 @@
+import json
+import socket
+import socketserver
+import struct
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+import numpy as np
+
+from components import default_parameter_staleness, default_parameter_frame_size
+
+if TYPE_CHECKING:
+    from components.DNNNetwork import DynamicNeuralNetwork
+
+# Per connection id, a (weight_a, weight_b) pair of either weights or weight changes
+ParameterSet = Dict[int, Tuple['np.ndarray', 'np.ndarray']]
+
+request_pull = b"P"
+request_push = b"U"
+frame_header = struct.Struct(">I")
+parameter_header_keys = ("version", "dtype", "compressed", "entries")
+
+
+def encode_parameters(parameters: ParameterSet, version: int, dtype: str = "float64", compress: bool = False) -> bytes:
+    """
+        Packs parameters into a length prefixed json header followed by every array flattened into one buffer,
+        cast to dtype and optionally zlib compressed.
+    """
+    ids = sorted(parameters)
+    entries = [[conn_id] + list(parameters[conn_id][0].shape) + list(parameters[conn_id][1].shape) for conn_id in ids]
+    flat = [array.ravel() for conn_id in ids for array in parameters[conn_id]]
+    body = (np.concatenate(flat) if len(flat) > 0 else np.zeros(0)).astype(dtype).tobytes()
+    if compress:
+        body = zlib.compress(body)
+    header = json.dumps({"version": version, "dtype": dtype, "compressed": compress, "entries": entries})
+    header = header.encode("utf-8")
+    return frame_header.pack(len(header)) + header + body
+
+
+def decode_parameters(payload: bytes) -> Tuple[ParameterSet, int]:
+    """
+        Unpacks parameters packed by encode_parameters, raising ValueError for a payload too short or whose header
+        is incomplete or whose body does not decompress.
+    """
+    if len(payload) < frame_header.size:
+        raise ValueError("Parameter payload of " + str(len(payload)) + " bytes is too short to hold a header")
+    header_len = frame_header.unpack_from(payload)[0]
+    if frame_header.size + header_len > len(payload):
+        raise ValueError("Parameter header runs past the end of its payload")
+    header = json.loads(payload[frame_header.size:frame_header.size + header_len].decode("utf-8"))
+    if not isinstance(header, dict) or not all(key in header for key in parameter_header_keys):
+        raise ValueError("Parameter header lacks one of " + ", ".join(parameter_header_keys))
+    body = payload[frame_header.size + header_len:]
+    if header["compressed"]:
+        try:
+            body = zlib.decompress(body)
+        except zlib.error as e:
+            raise ValueError("Parameter body could not be decompressed: " + str(e)) from e
+    flat = np.frombuffer(body, header["dtype"]).astype(float)
+    parameters: ParameterSet = {}
+    offset = 0
+    for conn_id, rows_a, cols_a, rows_b, cols_b in header["entries"]:
+        weight_a = flat[offset:offset + rows_a * cols_a].reshape(rows_a, cols_a)
+        offset += rows_a * cols_a
+        weight_b = flat[offset:offset + rows_b * cols_b].reshape(rows_b, cols_b)
+        offset += rows_b * cols_b
+        parameters[conn_id] = (weight_a, weight_b)
+    return parameters, header["version"]
+
+
+def network_parameters(network: 'DynamicNeuralNetwork', changes: bool = False) -> ParameterSet:
+    names = ("change_weight_a", "change_weight_b") if changes else ("weight_a", "weight_b")
+    return {c.connection_id: (getattr(c, names[0]), getattr(c, names[1]))
+            for c in network.compile_execution_plan().connections}
+
+
+class DNNParameterServer:
+    """
+        Holds the authoritative weights of a network, keyed by connection id, for workers training replicas.
+
+        Workers push the weight changes they accumulated against the version of the weights they last pulled.
+        A push whose base version lags the current version by more than max_staleness is rejected, the worker
+        must then pull again. Every accepted push is added to the weights and advances the version by one.
+        Over TCP, request frames longer than max_frame_size bytes are refused and their connection closed.
+    """
+
+    def __init__(self, network: 'DynamicNeuralNetwork', max_staleness: int = None, max_frame_size: int = None):
+        self.max_staleness = max_staleness if max_staleness is not None else default_parameter_staleness
+        self.max_frame_size = max_frame_size if max_frame_size is not None else default_parameter_frame_size
+        self.version = 0
+        self.accepted_pushes = 0
+        self.rejected_pushes = 0
+        self.weights: ParameterSet = {conn_id: (weight_a.copy(), weight_b.copy())
+                                      for conn_id, (weight_a, weight_b) in network_parameters(network).items()}
+        self.__lock = threading.Lock()
+        self.__tcp_server: 'socketserver.ThreadingTCPServer' = None
+
+    def pull(self) -> bytes:
+        with self.__lock:
+            return encode_parameters(self.weights, self.version)
+
+    def push(self, payload: bytes) -> bytes:
+        deltas, base_version = decode_parameters(payload)
+        with self.__lock:
+            if self.version - base_version > self.max_staleness:
+                self.rejected_pushes += 1
+                return json.dumps({"accepted": False, "version": self.version}).encode("utf-8")
+            # Checked up front so that a malformed push leaves the weights untouched
+            for conn_id, (delta_a, delta_b) in deltas.items():
+                if conn_id not in self.weights:
+                    raise ValueError("Push holds unknown connection id " + str(conn_id))
+                if not delta_a.shape == self.weights[conn_id][0].shape \
+                        or not delta_b.shape == self.weights[conn_id][1].shape:
+                    raise ValueError("Push holds changes of the wrong shape for connection " + str(conn_id))
+            for conn_id, (delta_a, delta_b) in deltas.items():
+                self.weights[conn_id][0][...] += delta_a
+                self.weights[conn_id][1][...] += delta_b
+            self.version += 1
+            self.accepted_pushes += 1
+            return json.dumps({"accepted": True, "version": self.version}).encode("utf-8")
+
+    def handle(self, kind: bytes, payload: bytes) -> bytes:
+        if kind == request_pull:
+            return self.pull()
+        if kind == request_push:
+            return self.push(payload)
+        raise ValueError("Unrecognized parameter server request " + str(kind))
+
+    def serve_tcp(self, host: str = "127.0.0.1", port: int = 0) -> Tuple[str, int]:
+        """
+            Serves requests from DNNTcpTransport on a background thread, returning the address bound.
+        """
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while True:
+                    try:
+                        request = _recv_frame(self.request, 1, server.max_frame_size)
+                    except ValueError as e:
+                        # The payload is never received, so the stream cannot be resynchronized
+                        _send_frame(self.request, b"\x01", str(e).encode("utf-8"))
+                        break
+                    if request is None:
+                        break
+                    try:
+                        status, response = 0, server.handle(request[0], request[1])
+                    except Exception as e:
+                        # Any malformed request is answered, so that the client sees why rather than a closed socket
+                        status, response = 1, (str(e) or type(e).__name__).encode("utf-8")
+                    _send_frame(self.request, bytes([status]), response)
+
+        self.__tcp_server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.__tcp_server.daemon_threads = True
+        threading.Thread(target=self.__tcp_server.serve_forever, daemon=True).start()
+        return self.__tcp_server.server_address[:2]
+
+    def shutdown(self):
+        if self.__tcp_server is not None:
+            self.__tcp_server.shutdown()
+            self.__tcp_server.server_close()
+            self.__tcp_server = None
+
+
+def _recv_exactly(sock: 'socket.socket', size: int) -> bytes:
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            return None
+        received += count
+    return bytes(data)
+
+
+def _recv_frame(sock: 'socket.socket', prefix_size: int, max_size: int = None) -> Tuple[bytes, bytes]:
+    """
+        Receives one frame, returning None once the peer closes the connection. Raises ValueError before
+        receiving a payload longer than max_size.
+    """
+    header = _recv_exactly(sock, prefix_size + frame_header.size)
+    if header is None:
+        return None
+    size = frame_header.unpack_from(header, prefix_size)[0]
+    if max_size is not None and size > max_size:
+        raise ValueError("Frame of " + str(size) + " bytes exceeds the limit of " + str(max_size))
+    payload = _recv_exactly(sock, size)
+    if payload is None:
+        return None
+    return header[:prefix_size], payload
+
+
+def _send_frame(sock: 'socket.socket', prefix: bytes, payload: bytes):
+    sock.sendall(prefix + frame_header.pack(len(payload)) + payload)
+
+
+class DNNParameterTransport(ABC):
+    """
+        Carries encoded requests from a DNNParameterClient to a DNNParameterServer.
+    """
+
+    @abstractmethod
+    def request(self, kind: bytes, payload: bytes) -> bytes:
+        pass
+
+    def close(self):
+        pass
+
+
+class DNNLoopbackTransport(DNNParameterTransport):
+    """
+        Hands requests straight to a server in the same process, still going through the byte encoding.
+    """
+
+    def __init__(self, server: 'DNNParameterServer'):
+        self.server = server
+
+    def request(self, kind: bytes, payload: bytes) -> bytes:
+        return self.server.handle(kind, payload)
+
+
+class DNNTcpTransport(DNNParameterTransport):
+
+    def __init__(self, host: str, port: int):
+        self.__socket = socket.create_connection((host, port))
+
+    def request(self, kind: bytes, payload: bytes) -> bytes:
+        _send_frame(self.__socket, kind, payload)
+        response = _recv_frame(self.__socket, 1)
+        if response is None:
+            raise ConnectionError("Parameter server closed the connection")
+        if not response[0] == b"\x00":
+            raise ValueError(response[1].decode("utf-8"))
+        return response[1]
+
+    def close(self):
+        self.__socket.close()
+
+
+class DNNParameterClient:
+    """
+        Trains a local replica against a parameter server: every step runs the forward and backward pass locally,
+        pushes the accumulated weight changes and pulls the server's weights.
+
+        Deltas are sent as delta_dtype (float32 by default) and zlib compressed when compress is set. A push
+        the server rejects as too stale is dropped, the replica simply continues from freshly pulled weights.
+    """
+
+    def __init__(self, network: 'DynamicNeuralNetwork', transport: 'DNNParameterTransport',
+                 delta_dtype: str = "float32", compress: bool = True):
+        self.network = network
+        self.transport = transport
+        self.delta_dtype = delta_dtype
+        self.compress = compress
+        self.version: int = None
+        self.rejected_pushes = 0
+
+    def pull(self):
+        weights, self.version = decode_parameters(self.transport.request(request_pull, b""))
+        connections = {c.connection_id: c for c in self.network.compile_execution_plan().connections}
+        for conn_id, (weight_a, weight_b) in weights.items():
+            connection = connections[conn_id]
+            np.copyto(connection.weight_a, weight_a)
+            np.copyto(connection.weight_b, weight_b)
+            connection.invalidate_factorizations()
+        self.network.invalidate_input_contributions()
+
+    def push(self) -> bool:
+        if self.version is None:
+            raise ValueError("Weights must be pulled before changes can be pushed")
+        payload = encode_parameters(network_parameters(self.network, True), self.version,
+                                    self.delta_dtype, self.compress)
+        status = json.loads(self.transport.request(request_push, payload).decode("utf-8"))
+        self.network.weight_arena().changes.fill(0)
+        if not status["accepted"]:
+            self.rejected_pushes += 1
+        return status["accepted"]
+
+    def train_step(self, input_data: List['np.ndarray'], expected_outputs: List['np.ndarray']) -> bool:
+        if self.version is None:
+            self.pull()
+        self.network.compute_weight_changes(input_data, expected_outputs)
+        accepted = self.push()
+        self.pull()
+        return accepted
@@ -0,0 +1,128 @@
+import json
+import os
+import struct
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from components.DNNNetwork import DynamicNeuralNetwork
+
+if TYPE_CHECKING:
+    from components.DNNExecutionPlan import DNNExecutionPlan
+
+# A saved network is the magic, a header length, a json header describing the topology, then every weight of the
+# network as little endian float64 in weight arena layout, starting at an offset aligned to weight_alignment
+network_magic = b"DNNW"
+network_format_version = 1
+weight_alignment = 64
+preamble = struct.Struct("<4sI")
+weight_dtype = "<f8"
+
+
+def describe_topology(network: 'DynamicNeuralNetwork', plan: 'DNNExecutionPlan' = None) -> dict:
+    """
+        Returns the graph of the network's execution plan as arguments to DynamicNeuralNetwork.from_topology.
+        Output nodes the plan does not reach are listed after the plan's nodes.
+    """
+    if plan is None:
+        plan = network.compile_execution_plan()
+    node_shapes = [list(node.internal_shape) for node in plan.nodes]
+    output_indices = []
+    for out_node in network.output_nodes:
+        if out_node in plan.node_index:
+            output_indices.append(plan.node_index[out_node])
+        else:
+            output_indices.append(len(node_shapes))
+            node_shapes.append(list(out_node.internal_shape))
+    return {
+        "input_shapes": [list(shape) for shape in network.input_shapes],
+        "output_shapes": [list(shape) for shape in network.output_shapes],
+        "node_shapes": node_shapes,
+        "input_indices": [plan.node_index[in_node] for in_node in network.input_nodes],
+        "output_indices": output_indices,
+        "connections": [[int(plan.connection_src[conn_idx]), int(plan.connection_dst[conn_idx]),
+                         connection.connection_id] for conn_idx, connection in enumerate(plan.connections)]
+    }
+
+
+def save_network(network: 'DynamicNeuralNetwork', path: str, metadata: dict = None):
+    """
+        Writes the network's topology and weights to path, to be rebuilt by load_network.
+
+        The file starts with network_magic and the length of the json header that follows it. The header holds
+        format_version, the weights' dtype and count, the topology as from describe_topology, the network's
+        settings and metadata, which is stored untouched for the caller. It is padded with spaces so that the
+        weights, every connection's weight_a then weight_b in execution plan order as in DNNWeightArena, start at
+        a multiple of weight_alignment bytes and can be memory mapped.
+    """
+    plan = network.compile_execution_plan()
+    weights = network.weight_arena().weights
+    header = {
+        "format_version": network_format_version,
+        "dtype": weight_dtype,
+        "num_weights": int(weights.size),
+        "topology": describe_topology(network, plan),
+        "settings": {
+            "num_chains": network.num_chains,
+            "max_chain_depth": network.chain_depth,
+            "input_node_connectivity": network.input_node_connectivity,
+            "output_node_connectivity": network.output_node_connectivity
+        },
+        "metadata": metadata if metadata is not None else {}
+    }
+    header = json.dumps(header).encode("utf-8")
+    header_end = preamble.size + len(header)
+    padding = -header_end % weight_alignment
+    with open(path, "wb") as out_file:
+        out_file.write(preamble.pack(network_magic, len(header) + padding))
+        out_file.write(header + b" " * padding)
+        out_file.write(weights.astype(weight_dtype, copy=False).tobytes())
+
+
+def read_network_header(path: str) -> dict:
+    """
+        Returns the json header of a saved network, with data_offset set to the position of its weights.
+    """
+    with open(path, "rb") as in_file:
+        start = in_file.read(preamble.size)
+        if len(start) < preamble.size:
+            raise ValueError(path + " is too short to hold a saved network")
+        magic, header_len = preamble.unpack(start)
+        if not magic == network_magic:
+            raise ValueError(path + " does not hold a saved network")
+        header = in_file.read(header_len)
+        if len(header) < header_len:
+            raise ValueError(path + " ends within its header")
+        header = json.loads(header.decode("utf-8"))
+    if header["format_version"] > network_format_version:
+        raise ValueError("Saved network format " + str(header["format_version"]) + " is newer than the supported " +
+                         str(network_format_version))
+    header["data_offset"] = preamble.size + header_len
+    return header
+
+
+def load_network(path: str, mmap_mode: str = None) -> 'DynamicNeuralNetwork':
+    """
+        Rebuilds a network saved by save_network.
+
+        With mmap_mode set, as for numpy.memmap, the connections view the weights straight from the file rather
+        than reading them. "r" maps them read-only, so that every process serving the same file shares one copy
+        in the page cache, such a network can run inference but not be trained. "c" maps them copy on write.
+    """
+    header = read_network_header(path)
+    network = DynamicNeuralNetwork.from_topology(**header["topology"], **header["settings"])
+    # The weights are laid out by the saved plan, which the rebuilt one must reproduce exactly
+    if not describe_topology(network) == header["topology"] \
+            or not network.weight_arena().num_weights == header["num_weights"]:
+        raise ValueError("Network rebuilt from " + path + " does not match the layout of its saved weights")
+    if os.path.getsize(path) < header["data_offset"] + header["num_weights"] * np.dtype(header["dtype"]).itemsize:
+        raise ValueError(path + " ends within its weights")
+    if header["num_weights"] == 0:
+        return network
+    if mmap_mode is not None:
+        weights = np.memmap(path, header["dtype"], mmap_mode, header["data_offset"], (header["num_weights"],))
+        network.view_weights(weights)
+    else:
+        weights = np.fromfile(path, header["dtype"], header["num_weights"], offset=header["data_offset"])
+        network.restore_weights(weights)
+    return network
@@ -0,0 +1,123 @@
+import queue
+import threading
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+from components import default_stream_batch_size, default_prefetch_depth
+
+if TYPE_CHECKING:
+    from components.DNNNetwork import DynamicNeuralNetwork
+
+# A shard is one .npy file per input node followed by one per output node, each of shape (samples, rows, cols)
+Shard = Tuple[List[str], List[str]]
+Batch = Tuple[List['np.ndarray'], List['np.ndarray']]
+
+
+def open_shard(network: 'DynamicNeuralNetwork', shard: Shard) -> Batch:
+    """
+        Memory maps every file of a shard read-only and checks them against the network's input and output
+        shapes, returning the mapped inputs and expected outputs.
+    """
+    input_paths, output_paths = shard
+    if not len(input_paths) == network.num_inputs or not len(output_paths) == network.num_outputs:
+        raise ValueError("Shard holds " + str(len(input_paths)) + " inputs and " + str(len(output_paths)) +
+                         " outputs, expected " + str(network.num_inputs) + " and " + str(network.num_outputs))
+    inputs = [np.load(path, mmap_mode="r") for path in input_paths]
+    outputs = [np.load(path, mmap_mode="r") for path in output_paths]
+    num_samples = inputs[0].shape[0] if len(inputs) > 0 and inputs[0].ndim == 3 else None
+    for path, data, shape in zip(input_paths + output_paths, inputs + outputs,
+                                 list(network.input_shapes) + list(network.output_shapes)):
+        if not data.ndim == 3 or not tuple(data.shape[1:]) == tuple(shape) or not data.shape[0] == num_samples:
+            raise ValueError("Incorrect shape in " + path + " expected (" + str(num_samples) + ", " +
+                             str(shape[0]) + ", " + str(shape[1]) + ") but received " + str(data.shape))
+    return inputs, outputs
+
+
+def iterate_batches(network: 'DynamicNeuralNetwork', shards: Iterable[Shard], batch_size: int) -> Iterator[Batch]:
+    """
+        Yields minibatches of at most batch_size samples from each shard in turn. Batches do not span shards,
+        and are copied out of the memory maps so that reading them from disk happens here.
+    """
+    for shard in shards:
+        inputs, outputs = open_shard(network, shard)
+        num_samples = inputs[0].shape[0]
+        for start in range(0, num_samples, batch_size):
+            end = min(start + batch_size, num_samples)
+            yield [np.array(x[start:end]) for x in inputs], [np.array(y[start:end]) for y in outputs]
+
+
+def prefetch(batches: Iterator[Batch], depth: int) -> Iterator[Batch]:
+    """
+        Runs batches on a background thread, keeping up to depth of its items ready ahead of the consumer.
+        Errors raised while producing are raised to the consumer in order.
+    """
+    ready = queue.Queue(depth)
+    stop = threading.Event()
+    finished = object()
+
+    def offer(item) -> bool:
+        # Gives up once the consumer stopped, which may leave the queue full for good
+        while not stop.is_set():
+            try:
+                ready.put(item, timeout=.05)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for batch in batches:
+                if not offer(batch):
+                    return
+            offer(finished)
+        except Exception as e:
+            offer(e)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = ready.get()
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+
+class DNNStreamingTrainer:
+    """
+        Trains a network on datasets too large to hold in memory, streamed from memory mapped .npy shards.
+
+        Shards are validated once when opened, rather than per sample. Minibatches are read on a background
+        thread while the previous one trains, so at most prefetch_depth + 1 batches are held in memory at a time.
+    """
+
+    def __init__(self, network: 'DynamicNeuralNetwork', shards: List[Shard], batch_size: int = None,
+                 prefetch_depth: int = None, on_step: Callable[[], object] = None):
+        self.network = network
+        self.shards = list(shards)
+        self.batch_size = batch_size if batch_size is not None else default_stream_batch_size
+        self.prefetch_depth = prefetch_depth if prefetch_depth is not None else default_prefetch_depth
+        # Called after every step, such as DNNCheckpointer.step
+        self.on_step = on_step
+        self.steps = 0
+
+    def train_epoch(self) -> int:
+        """
+            Performs one backpropagation step per minibatch over every shard, returning the number of samples seen.
+        """
+        num_samples = 0
+        for input_data, expected_outputs in prefetch(iterate_batches(self.network, self.shards, self.batch_size),
+                                                     self.prefetch_depth):
+            self.network.perform_backpropagation(input_data, expected_outputs)
+            num_samples += input_data[0].shape[0]
+            self.steps += 1
+            if self.on_step is not None:
+                self.on_step()
+        return num_samples
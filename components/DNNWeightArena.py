@@ -0,0 +1,109 @@
+from typing import TYPE_CHECKING, List
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from components.DNNNodeConnection import DNNConnection
+
+
+class DNNWeightArena:
+    """
+        Lays out the weights and weight changes of a set of connections in one contiguous float buffer.
+
+        The buffer holds every connection's weight_a followed by its weight_b, all weights first and all weight
+        changes after them in the same layout. Each connection's four arrays are replaced by views into the
+        buffer, so applying every update is a single add and a single fill. A buffer may be supplied, such as one
+        placed in shared memory, and must then hold size elements.
+
+        Alternatively weights may be supplied alone, holding num_weights elements already in arena layout, such as
+        a read-only memory map of a saved network. Connections then view those weights as they are, nothing is
+        copied in, and buffer is None as the weight changes are kept apart.
+    """
+
+    def __init__(self, connections: List['DNNConnection'], buffer: 'np.ndarray' = None, weights: 'np.ndarray' = None):
+        self.connections = list(connections)
+        self.offsets = np.zeros(len(self.connections) + 1, int)
+        for conn_idx, connection in enumerate(self.connections):
+            self.offsets[conn_idx + 1] = self.offsets[conn_idx] + connection.weight_a.size + connection.weight_b.size
+        self.num_weights = int(self.offsets[-1])
+        self.size = 2 * self.num_weights
+        if weights is not None:
+            if not weights.shape == (self.num_weights,):
+                raise ValueError("Weight arena requires weights of " + str(self.num_weights) + " elements")
+            self.buffer = None
+            self.weights = weights
+            self.changes = np.zeros(self.num_weights, float)
+            self.__bind(False)
+            return
+        if buffer is None:
+            buffer = np.zeros(self.size, float)
+        elif not buffer.shape == (self.size,):
+            raise ValueError("Weight arena requires a buffer of " + str(self.size) + " elements")
+        self.buffer = buffer
+        self.weights = self.buffer[:self.num_weights]
+        self.changes = self.buffer[self.num_weights:]
+        self.__bind()
+
+    def __bind(self, copy_weights: bool = True):
+        # Current values are copied in before the connection's arrays are replaced by views
+        for conn_idx, connection in enumerate(self.connections):
+            start = self.offsets[conn_idx]
+            mid = start + connection.weight_a.size
+            end = self.offsets[conn_idx + 1]
+            for region, name_a, name_b in ((self.weights, "weight_a", "weight_b"),
+                                           (self.changes, "change_weight_a", "change_weight_b")):
+                view_a = region[start:mid].reshape(connection.weight_a.shape)
+                view_b = region[mid:end].reshape(connection.weight_b.shape)
+                if copy_weights or region is self.changes:
+                    view_a[...] = getattr(connection, name_a)
+                    view_b[...] = getattr(connection, name_b)
+                setattr(connection, name_a, view_a)
+                setattr(connection, name_b, view_b)
+
+    def ensure_bound(self):
+        """
+            Binds an arena restored from a copy or pickle, whose connections then hold plain arrays again.
+        """
+        if self.weights is None:
+            self.__init__(self.connections)
+
+    def __ensure_writeable(self):
+        if not self.weights.flags.writeable:
+            raise ValueError("Weights are read-only, the network was loaded for inference only. "
+                             "Load it without mmap_mode, or with mmap_mode \"c\", to train it")
+
+    def apply_updates(self):
+        self.ensure_bound()
+        self.__ensure_writeable()
+        self.weights += self.changes
+        self.changes.fill(0)
+        for connection in self.connections:
+            connection.invalidate_factorizations()
+
+    def snapshot(self) -> 'np.ndarray':
+        """
+            Returns a copy of every weight, in arena layout.
+        """
+        self.ensure_bound()
+        return self.weights.copy()
+
+    def restore(self, weights: 'np.ndarray'):
+        """
+            Copies weights back in. Results the network cached from the previous weights are left as they are,
+            so restore through DynamicNeuralNetwork.restore_weights unless the network has none.
+        """
+        self.ensure_bound()
+        self.__ensure_writeable()
+        np.copyto(self.weights, weights)
+        for connection in self.connections:
+            connection.invalidate_factorizations()
+
+    def __getstate__(self):
+        # Views do not survive copying or pickling, the copied connections hold plain arrays and are bound again
+        return {"connections": self.connections}
+
+    def __setstate__(self, state):
+        self.connections = state["connections"]
+        self.buffer = None
+        self.weights = None
+        self.changes = None
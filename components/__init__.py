@@ -6,3 +6,11 @@ dnn_shape_min_rows = 5
 dnn_shape_max_rows = 10
 dnn_shape_min_cols = 5
 dnn_shape_max_cols = 10
+default_factorization_cache_size = 512
+default_backprop_workers = 1
+default_forward_workers = 1
+default_parameter_staleness = 4
+default_parameter_frame_size = 256 << 20
+default_checkpoint_compaction = 16
+default_stream_batch_size = 32
+default_prefetch_depth = 2
@@ -0,0 +1,122 @@
+from io import BytesIO
+from typing import TYPE_CHECKING, List, Tuple
+
+import numpy as np
+
+from matrix.MatrixUtils import swap_row, scale_and_subtract_rows, scale_row, eliminate_rows, scale_rows
+
+if TYPE_CHECKING:
+    from matrix.GaussianEliminator import ThreadBlock
+
+OP_SWAP = 0
+OP_SUBTRACT = 1
+OP_SCALE = 2
+OP_SCALE_FIRST_SUBTRACT = 3
+
+history_dtype = np.dtype([
+    ("opcode", np.uint8),
+    ("block", np.int32),
+    ("row_a", np.int32),
+    ("row_b", np.int32),
+    ("scale", np.float64),
+])
+
+
+class CompactHistory:
+    """
+        An elimination history stored as one row operation per entry of a structured array.
+
+        row_a is the row read from and row_b the row written to, except for OP_SCALE which scales row_a.
+        Operations sharing a block number are independent of each other, exactly like the calls of a
+        ThreadBlock, which lets a whole block be applied with a few fancy-indexed updates. Replays work
+        on any stack of matrices with shape (..., rows, cols).
+    """
+    __slots__ = ("operations", "_segments")
+
+    def __init__(self, operations: 'np.ndarray'):
+        self.operations = operations.astype(history_dtype, copy=False)
+        self._segments = self.__build_segments()
+
+    def __build_segments(self) -> List[Tuple[int, 'np.ndarray', 'np.ndarray', 'np.ndarray']]:
+        segments = []
+        if len(self.operations) == 0:
+            return segments
+        block_starts = np.flatnonzero(np.diff(self.operations["block"])) + 1
+        for block in np.split(self.operations, block_starts):
+            for opcode in np.unique(block["opcode"]):
+                ops = block[block["opcode"] == opcode]
+                if opcode == OP_SWAP:
+                    # Swaps do not commute with each other, keep them one per segment
+                    for op in ops:
+                        segments.append((OP_SWAP, np.array([op["row_a"]]), np.array([op["row_b"]]), np.zeros(1)))
+                else:
+                    segments.append((int(opcode), ops["row_a"].astype(int), ops["row_b"].astype(int),
+                                     ops["scale"][:, np.newaxis]))
+        return segments
+
+    @classmethod
+    def from_thread_blocks(cls, history: List['ThreadBlock']) -> 'CompactHistory':
+        entries = []
+        for block_idx, curr_block in enumerate(history):
+            for call, args in curr_block.history:
+                entries.extend(cls.__encode_call(block_idx, call, args))
+        return cls(np.array(entries, history_dtype))
+
+    @staticmethod
+    def __encode_call(block_idx: int, call, args) -> List[tuple]:
+        if call is swap_row:
+            return [(OP_SWAP, block_idx, args[0], args[1], 0.0)]
+        if call is scale_and_subtract_rows:
+            opcode = OP_SCALE_FIRST_SUBTRACT if len(args) > 3 and args[3] else OP_SUBTRACT
+            return [(opcode, block_idx, args[0], args[1], args[2])]
+        if call is scale_row:
+            return [(OP_SCALE, block_idx, args[0], args[0], args[1])]
+        if call is eliminate_rows:
+            pivot_row, rows, scales = args
+            return [(OP_SUBTRACT, block_idx, pivot_row, row, scale) for row, scale in zip(rows, scales)]
+        if call is scale_rows:
+            rows, scales = args
+            return [(OP_SCALE, block_idx, row, row, scale) for row, scale in zip(rows, scales)]
+        raise ValueError("Cannot encode unrecognized history call " + str(call))
+
+    def segments(self) -> List[Tuple[int, 'np.ndarray', 'np.ndarray', 'np.ndarray']]:
+        """
+            Returns the history as (opcode, row_a, row_b, scales) groups of operations independent of each other.
+        """
+        return self._segments
+
+    def replay(self, matrices: 'np.ndarray'):
+        """
+            Applies the history in place to matrices, treating every leading axis as a batch axis.
+        """
+        for opcode, row_a, row_b, scales in self._segments:
+            if opcode == OP_SUBTRACT:
+                matrices[..., row_b, :] -= scales * matrices[..., row_a, :]
+            elif opcode == OP_SCALE:
+                matrices[..., row_a, :] *= scales
+            elif opcode == OP_SCALE_FIRST_SUBTRACT:
+                matrices[..., row_b, :] = matrices[..., row_b, :] * scales - matrices[..., row_a, :]
+            else:
+                swapped = matrices[..., row_a, :].copy()
+                matrices[..., row_a, :] = matrices[..., row_b, :]
+                matrices[..., row_b, :] = swapped
+        return matrices
+
+    def tobytes(self) -> bytes:
+        buffer = BytesIO()
+        np.save(buffer, self.operations, allow_pickle=False)
+        return buffer.getvalue()
+
+    @classmethod
+    def frombytes(cls, data: bytes) -> 'CompactHistory':
+        return cls(np.load(BytesIO(data), allow_pickle=False))
+
+    def __getstate__(self):
+        return self.tobytes()
+
+    def __setstate__(self, state: bytes):
+        self.operations = np.load(BytesIO(state), allow_pickle=False)
+        self._segments = self.__build_segments()
+
+    def __len__(self):
+        return len(self.operations)
@@ -0,0 +1,113 @@
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Set
+
+import numpy as np
+
+from matrix.MatrixMultiplicationSolver import FactoredSystem, factorSystem
+
+
+class FactorizationCache:
+    """
+        A bounded, least recently used cache of FactoredSystems.
+
+        Entries are keyed by the caller and must be invalidated by the caller whenever the matrix changes.
+        An entry may also name the object owning the matrix, which the cache then only references weakly, its
+        entries are dropped once the owner is garbage collected. The cache may be shared between threads,
+        factoring happens outside of its lock.
+    """
+
+    def __init__(self, max_entries: int):
+        if max_entries < 1:
+            raise ValueError("A factorization cache must be able to hold at least one entry")
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.__entries: 'OrderedDict[Hashable, FactoredSystem]' = OrderedDict()
+        # Per owner id, a weak reference to the owner and the keys of its entries
+        self.__owners: Dict[int, 'weakref.ref'] = {}
+        self.__owner_keys: Dict[int, Set[Hashable]] = {}
+        # Filled by weak reference callbacks, which may run at any point, and purged under the lock. An owner's
+        # id is only reused once the owner is gone, by which point its callback has run
+        self.__dead_owners: List[int] = []
+        self.__lock = threading.Lock()
+
+    def get(self, key: Hashable, matrix: 'np.ndarray', owner: object = None) -> 'FactoredSystem':
+        """
+            Returns the factorization stored under key (of owner, if given), factoring matrix and storing the result
+            on a miss.
+        """
+        entry_key = self.__entry_key(key, owner)
+        with self.__lock:
+            self.__purge_dead_owners()
+            factorization = self.__entries.get(entry_key)
+            if factorization is not None:
+                self.__entries.move_to_end(entry_key)
+                self.hits += 1
+                return factorization
+            self.misses += 1
+        factorization = factorSystem(matrix)
+        with self.__lock:
+            self.__purge_dead_owners()
+            self.__entries[entry_key] = factorization
+            if owner is not None:
+                self.__track_owner(owner, entry_key)
+            if len(self.__entries) > self.max_entries:
+                self.__forget(self.__entries.popitem(last=False)[0])
+        return factorization
+
+    def invalidate(self, key: Hashable, owner: object = None):
+        entry_key = self.__entry_key(key, owner)
+        with self.__lock:
+            if self.__entries.pop(entry_key, None) is not None:
+                self.__forget(entry_key)
+
+    def contains(self, key: Hashable, owner: object = None) -> bool:
+        return self.__contains__(self.__entry_key(key, owner))
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__owners.clear()
+            self.__owner_keys.clear()
+
+    @staticmethod
+    def __entry_key(key: Hashable, owner: object) -> Hashable:
+        return key if owner is None else (id(owner), key)
+
+    def __track_owner(self, owner: object, entry_key: Hashable):
+        owner_id = id(owner)
+        if owner_id not in self.__owners:
+            self.__owners[owner_id] = weakref.ref(owner,
+                                                  lambda _, dead_id=owner_id: self.__dead_owners.append(dead_id))
+            self.__owner_keys[owner_id] = set()
+        self.__owner_keys[owner_id].add(entry_key)
+
+    def __forget(self, entry_key: Hashable):
+        # Stops tracking the owner of an entry that left the cache once it has no entries left
+        if not isinstance(entry_key, tuple) or entry_key[0] not in self.__owner_keys:
+            return
+        owner_keys = self.__owner_keys[entry_key[0]]
+        owner_keys.discard(entry_key)
+        if len(owner_keys) == 0:
+            del self.__owner_keys[entry_key[0]]
+            del self.__owners[entry_key[0]]
+
+    def __purge_dead_owners(self):
+        while len(self.__dead_owners) > 0:
+            owner_id = self.__dead_owners.pop()
+            if owner_id in self.__owners and self.__owners[owner_id]() is None:
+                for entry_key in self.__owner_keys.pop(owner_id):
+                    self.__entries.pop(entry_key, None)
+                del self.__owners[owner_id]
+
+    def __contains__(self, key: Hashable):
+        with self.__lock:
+            self.__purge_dead_owners()
+            return key in self.__entries
+
+    def __len__(self):
+        with self.__lock:
+            self.__purge_dead_owners()
+            return len(self.__entries)
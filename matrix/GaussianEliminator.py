@@ -1,16 +1,25 @@
+import os
 from multiprocessing import Pool
-from typing import List, Tuple, Callable, Iterable
+from typing import List, Tuple, Callable, Iterable, Union
 
 import numpy as np
 
-from matrix.MatrixUtils import getPivotPositions, swap_nonzero, scale_and_subtract_rows, scale_row
+from matrix.CompactHistory import CompactHistory
+from matrix.MatrixUtils import getPivotPositions, swap_nonzero, eliminate_rows, scale_rows
+from matrix.SharedMemoryBackend import SharedMatrix
 
 multipool: "Pool" = None
+multipool_workers = 1
 
 
-def enableMultiprocessing(pool: 'Pool'):
-    global multipool
+def enableMultiprocessing(pool: 'Pool', num_workers: int = None):
+    """
+        Runs multiprocessing elimination on pool, whose number of worker processes is num_workers
+        (os.cpu_count(), as for Pool, if not given).
+    """
+    global multipool, multipool_workers
     multipool = pool
+    multipool_workers = num_workers if num_workers is not None else (os.cpu_count() or 1)
 
 
 class ThreadBlock:
@@ -25,50 +34,110 @@ class ThreadBlock:
         return len(self.history)
 
 
-def execute_history(history: List['ThreadBlock'], matrix: 'np.ndarray', use_multiprocessing: bool):
+def execute_history(history: Union[List['ThreadBlock'], 'CompactHistory'], matrix: 'np.ndarray',
+                    use_multiprocessing: bool):
     global multipool
     if use_multiprocessing and multipool is None:
         raise ValueError("Multiprocessing has not been enabled for gaussian elimination. "
                          "Did you call enableMultiprocessing?")
+    if use_multiprocessing:
+        # The matrix is placed in shared memory once, workers only receive row indices and scales
+        with SharedMatrix(matrix) as shared:
+            shared.execute(history, multipool, multipool_workers)
+            matrix[...] = shared.array
+        return
+    if isinstance(history, CompactHistory):
+        history.replay(matrix)
+        return
     for curr_block in history:
-        async_results = []
         for call, args in curr_block.history:
-            if not use_multiprocessing or len(curr_block.history) == 1:
-                call(matrix, *args)
-            else:
-                async_results.append(multipool.apply_async(call, (matrix, *args)))
-        if use_multiprocessing and len(curr_block.history) > 1:
-            for async_res in async_results:
-                result = async_res.get()
-                matrix[result[1]] = result[0]
-
-
-def _forward_eliminate(matrix: 'np.ndarray', use_multiprocessing: bool = False) -> List['ThreadBlock']:
+            call(matrix, *args)
+
+
+def _execute_block(curr_block: 'ThreadBlock', matrix: 'np.ndarray', shared: 'SharedMatrix'):
+    if shared is None:
+        execute_history([curr_block], matrix, False)
+    else:
+        shared.execute([curr_block], multipool, multipool_workers)
+
+
+def _zero_tolerance(matrix: 'np.ndarray') -> float:
+    if matrix.size == 0:
+        return 0.0
+    return max(matrix.shape) * np.finfo(float).eps * np.max(np.abs(matrix))
+
+
+def gaussian_elimination_batch(matrices: 'np.ndarray', num_cols: int = None) -> 'np.ndarray':
+    """
+        Reduces every matrix of a (batch, rows, cols) stack to reduced row echelon form in place, eliminating the
+        stack together one column at a time. Only the first num_cols columns are searched for pivots, the rest
+        are carried along as augmentation. Pivots are chosen like gaussian_elimination does, as the first
+        entry on or below the next pivot row that is not round off.
+
+        Returns a (batch, rows) array holding the pivot column of every row, or -1 for rows without a pivot.
+    """
+    batch, rows, cols = matrices.shape
+    num_cols = cols if num_cols is None else num_cols
+    pivot_cols = np.full((batch, rows), -1, int)
+    if matrices.size == 0:
+        return pivot_cols
+    tolerance = max(rows, num_cols) * np.finfo(float).eps * np.max(np.abs(matrices[..., :num_cols]), axis=(1, 2))
+    next_row = np.zeros(batch, int)
+    row_range = np.arange(rows)
+    for col in range(num_cols):
+        below = row_range[np.newaxis] >= next_row[:, np.newaxis]
+        column = matrices[:, :, col]
+        round_off = below & (np.abs(column) <= tolerance[:, np.newaxis])
+        column[round_off] = 0
+        candidates = below & (column != 0)
+        systems = np.flatnonzero(np.any(candidates, axis=1))
+        if len(systems) == 0:
+            continue
+        piv_rows = next_row[systems]
+        found_rows = np.argmax(candidates[systems], axis=1)
+        pivot_values = matrices[systems, found_rows].copy()
+        matrices[systems, found_rows] = matrices[systems, piv_rows]
+        pivot_values /= pivot_values[:, [col]]
+        matrices[systems, piv_rows] = pivot_values
+        # Clear the column above and below every pivot with one rank-1 update per system
+        factors = matrices[systems, :, col].copy()
+        factors[np.arange(len(systems)), piv_rows] = 0
+        matrices[systems] -= factors[:, :, np.newaxis] * pivot_values[:, np.newaxis, :]
+        matrices[systems, :, col] = 0
+        matrices[systems, piv_rows, col] = 1
+        pivot_cols[systems, piv_rows] = col
+        next_row[systems] += 1
+    return pivot_cols
+
+
+def _forward_eliminate(matrix: 'np.ndarray', shared: 'SharedMatrix' = None) -> List['ThreadBlock']:
     gauss_history: List['ThreadBlock'] = []
-    max_col = min(matrix.shape)
+    tolerance = _zero_tolerance(matrix)
     curr_row = 0
-    for col in range(0, max_col):
-        if matrix[curr_row][col] == 0:
-            _, ret_action = swap_nonzero(matrix, col, col)
+    for col in range(0, matrix.shape[1]):
+        if curr_row == matrix.shape[0]:
+            break
+        # Entries left over by round off are cleared so they are neither chosen as pivots nor eliminated
+        remaining_col = matrix[curr_row:, col]
+        remaining_col[np.abs(remaining_col) <= tolerance] = 0
+        if matrix[curr_row, col] == 0:
+            _, ret_action = swap_nonzero(matrix, curr_row, col)
             if ret_action is None:
                 continue
             gauss_history.append(ThreadBlock())
             gauss_history[-1].addFunctionCall(ret_action[0], ret_action[1])
 
         # If we're here then we have a non-zero row entry.
-        curr_block = ThreadBlock()
-        mat_val = matrix[curr_row][col]
-        div_precompute = 1.0/mat_val
-
-        for row in range(curr_row+1, matrix.shape[0]):
-            if matrix[row][col] == 0:
-                continue
-            curr_block.addFunctionCall(scale_and_subtract_rows, (curr_row, row, matrix[row][col] * div_precompute))
-
-        execute_history([curr_block], matrix, use_multiprocessing)
-        curr_row += 1
-        if not len(curr_block) == 0:
+        # The whole column below the pivot is eliminated by a single rank-1 update.
+        rows = curr_row + 1 + np.flatnonzero(matrix[curr_row + 1:, col])
+        if len(rows) > 0:
+            curr_block = ThreadBlock()
+            div_precompute = 1.0 / matrix[curr_row, col]
+            curr_block.addFunctionCall(eliminate_rows, (curr_row, rows, matrix[rows, col] * div_precompute))
+            _execute_block(curr_block, matrix, shared)
+            matrix[rows, col] = 0
             gauss_history.append(curr_block)
+        curr_row += 1
     # end
     return gauss_history
 
@@ -78,24 +147,37 @@ def gaussian_elimination(matrix: 'np.ndarray', use_multiprocessing: bool = False
     if use_multiprocessing and multipool is None:
         raise ValueError("Multiprocessing has not been enabled for gaussian elimination. "
                          "Did you call enableMultiprocessing?")
-    gauss_history = _forward_eliminate(matrix, use_multiprocessing)
+    if use_multiprocessing:
+        # Eliminate on a shared memory copy for the whole run, rather than shipping the matrix per operation
+        with SharedMatrix(matrix) as shared:
+            gauss_history = _eliminate(shared.array, shared)
+            matrix[...] = shared.array
+        return gauss_history
+    return _eliminate(matrix, None)
+
 
-    scale_block = ThreadBlock()
+def _eliminate(matrix: 'np.ndarray', shared: 'SharedMatrix') -> List['ThreadBlock']:
+    gauss_history = _forward_eliminate(matrix, shared)
+
+    scaled_rows: List[int] = []
+    row_scales: List[float] = []
     pivot_positions = reversed(getPivotPositions(matrix))
     for piv_row, piv_col in pivot_positions:
-        pre_div = 1.0 / matrix[piv_row][piv_col]
-        if not matrix[piv_row][piv_col] == 1:
-            scale_block.addFunctionCall(scale_row, (piv_row, pre_div))
-        curr_block = ThreadBlock()
-        for row in reversed(range(0, piv_row)):
-            mat_val = matrix[row][piv_col]
-            if mat_val == 0:
-                continue
-            curr_block.addFunctionCall(scale_and_subtract_rows, (piv_row, row, mat_val * pre_div))
-        if not len(curr_block) == 0:
+        pre_div = 1.0 / matrix[piv_row, piv_col]
+        if not matrix[piv_row, piv_col] == 1:
+            scaled_rows.append(piv_row)
+            row_scales.append(pre_div)
+        # Every row above the pivot is cleared by a single rank-1 update
+        rows = np.flatnonzero(matrix[:piv_row, piv_col])
+        if len(rows) > 0:
+            curr_block = ThreadBlock()
+            curr_block.addFunctionCall(eliminate_rows, (piv_row, rows, matrix[rows, piv_col] * pre_div))
+            _execute_block(curr_block, matrix, shared)
+            matrix[rows, piv_col] = 0
             gauss_history.append(curr_block)
-        execute_history([curr_block], matrix, use_multiprocessing)
-    execute_history([scale_block], matrix, use_multiprocessing)
-    if not len(scale_block) == 0:
+    if not len(scaled_rows) == 0:
+        scale_block = ThreadBlock()
+        scale_block.addFunctionCall(scale_rows, (np.array(scaled_rows, int), np.array(row_scales, float)))
+        _execute_block(scale_block, matrix, shared)
         gauss_history.append(scale_block)
     return gauss_history
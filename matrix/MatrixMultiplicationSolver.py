@@ -1,9 +1,10 @@
 from multiprocessing import Pool
-from typing import List, Tuple
+from typing import List, Tuple, Sequence, Union
 
 import numpy as np
 
 from matrix import GaussianEliminator as ge
+from matrix import SolverStrategy as ss
 from matrix.MatrixUtils import getPivotPositions
 
 
@@ -33,6 +34,53 @@ class PvfSolution:
         return len(self.dependent_coeffs)
 
 
+class FactoredSystem:
+    """
+        The gauss eliminated form of a coefficient matrix together with the history that produced it,
+        so that further right hand sides can be solved against it without eliminating again.
+    """
+
+    def __init__(self, reduced_matrix: 'np.ndarray', history: List['ge.ThreadBlock'], scale: float,
+                 q_matrix: 'np.ndarray' = None, r_matrix: 'np.ndarray' = None):
+        self.reduced_matrix = reduced_matrix
+        self.history = history
+        self.scale = scale
+        # Factorization of reduced_matrix.T @ reduced_matrix, built the first time a least squares solve needs it
+        self.normal_system: 'FactoredSystem' = None
+        # QR factorization of the original matrix, only present when it has full column rank
+        self.q_matrix = q_matrix
+        self.r_matrix = r_matrix
+
+    def is_eliminated(self) -> bool:
+        return self.reduced_matrix is not None
+
+
+def factorSystem(original_matrix: 'np.ndarray', use_multiprocessing: bool = False) -> 'FactoredSystem':
+    """
+        Factors original_matrix according to the solver strategy. Under "auto" and "lapack" a matrix of full
+        column rank is QR factored, otherwise it is gauss eliminated. Under "lapack" a rank deficient matrix is
+        not factored at all, since it is handed to numpy.linalg.lstsq on every solve.
+    """
+    strategy = ss.getSolverStrategy()
+    if not strategy == ss.STRATEGY_GAUSSIAN:
+        q_matrix, r_matrix = ss.factorFullRank(original_matrix.astype(float))
+        if q_matrix is not None:
+            return FactoredSystem(None, None, 1.0, q_matrix, r_matrix)
+        if strategy == ss.STRATEGY_LAPACK:
+            return FactoredSystem(None, None, 1.0)
+    return eliminateSystem(original_matrix, use_multiprocessing)
+
+
+def eliminateSystem(original_matrix: 'np.ndarray', use_multiprocessing: bool = False) -> 'FactoredSystem':
+    working_matrix = original_matrix.astype(float)
+    scale = np.max(np.abs(working_matrix)) if working_matrix.size > 0 else 0.0
+    if scale == 0:
+        scale = 1.0
+    working_matrix /= scale
+    history = ge.gaussian_elimination(working_matrix, use_multiprocessing)
+    return FactoredSystem(working_matrix, history, scale)
+
+
 def systemSolveStatus(matrix: 'np.ndarray', augmented_column: 'np.ndarray'):
     """
         Returns whether the system of equations represented by the inputs has one solution,
@@ -59,60 +107,285 @@ def systemSolveStatus(matrix: 'np.ndarray', augmented_column: 'np.ndarray'):
 def extractSingleSolution(matrix: 'np.ndarray', augmentation: 'np.ndarray', pivot_positions: List[Tuple[int, int]]):
     ret_arr = np.zeros((matrix.shape[1], 1), float)
     for pivot_position in pivot_positions:
-        ret_arr[pivot_position[1]] = augmentation[pivot_position[1]][0]
+        ret_arr[pivot_position[1]] = augmentation[pivot_position[0]][0]
     return ret_arr
 
 
-def extractInfSolution(matrix: 'np.ndarray', augmentation: 'np.ndarray', pivot_positions: List[Tuple[int, int]]):
+def extractInfSolution(matrix: 'np.ndarray', augmentation: 'np.ndarray', pivot_positions: List[Tuple[int, int]],
+                       rng: 'np.random.Generator' = None):
     pvf_sol = PvfSolution(matrix, augmentation, pivot_positions)
-    return pvf_sol.insert_dependents(np.random.random((len(pvf_sol))))
+    return pvf_sol.insert_dependents(_random_source(rng).random((len(pvf_sol))))
+
+
+def _random_source(rng: 'np.random.Generator'):
+    # Generators and the global numpy random module both draw uniform samples through random(size)
+    return rng if rng is not None else np.random
+
+
+def classifySolveStatus(matrix: 'np.ndarray', augmentation: 'np.ndarray',
+                        pivot_positions: List[Tuple[int, int]]) -> 'np.ndarray':
+    """
+        Returns the solve status of every column of augmentation against the gauss eliminated matrix at once,
+        using the same codes as systemSolveStatus. A consistent column has a single solution only if every
+        column of matrix holds a pivot.
+    """
+    non_piv_rows = np.ones(matrix.shape[0], bool)
+    non_piv_rows[[x[0] for x in pivot_positions]] = False
+    inconsistent = np.any(augmentation[non_piv_rows] != 0, axis=0)
+    status = np.full(augmentation.shape[1], 0 if len(pivot_positions) == matrix.shape[1] else 1)
+    status[inconsistent] = 2
+    return status
+
+
+def extractSolutions(matrix: 'np.ndarray', augmentation: 'np.ndarray',
+                     pivot_positions: List[Tuple[int, int]], rng: 'np.random.Generator' = None) -> 'np.ndarray':
+    """
+        Back-substitutes every (consistent) column of augmentation against the gauss eliminated matrix at once.
+        Free variables whose column is not entirely zero are given a small random value, as extractInfSolution does.
+    """
+    ret_matrix = np.zeros((matrix.shape[1], augmentation.shape[1]), float)
+    piv_rows = np.array([x[0] for x in pivot_positions], int)
+    piv_cols = np.array([x[1] for x in pivot_positions], int)
+    ret_matrix[piv_cols] = augmentation[piv_rows]
+
+    non_piv_cols = np.ones(matrix.shape[1], bool)
+    non_piv_cols[piv_cols] = False
+    non_piv_cols &= np.any(matrix != 0, axis=0)
+    dependent_cols = np.flatnonzero(non_piv_cols)
+    if len(dependent_cols) > 0:
+        dependents = _random_source(rng).random((len(dependent_cols), augmentation.shape[1]))
+        ret_matrix[dependent_cols] = dependents
+        ret_matrix[piv_cols] -= matrix[np.ix_(piv_rows, dependent_cols)] @ dependents
+    return ret_matrix
+
+
+def solveDirect(original_matrix: 'np.ndarray', resulting_matrix: 'np.ndarray', strategy: str,
+                known_factorization: 'FactoredSystem' = None):
+    """
+        Solves the system with numpy.linalg if the strategy allows it. Returns None when the system has to be
+        gauss eliminated instead, which under "auto" is the case for every system without full column rank.
+    """
+    if known_factorization is not None and known_factorization.q_matrix is not None:
+        q_matrix, r_matrix = known_factorization.q_matrix, known_factorization.r_matrix
+    elif known_factorization is not None and strategy == ss.STRATEGY_AUTO and known_factorization.is_eliminated():
+        # Factored under "auto" already, so the matrix is known to be rank deficient
+        return None
+    else:
+        q_matrix, r_matrix = ss.factorFullRank(original_matrix.astype(float))
+
+    if q_matrix is None:
+        if strategy == ss.STRATEGY_AUTO:
+            return None
+        ss.solver_statistics.record(ss.PATH_LAPACK_LSTSQ)
+        return np.linalg.lstsq(original_matrix, resulting_matrix, rcond=None)[0]
+    if original_matrix.shape[0] == original_matrix.shape[1]:
+        ss.solver_statistics.record(ss.PATH_LAPACK_SOLVE)
+        if known_factorization is None:
+            return np.linalg.solve(original_matrix, resulting_matrix)
+    else:
+        ss.solver_statistics.record(ss.PATH_QR_LEAST_SQUARES)
+    return ss.solveFactored(q_matrix, r_matrix, resulting_matrix)
 
 
 def solveEquation(original_matrix: 'np.ndarray', resulting_matrix: 'np.ndarray',
                   known_history: List['ge.ThreadBlock'] = None,
-                  multiprocessing_pool: "Pool" = None):
+                  multiprocessing_pool: "Pool" = None,
+                  known_factorization: 'FactoredSystem' = None, rng: 'np.random.Generator' = None):
+    # Free variables are drawn from rng, or from the global numpy random state if it is not given.
+    # Systems of full column rank are handed to numpy.linalg unless the gaussian strategy was selected.
+    # A known history means original_matrix is already eliminated, so it always stays on the gaussian path
+    strategy = ss.getSolverStrategy()
+    if known_history is None and not strategy == ss.STRATEGY_GAUSSIAN:
+        direct_solution = solveDirect(original_matrix, resulting_matrix, strategy, known_factorization)
+        if direct_solution is not None:
+            return direct_solution
+    if known_factorization is not None and not known_factorization.is_eliminated():
+        # Factored under a different strategy, eliminate from scratch
+        known_factorization = None
+    ss.solver_statistics.record(ss.PATH_GAUSSIAN)
+
     use_multiprocessing = multiprocessing_pool is not None
-    if use_multiprocessing:
+    if use_multiprocessing and ge.multipool is not multiprocessing_pool:
+        # Keeps a worker count given to enableMultiprocessing for this pool
         ge.enableMultiprocessing(multiprocessing_pool)
 
     # If we have a known change history, then assume original matrix is in gauss eliminated form
     operating_history = known_history
-    working_original_matrix = original_matrix.copy()
-    working_resulting_matrix = resulting_matrix.copy()
-    orig_max = np.max(working_original_matrix)
-    resulting_max = np.max(working_resulting_matrix)
-    div = max(orig_max, resulting_max)
-    working_original_matrix /= div
-    working_resulting_matrix /= div
+    if known_factorization is not None:
+        # original_matrix was already eliminated, only the resulting matrix needs the same treatment
+        operating_history = known_factorization.history
+        working_original_matrix = known_factorization.reduced_matrix
+        div = known_factorization.scale
+        working_resulting_matrix = resulting_matrix / div
+    else:
+        working_original_matrix = original_matrix.copy()
+        working_resulting_matrix = resulting_matrix.copy()
+        orig_max = np.max(working_original_matrix)
+        resulting_max = np.max(working_resulting_matrix)
+        div = max(orig_max, resulting_max)
+        working_original_matrix /= div
+        working_resulting_matrix /= div
     # If matrix multiplication is on the left, assume that the arguments are passed in transposed already
 
     if operating_history is None:
         operating_history = ge.gaussian_elimination(working_original_matrix, use_multiprocessing)
     ge.execute_history(operating_history, working_resulting_matrix, use_multiprocessing)
 
+    # Every column shares the same pivots, so all of them are classified and back-substituted together
+    pivot_positions = getPivotPositions(working_original_matrix)
+    solve_status = classifySolveStatus(working_original_matrix, working_resulting_matrix, pivot_positions)
     ret_matrix = np.zeros((original_matrix.shape[1], resulting_matrix.shape[1]))
-    for i in range(ret_matrix.shape[1]):
-        curr_res_col = working_resulting_matrix[:, [i]]
-        solve_status, pivot_positions = systemSolveStatus(working_original_matrix, curr_res_col)
-        if solve_status == 0:
-            ret_matrix[:, [i]] = extractSingleSolution(working_original_matrix, curr_res_col, pivot_positions)
-        elif solve_status == 1:
-            # construct a pvf of the solution and do a small, random solution
-            ret_matrix[:, [i]] = extractInfSolution(working_original_matrix, curr_res_col, pivot_positions)
-        else:
-            # left multiply be the transpose for both and re-solve.
-            working_orig_matrix_trans = working_original_matrix.T
-            reval_org_matrix = working_orig_matrix_trans @ working_original_matrix
-            reval_res_col = working_orig_matrix_trans @ curr_res_col
-            reval_hist = ge.gaussian_elimination(reval_org_matrix, use_multiprocessing)
-            ge.execute_history(reval_hist, reval_res_col, use_multiprocessing)
-            solve_status, pivot_positions = systemSolveStatus(reval_org_matrix, reval_res_col)
-            if solve_status == 0:
-                ret_matrix[:, [i]] = extractSingleSolution(reval_org_matrix, reval_res_col, pivot_positions)
-            elif solve_status == 1:
-                # construct pvf of the solution, do a small random solution
-                ret_matrix[:, [i]] = extractInfSolution(reval_org_matrix, reval_res_col, pivot_positions)
-            else:
-                raise ValueError("System solving failed. This really shouldn't happen in theory.")
-            pass
+    consistent_cols = np.flatnonzero(solve_status != 2)
+    inconsistent_cols = np.flatnonzero(solve_status == 2)
+    if len(consistent_cols) > 0:
+        ret_matrix[:, consistent_cols] = extractSolutions(working_original_matrix,
+                                                          working_resulting_matrix[:, consistent_cols],
+                                                          pivot_positions, rng)
+    if len(inconsistent_cols) > 0:
+        # left multiply the (scaled, not eliminated) system by the transpose for both and re-solve,
+        # eliminating the normal equations only once for every inconsistent column
+        working_orig_matrix_trans = original_matrix.T / div
+        normal_system = known_factorization.normal_system if known_factorization is not None else None
+        if normal_system is None:
+            normal_system = eliminateSystem(working_orig_matrix_trans @ working_orig_matrix_trans.T,
+                                            use_multiprocessing)
+            if known_factorization is not None:
+                known_factorization.normal_system = normal_system
+        reval_res = working_orig_matrix_trans @ (resulting_matrix[:, inconsistent_cols] / div) / normal_system.scale
+        ge.execute_history(normal_system.history, reval_res, use_multiprocessing)
+        # The normal equations are always consistent, anything left in their non-pivot rows is round off
+        reval_pivots = getPivotPositions(normal_system.reduced_matrix)
+        ret_matrix[:, inconsistent_cols] = extractSolutions(normal_system.reduced_matrix, reval_res,
+                                                            reval_pivots, rng)
     return ret_matrix
+
+
+def solveEquationShared(original_matrix: 'np.ndarray', resulting_matrices: 'np.ndarray',
+                        multiprocessing_pool: "Pool" = None, known_factorization: 'FactoredSystem' = None,
+                        rng: 'np.random.Generator' = None):
+    """
+        Solves original_matrix @ X[b] = resulting_matrices[b] for every b in a stack of shape (batch, rows, cols).
+        Since every system shares original_matrix, the stack is laid out side by side as the columns of a
+        single augmentation and solved with one elimination.
+    """
+    batch, rows, cols = resulting_matrices.shape
+    stacked = resulting_matrices.transpose(1, 0, 2).reshape(rows, batch * cols)
+    solved = solveEquation(original_matrix, stacked, multiprocessing_pool=multiprocessing_pool,
+                           known_factorization=known_factorization, rng=rng)
+    return solved.reshape(solved.shape[0], batch, cols).transpose(1, 0, 2)
+
+
+def _solveReducedBatch(augmented: 'np.ndarray', num_cols: int,
+                       rng: 'np.random.Generator' = None) -> Tuple['np.ndarray', 'np.ndarray']:
+    """
+        Solves a stack of augmented systems [A | B] with the semantics of solveEquation's consistent path.
+        Returns the solutions together with a (batch, cols of B) mask of the columns that had no solution.
+    """
+    pivot_cols = ge.gaussian_elimination_batch(augmented, num_cols)
+    reduced = augmented[..., :num_cols]
+    augmentation = augmented[..., num_cols:]
+    has_pivot = pivot_cols >= 0
+    inconsistent = np.any((augmentation != 0) & ~has_pivot[..., np.newaxis], axis=1)
+
+    # Free variables whose column is not entirely zero are given a random value, as extractSolutions does
+    is_pivot_col = np.zeros((augmented.shape[0], num_cols), bool)
+    sys_idx, row_idx = np.nonzero(has_pivot)
+    is_pivot_col[sys_idx, pivot_cols[sys_idx, row_idx]] = True
+    dependent = ~is_pivot_col & np.any(reduced != 0, axis=1)
+    solutions = _random_source(rng).random((augmented.shape[0], num_cols, augmentation.shape[2]))
+    solutions *= dependent[..., np.newaxis]
+    substituted = augmentation - reduced @ solutions
+    solutions[sys_idx, pivot_cols[sys_idx, row_idx]] = substituted[sys_idx, row_idx]
+    return solutions, inconsistent
+
+
+def _solveStackedSystems(original_matrices: 'np.ndarray', resulting_matrices: 'np.ndarray',
+                         rng: 'np.random.Generator' = None) -> 'np.ndarray':
+    strategy = ss.getSolverStrategy()
+    if strategy == ss.STRATEGY_GAUSSIAN:
+        ss.solver_statistics.record(ss.PATH_GAUSSIAN, original_matrices.shape[0])
+        return _eliminateStackedSystems(original_matrices, resulting_matrices, rng)
+    batch, rows, cols = original_matrices.shape
+    full_rank, q_matrices, r_matrices = ss.factorFullRankBatch(original_matrices)
+    solutions = np.zeros((batch, cols, resulting_matrices.shape[2]))
+    direct = np.flatnonzero(full_rank)
+    if len(direct) > 0:
+        if rows == cols:
+            ss.solver_statistics.record(ss.PATH_LAPACK_SOLVE, len(direct))
+            solutions[direct] = np.linalg.solve(original_matrices[direct], resulting_matrices[direct])
+        else:
+            ss.solver_statistics.record(ss.PATH_QR_LEAST_SQUARES, len(direct))
+            solutions[direct] = ss.solveFactored(q_matrices[direct], r_matrices[direct], resulting_matrices[direct])
+    deficient = np.flatnonzero(~full_rank)
+    if len(deficient) > 0:
+        if strategy == ss.STRATEGY_LAPACK:
+            ss.solver_statistics.record(ss.PATH_LAPACK_LSTSQ, len(deficient))
+            for idx in deficient:
+                solutions[idx] = np.linalg.lstsq(original_matrices[idx], resulting_matrices[idx], rcond=None)[0]
+        else:
+            ss.solver_statistics.record(ss.PATH_GAUSSIAN, len(deficient))
+            solutions[deficient] = _eliminateStackedSystems(original_matrices[deficient],
+                                                            resulting_matrices[deficient], rng)
+    return solutions
+
+
+def _eliminateStackedSystems(original_matrices: 'np.ndarray', resulting_matrices: 'np.ndarray',
+                             rng: 'np.random.Generator' = None) -> 'np.ndarray':
+    batch, rows, cols = original_matrices.shape
+    div = np.max(np.abs(original_matrices), axis=(1, 2), initial=0.0)
+    div = np.maximum(div, np.max(np.abs(resulting_matrices), axis=(1, 2), initial=0.0))
+    div[div == 0] = 1.0
+    div = div[:, np.newaxis, np.newaxis]
+    augmented = np.concatenate((original_matrices / div, resulting_matrices / div), axis=2)
+    solutions, inconsistent = _solveReducedBatch(augmented, cols, rng)
+
+    systems = np.flatnonzero(np.any(inconsistent, axis=1))
+    if len(systems) > 0:
+        # Inconsistent columns are solved in the least squares sense through the normal equations,
+        # which are always consistent so anything left in their non-pivot rows is round off
+        trans = original_matrices[systems].transpose(0, 2, 1) / div[systems]
+        normal = trans @ trans.transpose(0, 2, 1)
+        normal_res = trans @ (resulting_matrices[systems] / div[systems])
+        normal_div = np.max(np.abs(normal), axis=(1, 2), initial=0.0)
+        normal_div[normal_div == 0] = 1.0
+        normal_div = normal_div[:, np.newaxis, np.newaxis]
+        least_squares, _ = _solveReducedBatch(np.concatenate((normal / normal_div, normal_res / normal_div), axis=2),
+                                              cols, rng)
+        use_least_squares = inconsistent[systems][:, np.newaxis, :]
+        solutions[systems] = np.where(use_least_squares, least_squares, solutions[systems])
+    return solutions
+
+
+def solveEquationBatch(original_matrices: Union['np.ndarray', Sequence['np.ndarray']],
+                       resulting_matrices: Union['np.ndarray', Sequence['np.ndarray']],
+                       rng: 'np.random.Generator' = None) -> Union['np.ndarray', List['np.ndarray']]:
+    """
+        Solves original_matrices[i] @ X[i] = resulting_matrices[i] for many independent systems at once.
+
+        Given (batch, rows, cols) and (batch, rows, k) stacks, the whole stack is eliminated together and a
+        (batch, cols, k) stack is returned. Given sequences of matrices, systems are grouped by shape, each group
+        is solved as one stack and a list of solutions in the original order is returned.
+        Every system keeps solveEquation's semantics, including the solver strategy: unique solutions are exact,
+        free variables of consistent systems are chosen at random and columns without a solution are solved in
+        the least squares sense. Free variables are drawn from rng, or from the global numpy random state if it
+        is not given.
+    """
+    if isinstance(original_matrices, np.ndarray) and isinstance(resulting_matrices, np.ndarray):
+        if original_matrices.ndim == 3:
+            if not original_matrices.shape[:2] == resulting_matrices.shape[:2]:
+                raise ValueError("Stacked systems must have matching batch sizes and row counts")
+            return _solveStackedSystems(original_matrices.astype(float), resulting_matrices.astype(float), rng)
+    if not len(original_matrices) == len(resulting_matrices):
+        raise ValueError("Every original matrix requires exactly one resulting matrix")
+    groups = {}
+    for idx, (original, resulting) in enumerate(zip(original_matrices, resulting_matrices)):
+        if not original.shape[0] == resulting.shape[0]:
+            raise ValueError("System " + str(idx) + " has mismatched row counts")
+        groups.setdefault((original.shape, resulting.shape), []).append(idx)
+    ret_list: List['np.ndarray'] = [None] * len(original_matrices)
+    for indices in groups.values():
+        solved = _solveStackedSystems(np.array([original_matrices[i] for i in indices], float),
+                                      np.array([resulting_matrices[i] for i in indices], float), rng)
+        for solution, idx in zip(solved, indices):
+            ret_list[idx] = solution
+    return ret_list
@@ -23,24 +23,41 @@ def scale_row(matrix: 'np.ndarray', row: int, scale: float):
     return matrix[row], row
 
 
+def eliminate_rows(matrix: 'np.ndarray', pivot_row: int, rows: 'np.ndarray', scales: 'np.ndarray'):
+    """
+        Subtracts scales[i] times pivot_row from rows[i] for every i, as one rank-1 update.
+        pivot_row must not be one of rows.
+    """
+    if len(rows) > 0 and rows[-1] - rows[0] + 1 == len(rows):
+        # Dense runs of rows are updated through a view rather than gathered and scattered
+        rows = slice(rows[0], rows[-1] + 1)
+    matrix[rows] -= scales[:, np.newaxis] * matrix[pivot_row]
+    return matrix[rows], rows
+
+
+def scale_rows(matrix: 'np.ndarray', rows: 'np.ndarray', scales: 'np.ndarray'):
+    matrix[rows] *= scales[:, np.newaxis]
+    return matrix[rows], rows
+
+
 def swap_nonzero(matrix: 'np.ndarray', start_row: int, col: int):
     action = None
-    for r in range(start_row + 1, matrix.shape[0]):
-        if not matrix[r][col] == 0:
-            swap_row(matrix, start_row, r)
-            action = swap_row, (start_row, r)
-            break
+    nonzero_rows = np.flatnonzero(matrix[start_row + 1:, col])
+    if len(nonzero_rows) > 0:
+        r = start_row + 1 + nonzero_rows[0]
+        swap_row(matrix, start_row, r)
+        action = swap_row, (start_row, r)
     return matrix, action
 
 
 def getPivotPositions(matrix: 'np.ndarray') -> List[Tuple[int, int]]:
     pivots: List[Tuple[int, int]] = []
     last_col = 0
+    nonzero = matrix != 0
     for row in range(matrix.shape[0]):
-        for col in range(last_col, matrix.shape[1]):
-            mat_val = matrix[row][col]
-            if not mat_val == 0:
-                pivots.append((row, col))
-                last_col = col+1
-                break
+        nonzero_cols = np.flatnonzero(nonzero[row, last_col:])
+        if len(nonzero_cols) > 0:
+            col = last_col + int(nonzero_cols[0])
+            pivots.append((row, col))
+            last_col = col+1
     return pivots
@@ -0,0 +1,96 @@
+import os
+import tempfile
+from typing import TYPE_CHECKING, List, Union
+
+import numpy as np
+
+from matrix.CompactHistory import CompactHistory, OP_SWAP, OP_SUBTRACT, OP_SCALE
+
+if TYPE_CHECKING:
+    from multiprocessing.pool import Pool
+    from matrix.GaussianEliminator import ThreadBlock
+
+# Row operations touching fewer elements than this are applied by the owning process, since handing
+# them to the pool costs more than the update itself
+min_parallel_elements = 1 << 16
+
+
+def _shared_directory() -> str:
+    # Files under /dev/shm live in memory, elsewhere the page cache still shares one copy between processes
+    return "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def _map(path: str, shape: tuple, dtype: str, mode: str) -> 'np.ndarray':
+    # A memory map cannot be empty, so an empty matrix still maps one element
+    size = int(np.prod(shape))
+    return np.memmap(path, np.dtype(dtype), mode, shape=(max(size, 1),))[:size].reshape(shape)
+
+
+def _apply_segment(matrix: 'np.ndarray', opcode: int, row_a: 'np.ndarray', row_b: 'np.ndarray',
+                   scales: 'np.ndarray'):
+    if opcode == OP_SUBTRACT:
+        matrix[row_b] -= scales * matrix[row_a]
+    elif opcode == OP_SCALE:
+        matrix[row_a] *= scales
+    else:
+        matrix[row_b] = matrix[row_b] * scales - matrix[row_a]
+
+
+def _apply_shared_segment(path: str, shape: tuple, dtype: str, opcode: int, row_a: 'np.ndarray',
+                          row_b: 'np.ndarray', scales: 'np.ndarray'):
+    matrix = _map(path, shape, dtype, "r+")
+    _apply_segment(matrix, opcode, row_a, row_b, scales)
+    del matrix
+    return True
+
+
+class SharedMatrix:
+    """
+        A copy of a matrix placed in shared memory once, so that pool workers can apply row operations to it
+        in place. Workers are only ever sent row indices and scales.
+
+        The matrix is a memory mapped file rather than a multiprocessing SharedMemory block, since a worker
+        attaching to such a block registers it with its own resource tracker, which then unlinks it from under
+        the owner. Only the owner creates and removes the file, workers merely map it.
+    """
+
+    def __init__(self, matrix: 'np.ndarray'):
+        handle, self.__path = tempfile.mkstemp(prefix="dnn-", suffix=".matrix", dir=_shared_directory())
+        os.close(handle)
+        self.array = _map(self.__path, matrix.shape, matrix.dtype.str, "w+")
+        self.array[...] = matrix
+
+    def execute(self, history: Union[List['ThreadBlock'], 'CompactHistory'], pool: 'Pool', num_workers: int):
+        if not isinstance(history, CompactHistory):
+            history = CompactHistory.from_thread_blocks(history)
+        for segment in history.segments():
+            self.execute_segment(segment, pool, num_workers)
+
+    def execute_segment(self, segment, pool: 'Pool', num_workers: int):
+        """
+            Applies one segment of row operations, split across the num_workers processes of pool when large.
+        """
+        opcode, row_a, row_b, scales = segment
+        if opcode == OP_SWAP:
+            self.array[[row_a[0], row_b[0]]] = self.array[[row_b[0], row_a[0]]]
+            return
+        row_elements = int(np.prod(self.array.shape[1:]))
+        if num_workers == 1 or len(row_b) < 2 or len(row_b) * row_elements < min_parallel_elements:
+            _apply_segment(self.array, opcode, row_a, row_b, scales)
+            return
+        # Every operation of a segment writes a distinct row, so disjoint row ranges can run concurrently
+        chunks = np.array_split(np.arange(len(row_b)), min(num_workers, len(row_b)))
+        pool.starmap(_apply_shared_segment, [
+            (self.__path, self.array.shape, self.array.dtype.str, opcode, row_a[chunk], row_b[chunk], scales[chunk])
+            for chunk in chunks
+        ])
+
+    def close(self):
+        del self.array
+        os.remove(self.__path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,106 @@
+import threading
+from typing import Dict, Tuple
+
+import numpy as np
+
+STRATEGY_GAUSSIAN = "gaussian"
+STRATEGY_LAPACK = "lapack"
+STRATEGY_AUTO = "auto"
+strategies = (STRATEGY_GAUSSIAN, STRATEGY_LAPACK, STRATEGY_AUTO)
+
+# Paths a solve can take, as reported by SolverStatistics
+PATH_LAPACK_SOLVE = "lapack_solve"
+PATH_QR_LEAST_SQUARES = "qr_least_squares"
+PATH_LAPACK_LSTSQ = "lapack_lstsq"
+PATH_GAUSSIAN = "gaussian"
+
+solver_strategy = STRATEGY_AUTO
+
+stacked_qr_supported = tuple(int(x) for x in np.__version__.split(".")[:2]) >= (1, 22)
+
+
+def setSolverStrategy(strategy: str):
+    """
+        Selects how solveEquation handles systems:
+        gaussian: always gauss eliminate, as the solver originally did
+        lapack: always use numpy.linalg, rank deficient systems are solved with lstsq
+        auto: use numpy.linalg for systems of full column rank and gauss elimination for the rest
+    """
+    global solver_strategy
+    if strategy not in strategies:
+        raise ValueError("Unknown solver strategy " + str(strategy) + ", expected one of " + str(strategies))
+    solver_strategy = strategy
+
+
+def getSolverStrategy() -> str:
+    return solver_strategy
+
+
+class SolverStatistics:
+    """
+        Thread safe counts of the path every solve took, along with the path of the calling thread's last solve.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__counts: Dict[str, int] = {}
+        self.__last = threading.local()
+
+    def record(self, path: str, num_systems: int = 1):
+        with self.__lock:
+            self.__counts[path] = self.__counts.get(path, 0) + num_systems
+        self.__last.path = path
+
+    def last_path(self) -> str:
+        return getattr(self.__last, "path", None)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.__lock:
+            return dict(self.__counts)
+
+    def reset(self):
+        with self.__lock:
+            self.__counts.clear()
+
+
+solver_statistics = SolverStatistics()
+
+
+def factorFullRankBatch(matrices: 'np.ndarray') -> Tuple['np.ndarray', 'np.ndarray', 'np.ndarray']:
+    """
+        Returns the reduced QR factorizations of a (batch, rows, cols) stack together with a mask of the
+        systems that have full column rank. The rank is judged from the diagonal of R with the same tolerance
+        numpy.linalg.matrix_rank uses. Systems with more columns than rows never have full column rank.
+    """
+    batch, rows, cols = matrices.shape
+    if rows < cols or cols == 0 or batch == 0:
+        return np.zeros(batch, bool), None, None
+    if batch == 1 or stacked_qr_supported:
+        q_mats, r_mats = np.linalg.qr(matrices if batch > 1 else matrices[0])
+        q_mats, r_mats = q_mats.reshape(batch, rows, cols), r_mats.reshape(batch, cols, cols)
+    else:
+        # numpy before 1.22 only factors a single matrix at a time
+        factors = [np.linalg.qr(matrix) for matrix in matrices]
+        q_mats, r_mats = np.array([x[0] for x in factors]), np.array([x[1] for x in factors])
+    diagonals = np.abs(np.diagonal(r_mats, axis1=1, axis2=2))
+    tolerance = max(rows, cols) * np.finfo(float).eps * np.max(diagonals, axis=1)
+    full_rank = np.all(np.isfinite(diagonals), axis=1) & (np.min(diagonals, axis=1) > tolerance)
+    return full_rank, q_mats, r_mats
+
+
+def factorFullRank(matrix: 'np.ndarray') -> Tuple['np.ndarray', 'np.ndarray']:
+    """
+        Returns the reduced QR factorization of matrix if it has full column rank, otherwise (None, None).
+    """
+    full_rank, q_mats, r_mats = factorFullRankBatch(matrix[np.newaxis])
+    if not full_rank[0]:
+        return None, None
+    return q_mats[0], r_mats[0]
+
+
+def solveFactored(q_mat: 'np.ndarray', r_mat: 'np.ndarray', resulting_matrix: 'np.ndarray') -> 'np.ndarray':
+    """
+        Solves (in the least squares sense when q_mat is not square) with factorizations from factorFullRank
+        or factorFullRankBatch.
+    """
+    return np.linalg.solve(r_mat, np.swapaxes(q_mat, -1, -2) @ resulting_matrix)
@@ -0,0 +1,248 @@
+import asyncio
+import struct
+from io import BytesIO
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+import numpy as np
+
+from serving import default_max_batch_size, default_max_batch_wait, default_max_frame_size
+
+if TYPE_CHECKING:
+    from components.DNNExecutionContext import DNNExecutionContext
+    from components.DNNNetwork import DynamicNeuralNetwork
+
+# Socket frames are a 4 byte big endian payload length followed by the payload. Responses put a status byte
+# in front of the length, the payload is then either the outputs or a utf-8 error message.
+frame_header = struct.Struct(">I")
+status_ok = 0
+status_error = 1
+
+
+def encode_arrays(arrays: List['np.ndarray']) -> bytes:
+    buffer = BytesIO()
+    np.savez(buffer, *arrays)
+    return buffer.getvalue()
+
+
+def decode_arrays(payload: bytes) -> List['np.ndarray']:
+    with np.load(BytesIO(payload), allow_pickle=False) as data:
+        return [data["arr_" + str(i)] for i in range(len(data.files))]
+
+
+class FrameTooLargeError(ValueError):
+    def __init__(self, message):
+        super().__init__(message)
+
+
+async def read_frame(reader: 'asyncio.StreamReader', max_size: int = None) -> bytes:
+    """
+        Reads one frame, raising FrameTooLargeError before reading a payload longer than max_size.
+    """
+    header = await reader.readexactly(frame_header.size)
+    size = frame_header.unpack(header)[0]
+    if max_size is not None and size > max_size:
+        raise FrameTooLargeError("Frame of " + str(size) + " bytes exceeds the limit of " + str(max_size))
+    return await reader.readexactly(size)
+
+
+class DNNServerStatistics:
+    """
+        Queue depth and batch size counters of a DNNBatchingServer. Only updated from the event loop.
+    """
+
+    def __init__(self):
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.requests_served = 0
+        self.batches_run = 0
+        self.batch_size_histogram: Dict[int, int] = {}
+
+    def record_queue_depth(self, depth: int):
+        self.queue_depth = depth
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def record_batch(self, batch_size: int):
+        self.batches_run += 1
+        self.requests_served += batch_size
+        self.batch_size_histogram[batch_size] = self.batch_size_histogram.get(batch_size, 0) + 1
+
+    def snapshot(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "requests_served": self.requests_served,
+            "batches_run": self.batches_run,
+            "batch_size_histogram": dict(self.batch_size_histogram),
+        }
+
+
+class DNNBatchingServer:
+    """
+        Serves single sample inference requests, coalescing whatever is queued into one batched forward pass.
+
+        A batch is closed once it holds max_batch_size requests, or max_batch_wait seconds after its first
+        request arrived. Batches run one at a time through an execution context on a worker thread, so the
+        event loop keeps accepting requests meanwhile and the network itself is never written to.
+        Requests are submitted in process with submit, or over a local socket opened with serve_socket, where
+        request frames longer than max_frame_size bytes are refused and their connection closed.
+    """
+
+    def __init__(self, network: 'DynamicNeuralNetwork', max_batch_size: int = None, max_batch_wait: float = None,
+                 max_frame_size: int = None):
+        self.network = network
+        self.max_frame_size = max_frame_size if max_frame_size is not None else default_max_frame_size
+        self.max_batch_size = max_batch_size if max_batch_size is not None else default_max_batch_size
+        self.max_batch_wait = max_batch_wait if max_batch_wait is not None else default_max_batch_wait
+        if self.max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.statistics = DNNServerStatistics()
+        self.__context: 'DNNExecutionContext' = None
+        self.__queue: 'asyncio.Queue' = None
+        self.__batching_task: 'asyncio.Task' = None
+        self.__socket_servers: List['asyncio.AbstractServer'] = []
+
+    async def start(self):
+        if self.__batching_task is not None:
+            raise ValueError("Server is already running")
+        self.__context = self.network.create_execution_context()
+        self.__queue = asyncio.Queue()
+        self.__batching_task = asyncio.get_running_loop().create_task(self.__run_batches())
+
+    async def stop(self):
+        for socket_server in self.__socket_servers:
+            socket_server.close()
+            await socket_server.wait_closed()
+        self.__socket_servers.clear()
+        if self.__batching_task is not None:
+            self.__batching_task.cancel()
+            try:
+                await self.__batching_task
+            except asyncio.CancelledError:
+                pass
+            self.__batching_task = None
+        while self.__queue is not None and not self.__queue.empty():
+            _, future = self.__queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Server stopped before the request was served"))
+        self.statistics.record_queue_depth(0)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+    async def submit(self, input_data: List['np.ndarray']) -> List['np.ndarray']:
+        """
+            Queues one unbatched sample per input node and returns one matrix per output node once served.
+        """
+        if self.__batching_task is None:
+            raise ValueError("Server is not running, did you call start?")
+        if self.network.validate_input_data(input_data) is not None:
+            raise ValueError("Requests must hold a single sample, batching is done by the server")
+        future = asyncio.get_running_loop().create_future()
+        self.__queue.put_nowait((input_data, future))
+        self.statistics.record_queue_depth(self.__queue.qsize())
+        return await future
+
+    async def __collect_batch(self) -> List[Tuple[List['np.ndarray'], 'asyncio.Future']]:
+        loop = asyncio.get_running_loop()
+        batch = [await self.__queue.get()]
+        deadline = loop.time() + self.max_batch_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0 and self.__queue.empty():
+                break
+            try:
+                batch.append(self.__queue.get_nowait() if not self.__queue.empty()
+                             else await asyncio.wait_for(self.__queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        self.statistics.record_queue_depth(self.__queue.qsize())
+        # Requests cancelled while queued need no answer
+        return [(input_data, future) for input_data, future in batch if not future.done()]
+
+    async def __run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.__collect_batch()
+            if len(batch) == 0:
+                continue
+            stacked_inputs = [np.stack([input_data[i] for input_data, _ in batch])
+                              for i in range(self.network.num_inputs)]
+            try:
+                outputs = await loop.run_in_executor(None, self.__context.run, stacked_inputs)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.statistics.record_batch(len(batch))
+            for sample, (_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result([output[sample] for output in outputs])
+
+    async def serve_socket(self, host: str = "127.0.0.1", port: int = 0) -> Tuple[str, int]:
+        """
+            Accepts requests over TCP on host, returning the address actually bound (port 0 picks a free port).
+            Each request frame holds the inputs encoded with encode_arrays, and is answered by a status byte and
+            a frame holding either the encoded outputs or an error message.
+        """
+        socket_server = await asyncio.start_server(self.__handle_connection, host, port)
+        self.__socket_servers.append(socket_server)
+        return socket_server.sockets[0].getsockname()[:2]
+
+    async def __handle_connection(self, reader: 'asyncio.StreamReader', writer: 'asyncio.StreamWriter'):
+        try:
+            while True:
+                try:
+                    payload = await read_frame(reader, self.max_frame_size)
+                except asyncio.IncompleteReadError:
+                    break
+                except FrameTooLargeError as e:
+                    # The payload is never read, so the stream cannot be resynchronized
+                    await self.__reply(writer, status_error, str(e).encode("utf-8"))
+                    break
+                try:
+                    status, response = status_ok, encode_arrays(await self.submit(decode_arrays(payload)))
+                except Exception as e:
+                    # Anything a malformed request raises is reported to the client instead of dropping it
+                    status, response = status_error, (str(e) or type(e).__name__).encode("utf-8")
+                await self.__reply(writer, status, response)
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def __reply(writer: 'asyncio.StreamWriter', status: int, response: bytes):
+        writer.write(bytes([status]) + frame_header.pack(len(response)) + response)
+        await writer.drain()
+
+
+class DNNServingClient:
+    """
+        Minimal client for DNNBatchingServer.serve_socket, sending one request at a time over one connection.
+    """
+
+    def __init__(self, reader: 'asyncio.StreamReader', writer: 'asyncio.StreamWriter'):
+        self.__reader = reader
+        self.__writer = writer
+
+    @classmethod
+    async def connect(cls, host: str, port: int) -> 'DNNServingClient':
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def request(self, input_data: List['np.ndarray']) -> List['np.ndarray']:
+        payload = encode_arrays(input_data)
+        self.__writer.write(frame_header.pack(len(payload)) + payload)
+        await self.__writer.drain()
+        status = (await self.__reader.readexactly(1))[0]
+        response = await read_frame(self.__reader)
+        if not status == status_ok:
+            raise ValueError(response.decode("utf-8"))
+        return decode_arrays(response)
+
+    async def close(self):
+        self.__writer.close()
+        await self.__writer.wait_closed()
@@ -0,0 +1,3 @@
+default_max_batch_size = 32
+default_max_batch_wait = .002
+default_max_frame_size = 16 << 20
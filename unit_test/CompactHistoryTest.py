@@ -0,0 +1,43 @@
+import pickle
+import unittest
+
+import numpy as np
+
+import matrix.GaussianEliminator as ge
+from matrix.CompactHistory import CompactHistory
+
+
+class CompactHistoryTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        # The zero leading entry forces a row swap into the history
+        self.test_arr = np.array([[0, 2, 1, 4], [3, 1, 1, 2], [1, 5, 2, 2], [2, 2, 7, 1]], float)
+        self.history = ge.gaussian_elimination(self.test_arr.copy())
+        self.compact = CompactHistory.from_thread_blocks(self.history)
+
+    def test_replay_matches_thread_blocks(self):
+        rhs = np.random.random((4, 3))
+        expected = rhs.copy()
+        ge.execute_history(self.history, expected, False)
+        replayed = rhs.copy()
+        ge.execute_history(self.compact, replayed, False)
+        self.assertTrue(np.allclose(expected, replayed))
+
+    def test_replay_onto_stacked_matrices(self):
+        stack = np.random.random((5, 4, 2))
+        replayed = self.compact.replay(stack.copy())
+        for i in range(stack.shape[0]):
+            expected = stack[i].copy()
+            ge.execute_history(self.history, expected, False)
+            self.assertTrue(np.allclose(expected, replayed[i]))
+
+    def test_serialization_round_trip(self):
+        restored = CompactHistory.frombytes(self.compact.tobytes())
+        self.assertTrue(np.array_equal(restored.operations, self.compact.operations))
+        unpickled = pickle.loads(pickle.dumps(self.compact))
+        rhs = np.random.random((4, 1))
+        self.assertTrue(np.array_equal(unpickled.replay(rhs.copy()), self.compact.replay(rhs.copy())))
+
+
+if __name__ == '__main__':
+    unittest.main()
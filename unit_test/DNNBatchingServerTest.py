@@ -0,0 +1,84 @@
+import asyncio
+import unittest
+
+import numpy as np
+
+from components.DNNNetwork import DynamicNeuralNetwork
+from serving.DNNBatchingServer import DNNBatchingServer, DNNServingClient, frame_header, read_frame, status_error
+
+
+class DNNBatchingServerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.network = DynamicNeuralNetwork([(1, 2), (3, 4)], [(2, 3)],
+                                            input_node_connectivity=1.0, output_node_connectivity=1.0)
+        self.requests = [[np.random.random((1, 2)), np.random.random((3, 4))] for _ in range(10)]
+        self.expected = [self.network.create_execution_context().run(inputs)[0] for inputs in self.requests]
+
+    def test_requests_are_coalesced(self):
+        async def serve():
+            async with DNNBatchingServer(self.network, max_batch_size=4, max_batch_wait=.05) as server:
+                outputs = await asyncio.gather(*[server.submit(inputs) for inputs in self.requests])
+                return outputs, server.statistics.snapshot()
+
+        outputs, stats = asyncio.run(serve())
+        for output, expected in zip(outputs, self.expected):
+            self.assertTrue(np.allclose(output[0], expected))
+        self.assertEqual(stats["requests_served"], 10)
+        self.assertEqual(stats["batch_size_histogram"], {4: 2, 2: 1})
+        self.assertEqual(stats["max_queue_depth"], 10)
+        self.assertEqual(stats["queue_depth"], 0)
+
+    def test_requests_over_socket(self):
+        async def serve():
+            async with DNNBatchingServer(self.network, max_batch_size=8) as server:
+                host, port = await server.serve_socket()
+                client = await DNNServingClient.connect(host, port)
+                try:
+                    outputs = [await client.request(inputs) for inputs in self.requests[:3]]
+                    with self.assertRaises(ValueError):
+                        await client.request([np.random.random((2, 2)), np.random.random((3, 4))])
+                    # The connection stays usable after an error response
+                    outputs.append(await client.request(self.requests[3]))
+                finally:
+                    await client.close()
+                return outputs
+
+        outputs = asyncio.run(serve())
+        for output, expected in zip(outputs, self.expected):
+            self.assertTrue(np.allclose(output[0], expected))
+
+    def test_malformed_frames_answered(self):
+        async def serve():
+            async with DNNBatchingServer(self.network, max_frame_size=1024) as server:
+                host, port = await server.serve_socket()
+                reader, writer = await asyncio.open_connection(host, port)
+                try:
+                    # A truncated npz archive, which numpy reports as a BadZipFile rather than a ValueError
+                    writer.write(frame_header.pack(8) + b"PK\x03\x04junk")
+                    await writer.drain()
+                    garbage_status = (await reader.readexactly(1))[0]
+                    await read_frame(reader)
+                    writer.write(frame_header.pack(1 << 31))
+                    await writer.drain()
+                    oversize_status = (await reader.readexactly(1))[0]
+                    await read_frame(reader)
+                    # The server closes the connection rather than reading the oversized payload
+                    closed = await reader.read() == b""
+                finally:
+                    writer.close()
+                return garbage_status, oversize_status, closed
+
+        self.assertEqual(asyncio.run(serve()), (status_error, status_error, True))
+
+    def test_batched_submission_rejected(self):
+        async def serve():
+            async with DNNBatchingServer(self.network) as server:
+                await server.submit([np.random.random((2, 1, 2)), np.random.random((2, 3, 4))])
+
+        with self.assertRaises(ValueError):
+            asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from components.DNNCheckpointer import DNNCheckpointer, restore_checkpoint, base_file_name, delta_file_name
+from components.DNNNetwork import DynamicNeuralNetwork
+
+
+class DNNCheckpointerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.network = DynamicNeuralNetwork([(1, 2), (3, 4)], [(2, 3)],
+                                            input_node_connectivity=1.0, output_node_connectivity=1.0)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def train_step(self):
+        # Small random updates stand in for backpropagation, which can diverge on random targets
+        arena = self.network.weight_arena()
+        arena.changes[:] = np.random.uniform(-.01, .01, arena.num_weights)
+        self.network.update_weights()
+
+    def assertRestored(self):
+        restored = restore_checkpoint(self.directory)
+        self.assertEqual([c.connection_id for c in restored.compile_execution_plan().connections],
+                         [c.connection_id for c in self.network.compile_execution_plan().connections])
+        self.assertTrue(np.array_equal(restored.weight_arena().weights, self.network.weight_arena().weights))
+
+    def test_restore_replays_deltas(self):
+        checkpointer = DNNCheckpointer(self.network, self.directory, interval=2)
+        for _ in range(6):
+            self.train_step()
+            checkpointer.step()
+        self.assertEqual(checkpointer.num_records, 3)
+        self.assertRestored()
+
+    def test_records_hold_only_changed_connections(self):
+        checkpointer = DNNCheckpointer(self.network, self.directory)
+        log_path = os.path.join(self.directory, delta_file_name)
+        checkpointer.checkpoint()
+        empty_size = os.path.getsize(log_path)
+        connection = self.network.compile_execution_plan().connections[0]
+        connection.weight_a += 1
+        checkpointer.checkpoint()
+        self.assertLess(os.path.getsize(log_path) - empty_size,
+                        empty_size + 8 * (connection.weight_a.size + connection.weight_b.size) + 64)
+        self.assertRestored()
+
+    def test_compaction(self):
+        checkpointer = DNNCheckpointer(self.network, self.directory, compact_every=2)
+        for _ in range(3):
+            self.train_step()
+            checkpointer.checkpoint()
+        self.assertEqual(checkpointer.num_records, 0)
+        self.assertEqual(os.path.getsize(os.path.join(self.directory, delta_file_name)), 0)
+        self.assertRestored()
+
+    def test_crash_during_compaction_keeps_new_base(self):
+        checkpointer = DNNCheckpointer(self.network, self.directory)
+        for _ in range(2):
+            self.train_step()
+            checkpointer.checkpoint()
+        log_path = os.path.join(self.directory, delta_file_name)
+        with open(log_path, "rb") as log_file:
+            log = log_file.read()
+        self.train_step()
+        checkpointer.compact()
+        # As though the crash came after the base was replaced but before the log was emptied
+        with open(log_path, "wb") as log_file:
+            log_file.write(log)
+        self.assertRestored()
+        resumed = DNNCheckpointer(self.network, self.directory)
+        self.assertGreater(resumed.sequence, checkpointer.sequence)
+
+    def test_torn_record_is_ignored(self):
+        checkpointer = DNNCheckpointer(self.network, self.directory)
+        self.train_step()
+        checkpointer.checkpoint()
+        weights = self.network.weight_arena().snapshot()
+        self.train_step()
+        checkpointer.checkpoint()
+        log_path = os.path.join(self.directory, delta_file_name)
+        with open(log_path, "r+b") as log_file:
+            log_file.truncate(os.path.getsize(log_path) - 8)
+        self.assertTrue(np.array_equal(restore_checkpoint(self.directory).weight_arena().weights, weights))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, base_file_name)))
+
+
+if __name__ == '__main__':
+    unittest.main()
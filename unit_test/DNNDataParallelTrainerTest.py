@@ -0,0 +1,40 @@
+import unittest
+from copy import deepcopy
+
+import numpy as np
+
+from components.DNNDataParallelTrainer import DNNDataParallelTrainer
+from components.DNNNode import DNNNode
+from unit_test.helpers import build_linear_network
+
+
+class DNNDataParallelTrainerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.network = build_linear_network([(4, 4), (4, 4), (4, 4)])
+        branch = DNNNode((4, 4))
+        self.network.input_nodes[0].add_outgoing_connection(branch)
+        branch.add_outgoing_connection(self.network.output_nodes[0])
+
+    def test_step_matches_single_process(self):
+        reference = deepcopy(self.network)
+        in_data = np.random.random((5, 4, 4)) + np.eye(4)
+        expected = np.random.random((5, 4, 4))
+        reference.perform_backpropagation([in_data], [expected])
+
+        with DNNDataParallelTrainer(self.network, 3, 8) as trainer:
+            trainer.train_step([in_data], [expected])
+            arena = self.network.weight_arena()
+            self.assertTrue(np.allclose(arena.weights, reference.weight_arena().weights))
+            for worker_idx in range(3):
+                self.assertTrue(np.array_equal(trainer.replica_weights(worker_idx), arena.weights))
+            # Replicas keep training from the shared weights
+            trainer.train_step([in_data[:2]], [expected[:2]])
+            reference.perform_backpropagation([in_data[:2]], [expected[:2]])
+            self.assertTrue(np.allclose(arena.weights, reference.weight_arena().weights))
+            with self.assertRaises(ValueError):
+                trainer.train_step([np.random.random((9, 4, 4))], [np.random.random((9, 4, 4))])
+
+
+if __name__ == '__main__':
+    unittest.main()
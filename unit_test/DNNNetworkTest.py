@@ -0,0 +1,450 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+
+import numpy as np
+
+from components.DNNInputNode import DNNInputNode
+from components.DNNNetwork import DynamicNeuralNetwork
+from components.DNNNode import DNNNode
+from unit_test.helpers import build_linear_network
+
+
+class DNNNetworkTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.network = DynamicNeuralNetwork([(1, 2), (3, 4)], [(2, 3)],
+                                            input_node_connectivity=1.0, output_node_connectivity=1.0)
+
+    def test_execution_plan_is_topological(self):
+        plan = self.network.compile_execution_plan()
+        self.assertEqual(len(plan.nodes), len(set(plan.nodes)))
+        for conn_idx in range(len(plan.connections)):
+            self.assertLess(plan.connection_src[conn_idx], plan.connection_dst[conn_idx])
+        for node_idx in range(len(plan.nodes)):
+            for conn_idx in plan.fan_out(node_idx):
+                self.assertEqual(plan.connection_src[conn_idx], node_idx)
+            for conn_idx in plan.fan_in(node_idx):
+                self.assertEqual(plan.connection_dst[conn_idx], node_idx)
+        for out_node in self.network.output_nodes:
+            self.assertTrue(plan.node_index[out_node] not in plan.forward_order)
+        for in_node in self.network.input_nodes:
+            self.assertTrue(plan.node_index[in_node] not in plan.backward_order)
+
+    def test_execution_plan_invalidated_on_new_connection(self):
+        plan = self.network.compile_execution_plan()
+        self.assertIs(plan, self.network.compile_execution_plan())
+        extra_node = DNNNode((2, 2))
+        self.network.input_nodes[0].add_outgoing_connection(extra_node)
+        extra_node.add_outgoing_connection(self.network.output_nodes[0])
+        new_plan = self.network.compile_execution_plan()
+        self.assertIsNot(plan, new_plan)
+        self.assertEqual(len(new_plan.connections), len(plan.connections) + 2)
+        self.assertTrue(extra_node in new_plan.node_index)
+
+    def test_propagate_matches_manual_evaluation(self):
+        # Wire a small diamond by hand so the expected output can be computed directly
+        input_node = DNNInputNode((2, 3))
+        left = DNNNode((3, 2))
+        right = DNNNode((4, 4))
+        network = DynamicNeuralNetwork([(2, 3)], [(2, 2)], num_chains=1,
+                                       input_node_connectivity=1.0, output_node_connectivity=1.0)
+        output_node = network.output_nodes[0]
+        network.input_nodes[0] = input_node
+        output_node.incoming_connections.clear()
+        input_node.add_outgoing_connection(left)
+        input_node.add_outgoing_connection(right)
+        left.add_outgoing_connection(right)
+        right.add_outgoing_connection(output_node)
+
+        in_data = np.random.random((2, 3))
+        conn_in_left, conn_in_right = input_node.outgoing_connections
+        conn_left_right = left.outgoing_connections[0]
+        conn_right_out = right.outgoing_connections[0]
+        left_val = conn_in_left.weight_a @ in_data @ conn_in_left.weight_b
+        right_val = conn_in_right.weight_a @ in_data @ conn_in_right.weight_b + \
+            conn_left_right.weight_a @ left_val @ conn_left_right.weight_b
+        expected = conn_right_out.weight_a @ right_val @ conn_right_out.weight_b
+
+        network.add_input_data([in_data])
+        network.propagate_inputs()
+        outputs = network.extract_output_data()
+        network.clear_incoming_messages()
+        self.assertTrue(np.allclose(outputs[0], expected))
+
+    def test_batched_propagation_matches_single_samples(self):
+        batch = [np.random.random((3, 4, 5)) * 2 - 1, np.random.random((3, 3, 4)) * 2 - 1]
+        network = DynamicNeuralNetwork([(4, 5), (3, 4)], [(2, 3)],
+                                       input_node_connectivity=1.0, output_node_connectivity=1.0)
+        network.add_input_data(batch)
+        network.propagate_inputs()
+        batched_output = network.extract_output_data()[0]
+        network.clear_incoming_messages()
+        self.assertEqual(batched_output.shape, (3, 2, 3))
+        for sample in range(3):
+            network.add_input_data([batch[0][sample], batch[1][sample]])
+            network.propagate_inputs()
+            single_output = network.extract_output_data()[0]
+            network.clear_incoming_messages()
+            self.assertTrue(np.allclose(batched_output[sample], single_output))
+
+    def test_batched_input_validation(self):
+        with self.assertRaises(ValueError):
+            self.network.add_input_data([np.random.random((2, 1, 2)), np.random.random((3, 3, 4))])
+        with self.assertRaises(ValueError):
+            self.network.add_input_data([np.random.random((2, 1, 2)), np.random.random((3, 4))])
+
+    def test_batched_backpropagation_accumulates_over_batch(self):
+        network = build_linear_network([(4, 4), (4, 4), (4, 4)])
+        connections = network.compile_execution_plan().connections
+        in_data = np.random.random((4, 4)) + np.eye(4)
+        expected = np.random.random((4, 4))
+        starting_weights = [(c.weight_a.copy(), c.weight_b.copy()) for c in connections]
+
+        network.perform_backpropagation([in_data], [expected])
+        single_changes = [(c.weight_a - w_a, c.weight_b - w_b) for c, (w_a, w_b) in zip(connections, starting_weights)]
+
+        for connection, (w_a, w_b) in zip(connections, starting_weights):
+            connection.weight_a[:] = w_a
+            connection.weight_b[:] = w_b
+        network.perform_backpropagation([np.stack([in_data, in_data])], [np.stack([expected, expected])])
+        for connection, (w_a, w_b), (d_a, d_b) in zip(connections, starting_weights, single_changes):
+            self.assertTrue(np.allclose(connection.weight_a - w_a, 2 * d_a))
+            self.assertTrue(np.allclose(connection.weight_b - w_b, 2 * d_b))
+
+    def test_tape_backpropagation_matches_message_history(self):
+        network = build_linear_network([(4, 4), (4, 4), (4, 4)])
+        input_node = network.input_nodes[0]
+        branch = DNNNode((4, 4))
+        input_node.add_outgoing_connection(branch)
+        branch.add_outgoing_connection(network.output_nodes[0])
+        legacy_network = deepcopy(network)
+        in_data = np.random.random((4, 4)) + np.eye(4)
+        expected = np.random.random((4, 4))
+
+        network.perform_backpropagation([in_data], [expected])
+        tape = network.activation_tape()
+        self.assertTrue(tape.recorded.all())
+        self.assertEqual(len(tape.original_inputs), len(network.compile_execution_plan().connections))
+
+        # Replay the same step through the message history path, without a tape
+        plan = legacy_network.compile_execution_plan()
+        legacy_network.add_input_data([in_data])
+        for node_idx in plan.forward_order:
+            plan.nodes[node_idx].transmit_data()
+        output_node = legacy_network.output_nodes[0]
+        output = output_node.extract_output()
+        legacy_network.clear_incoming_messages()
+        output_node.outgoing_buffer.contents = expected - output
+        output_node.receive_incoming_message(output_node.outgoing_buffer)
+        output_node.outgoing_buffer = None
+        for node_idx in plan.backward_order:
+            plan.nodes[node_idx].transmit_error()
+        legacy_network.update_weights()
+
+        for connection, legacy_connection in zip(network.compile_execution_plan().connections, plan.connections):
+            self.assertTrue(np.allclose(connection.weight_a, legacy_connection.weight_a))
+            self.assertTrue(np.allclose(connection.weight_b, legacy_connection.weight_b))
+
+    def test_backward_levels_are_independent(self):
+        network = DynamicNeuralNetwork([(4, 4), (4, 4)], [(4, 4), (4, 4)], num_chains=6,
+                                       input_node_connectivity=1.0, output_node_connectivity=1.0)
+        plan = network.compile_execution_plan()
+        scheduled = np.concatenate(plan.backward_levels)
+        self.assertEqual(sorted(scheduled), sorted(plan.backward_order))
+        node_level = {node_idx: level for level, nodes in enumerate(plan.backward_levels) for node_idx in nodes}
+        for conn_idx in range(len(plan.connections)):
+            src, dst = plan.connection_src[conn_idx], plan.connection_dst[conn_idx]
+            if src in node_level and dst in node_level:
+                self.assertGreater(node_level[src], node_level[dst])
+
+    def test_parallel_backpropagation_matches_serial(self):
+        network = build_linear_network([(4, 4), (4, 4), (4, 4), (4, 4)])
+        input_node = network.input_nodes[0]
+        first_node = input_node.outgoing_connections[0].node_out
+        # Several branches share first_node as their predecessor, so error from one level converges on it
+        for _ in range(4):
+            branch = DNNNode((4, 4))
+            first_node.add_outgoing_connection(branch)
+            branch.add_outgoing_connection(network.output_nodes[0])
+        parallel_network = deepcopy(network)
+        parallel_network.set_backprop_workers(4)
+        in_data = np.random.random((3, 4, 4)) + np.eye(4)
+        expected = np.random.random((3, 4, 4))
+
+        network.perform_backpropagation([in_data], [expected])
+        parallel_network.perform_backpropagation([in_data], [expected])
+        parallel_network.shutdown_workers()
+        for connection, parallel_connection in zip(network.compile_execution_plan().connections,
+                                                   parallel_network.compile_execution_plan().connections):
+            self.assertTrue(np.array_equal(connection.weight_a, parallel_connection.weight_a))
+            self.assertTrue(np.array_equal(connection.weight_b, parallel_connection.weight_b))
+
+    def test_forward_components_are_independent_chains(self):
+        network = DynamicNeuralNetwork([(4, 4), (4, 4)], [(4, 4)], num_chains=5,
+                                       input_node_connectivity=1.0, output_node_connectivity=1.0)
+        plan = network.compile_execution_plan()
+        self.assertEqual(len(plan.forward_components), 5)
+        component_of = {node_idx: i for i, members in enumerate(plan.forward_components) for node_idx in members}
+        self.assertEqual(len(component_of) + len(plan.forward_inputs), len(plan.forward_order))
+        for src, dst in zip(plan.connection_src, plan.connection_dst):
+            if src in component_of and dst in component_of:
+                self.assertEqual(component_of[src], component_of[dst])
+
+    def test_seeded_backpropagation_is_reproducible(self):
+        # Wide nodes make row_res underdetermined, so every connection chooses free variables at random
+        network = build_linear_network([(2, 6), (2, 6), (2, 6)])
+        for _ in range(3):
+            branch = DNNNode((2, 6))
+            network.input_nodes[0].add_outgoing_connection(branch)
+            branch.add_outgoing_connection(network.output_nodes[0])
+        in_data = np.random.random((3, 2, 6))
+        expected = np.random.random((3, 2, 6))
+        results = []
+        for num_workers, seed in ((1, 7), (3, 7), (3, 8)):
+            replica = deepcopy(network)
+            replica.set_backprop_workers(num_workers)
+            replica.seed_backpropagation(seed)
+            replica.perform_backpropagation([in_data], [expected])
+            replica.shutdown_workers()
+            results.append(replica.weight_arena().snapshot())
+        self.assertTrue(np.array_equal(results[0], results[1]))
+        self.assertFalse(np.array_equal(results[0], results[2]))
+
+    def test_parallel_forward_matches_serial(self):
+        network = DynamicNeuralNetwork([(4, 5), (3, 4)], [(2, 3), (4, 4)], num_chains=6,
+                                       input_node_connectivity=1.0, output_node_connectivity=1.0)
+        inputs = [np.random.random((2, 4, 5)), np.random.random((2, 3, 4))]
+        network.add_input_data(inputs)
+        network.propagate_inputs()
+        expected = network.extract_output_data()
+        network.clear_incoming_messages()
+
+        network.set_forward_workers(4)
+        network.add_input_data(inputs)
+        network.propagate_inputs()
+        outputs = network.extract_output_data()
+        network.clear_incoming_messages()
+        network.shutdown_workers()
+        for output, expected_output in zip(outputs, expected):
+            self.assertTrue(np.array_equal(output, expected_output))
+
+    def test_execution_contexts_run_concurrently(self):
+        network = DynamicNeuralNetwork([(4, 5), (3, 4)], [(2, 3)], num_chains=4,
+                                       input_node_connectivity=1.0, output_node_connectivity=1.0)
+        requests = [[np.random.random((4, 5)), np.random.random((3, 4))] for _ in range(8)]
+        requests.append([np.random.random((3, 4, 5)), np.random.random((3, 3, 4))])
+        expected = []
+        for inputs in requests:
+            network.add_input_data(inputs)
+            network.propagate_inputs()
+            expected.append(network.extract_output_data()[0].copy())
+            network.clear_incoming_messages()
+        tape = network.activation_tape()
+        tape.begin_pass()
+
+        def run_request(inputs):
+            return network.create_execution_context().run(inputs)[0]
+
+        with ThreadPoolExecutor(4) as executor:
+            outputs = list(executor.map(run_request, requests))
+        for output, expected_output in zip(outputs, expected):
+            self.assertTrue(np.allclose(output, expected_output))
+        # Contexts never write to the network's nodes or its tape
+        self.assertFalse(tape.recorded.any())
+        self.assertTrue(all(len(node.incoming_messages) == 0 for node in network.compile_execution_plan().nodes))
+        with self.assertRaises(ValueError):
+            network.create_execution_context().run([np.random.random((4, 5))])
+
+    def test_fused_network_matches_unfused(self):
+        network = DynamicNeuralNetwork([(4, 5), (3, 4)], [(2, 3), (4, 4)], num_chains=4,
+                                       input_node_connectivity=1.0, output_node_connectivity=1.0)
+        fused = network.fuse_for_inference()
+        # Every chain collapses, leaving at most one term per chain and (input, output) pair
+        components = network.compile_execution_plan().forward_components
+        self.assertEqual(len(fused.eliminated_nodes), sum(len(c) for c in components))
+        self.assertLessEqual(len(fused), 4 * 2 * 2)
+        context = network.create_execution_context()
+        for inputs in ([np.random.random((4, 5)), np.random.random((3, 4))],
+                       [np.random.random((3, 4, 5)), np.random.random((3, 3, 4))]):
+            for output, expected in zip(fused.run(inputs), context.run(inputs)):
+                self.assertTrue(np.allclose(output, expected))
+
+    def test_fusion_keeps_costly_nodes(self):
+        # The hub has fan-in 3 and fan-out 3, removing it would grow 6 terms into 9
+        network = build_linear_network([(3, 3), (3, 3), (3, 3)])
+        input_node = network.input_nodes[0]
+        hub = input_node.outgoing_connections[0].node_out
+        for _ in range(2):
+            before, after = DNNNode((3, 3)), DNNNode((3, 3))
+            input_node.add_outgoing_connection(before)
+            before.add_outgoing_connection(hub)
+            hub.add_outgoing_connection(after)
+            after.add_outgoing_connection(network.output_nodes[0])
+        fused = network.fuse_for_inference()
+        plan = network.compile_execution_plan()
+        self.assertFalse(plan.node_index[hub] in fused.eliminated_nodes)
+        self.assertEqual(len(fused), 6)
+        in_data = np.random.random((3, 3))
+        self.assertTrue(np.allclose(fused.run([in_data])[0], network.create_execution_context().run([in_data])[0]))
+
+    def test_incremental_propagation_matches_full(self):
+        network = DynamicNeuralNetwork([(4, 5), (3, 4), (2, 2)], [(2, 3), (4, 4)], num_chains=4,
+                                       input_node_connectivity=1.0, output_node_connectivity=1.0)
+        context = network.create_execution_context()
+        inputs = [np.random.random((4, 5)), np.random.random((3, 4)), np.random.random((2, 2))]
+        with self.assertRaises(ValueError):
+            network.propagate_changed_inputs({0: inputs[0]})
+        outputs = network.propagate_changed_inputs(dict(enumerate(inputs)))
+        for output, expected in zip(outputs, context.run(inputs)):
+            self.assertTrue(np.allclose(output, expected))
+
+        inputs[1] = np.random.random((3, 4))
+        outputs = network.propagate_changed_inputs({1: inputs[1]})
+        for output, expected in zip(outputs, context.run(inputs)):
+            self.assertTrue(np.allclose(output, expected))
+
+        # Weight updates drop the cached contributions
+        connection = network.compile_execution_plan().connections[0]
+        connection.change_weight_a += 1
+        network.update_weights()
+        with self.assertRaises(ValueError):
+            network.propagate_changed_inputs({2: inputs[2]})
+        outputs = network.propagate_changed_inputs(dict(enumerate(inputs)))
+        for output, expected in zip(outputs, context.run(inputs)):
+            self.assertTrue(np.allclose(output, expected))
+
+        # As does restoring weights
+        network.restore_weights(network.weight_arena().snapshot() * 2)
+        with self.assertRaises(ValueError):
+            network.propagate_changed_inputs({})
+        outputs = network.propagate_changed_inputs(dict(enumerate(inputs)))
+        for output, expected in zip(outputs, context.run(inputs)):
+            self.assertTrue(np.allclose(output, expected))
+
+    def test_demand_driven_outputs(self):
+        network = DynamicNeuralNetwork([(4, 5), (3, 4)], [(2, 3), (4, 4), (3, 3)], num_chains=6,
+                                       input_node_connectivity=1.0, output_node_connectivity=.34)
+        inputs = [np.random.random((2, 4, 5)), np.random.random((2, 3, 4))]
+        expected = network.create_execution_context().run(inputs)
+        outputs = network.evaluate_outputs(inputs, [2, 0])
+        self.assertTrue(np.allclose(outputs[0], expected[2]))
+        self.assertTrue(np.allclose(outputs[1], expected[0]))
+
+        plan = network.compile_execution_plan()
+        subgraph = plan.output_subgraph((1,))
+        self.assertIs(subgraph, plan.output_subgraph((1,)))
+        for node_idx in subgraph[1:]:
+            self.assertTrue(np.all(np.isin(plan.connection_src[plan.fan_in(node_idx)], subgraph)))
+        for other_output in (network.output_nodes[0], network.output_nodes[2]):
+            self.assertFalse(plan.node_index[other_output] in subgraph)
+        with self.assertRaises(ValueError):
+            network.evaluate_outputs(inputs, [3])
+
+    def test_buffer_pool_reuses_arrays(self):
+        network = build_linear_network([(4, 4), (4, 4), (4, 4)])
+        input_node = network.input_nodes[0]
+        branch = DNNNode((4, 4))
+        input_node.add_outgoing_connection(branch)
+        branch.add_outgoing_connection(network.output_nodes[0])
+        pooled_network = deepcopy(network)
+        pooled_network.enable_buffer_pool()
+        in_data = np.random.random((2, 4, 4)) + np.eye(4)
+        expected = np.random.random((2, 4, 4))
+
+        pooled_network.add_input_data([in_data])
+        pooled_network.propagate_inputs()
+        first_output = pooled_network.extract_output_data()[0]
+        pooled_network.clear_incoming_messages()
+        pooled_network.add_input_data([in_data])
+        pooled_network.propagate_inputs()
+        self.assertIs(pooled_network.extract_output_data()[0], first_output)
+        pooled_network.clear_incoming_messages()
+
+        changes = [(c.change_weight_a, c.change_weight_b) for c in pooled_network.compile_execution_plan().connections]
+        network.perform_backpropagation([in_data], [expected])
+        pooled_network.perform_backpropagation([in_data], [expected])
+        for connection, pooled_connection, (change_a, change_b) in zip(
+                network.compile_execution_plan().connections, pooled_network.compile_execution_plan().connections,
+                changes):
+            self.assertTrue(np.allclose(connection.weight_a, pooled_connection.weight_a))
+            self.assertTrue(np.allclose(connection.weight_b, pooled_connection.weight_b))
+            self.assertIs(pooled_connection.change_weight_a, change_a)
+            self.assertIs(pooled_connection.change_weight_b, change_b)
+
+        pooled_network.enable_buffer_pool(False)
+        self.assertTrue(all(node.pooled_message is None for node in pooled_network.compile_execution_plan().nodes))
+
+    def test_other_networks_leave_plan_current(self):
+        plan = self.network.compile_execution_plan()
+        arena = self.network.weight_arena()
+        context = self.network.create_execution_context()
+        DynamicNeuralNetwork([(1, 2)], [(2, 3)], input_node_connectivity=1.0, output_node_connectivity=1.0)
+        self.assertFalse(plan.is_stale())
+        self.assertIs(self.network.compile_execution_plan(), plan)
+        self.assertIs(self.network.weight_arena(), arena)
+        context.run([np.random.random((1, 2)), np.random.random((3, 4))])
+        self.network.input_nodes[0].add_outgoing_connection(DNNNode((2, 2)))
+        self.assertTrue(plan.is_stale())
+
+    def test_weight_arena_backs_connections(self):
+        arena = self.network.weight_arena()
+        connections = self.network.compile_execution_plan().connections
+        for connection in connections:
+            for weights in (connection.weight_a, connection.weight_b,
+                            connection.change_weight_a, connection.change_weight_b):
+                self.assertTrue(np.shares_memory(weights, arena.buffer))
+        connections[0].change_weight_b += 1
+        before = arena.snapshot()
+        self.network.update_weights()
+        self.assertTrue(np.allclose(arena.weights - before, np.concatenate(
+            [np.concatenate([np.zeros(c.weight_a.size), np.full(c.weight_b.size, float(i == 0))])
+             for i, c in enumerate(connections)])))
+        self.assertFalse(arena.changes.any())
+
+        # Copies get an arena of their own, bound again on first use
+        copied = deepcopy(self.network)
+        copied_connection = copied.compile_execution_plan().connections[0]
+        self.assertTrue(np.allclose(copied_connection.weight_b, connections[0].weight_b))
+        copied_arena = copied.weight_arena()
+        self.assertTrue(np.shares_memory(copied_connection.weight_b, copied_arena.buffer))
+        self.assertFalse(np.shares_memory(copied_arena.buffer, arena.buffer))
+
+        # A topology change moves every weight into a new arena
+        old_weights = [(c.weight_a.copy(), c.weight_b.copy()) for c in connections]
+        extra_node = DNNNode((2, 2))
+        self.network.input_nodes[0].add_outgoing_connection(extra_node)
+        extra_node.add_outgoing_connection(self.network.output_nodes[0])
+        new_arena = self.network.weight_arena()
+        self.assertIsNot(new_arena, arena)
+        for connection, (weight_a, weight_b) in zip(connections, old_weights):
+            self.assertTrue(np.array_equal(connection.weight_a, weight_a))
+            self.assertTrue(np.array_equal(connection.weight_b, weight_b))
+        for connection in self.network.compile_execution_plan().connections:
+            self.assertTrue(np.shares_memory(connection.weight_a, new_arena.buffer))
+
+    def test_inference_mode_skips_recording(self):
+        inputs = [np.random.random((1, 2)), np.random.random((3, 4))]
+        self.network.add_input_data(inputs)
+        self.network.propagate_inputs()
+        expected = self.network.extract_output_data()[0]
+        self.network.clear_incoming_messages()
+
+        tape = self.network.activation_tape()
+        tape.begin_pass()
+        with self.network.inference_mode():
+            self.network.add_input_data(inputs)
+            self.network.propagate_inputs()
+            output_node = self.network.output_nodes[0]
+            self.assertTrue(all(msg.message_history is None for msg in output_node.incoming_messages))
+            output = self.network.extract_output_data()[0]
+            self.network.clear_incoming_messages()
+            with self.assertRaises(ValueError):
+                self.network.perform_backpropagation(inputs, [output])
+        self.assertFalse(self.network.inference_only)
+        self.assertFalse(tape.recorded.any())
+        self.assertTrue(np.allclose(output, expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import json
+import socket
+import unittest
+import zlib
+from copy import deepcopy
+
+import numpy as np
+
+from components.DNNNode import DNNNode
+from components.DNNParameterServer import DNNParameterServer, DNNParameterClient, DNNLoopbackTransport, \
+    DNNTcpTransport, encode_parameters, decode_parameters, frame_header, request_pull, request_push
+from unit_test.helpers import build_linear_network
+
+
+class DNNParameterServerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.network = build_linear_network([(4, 4), (4, 4), (4, 4)])
+        self.in_data = np.random.random((2, 4, 4)) + np.eye(4)
+        self.expected = np.random.random((2, 4, 4))
+
+    def test_connection_ids_match_across_replicas(self):
+        connections = self.network.compile_execution_plan().connections
+        ids = [c.connection_id for c in connections]
+        self.assertEqual(len(set(ids)), len(ids))
+        replica = deepcopy(self.network)
+        self.assertEqual([c.connection_id for c in replica.compile_execution_plan().connections], ids)
+
+    def test_connection_ids_stay_unique(self):
+        self.network.set_backprop_workers(2)
+        self.network.input_nodes[0].add_outgoing_connection(DNNNode((4, 4)))
+        ids = [c.connection_id for c in self.network.compile_execution_plan().connections]
+        self.assertEqual(len(set(ids)), len(ids))
+        self.network.shutdown_workers()
+
+    def test_parameter_encoding(self):
+        parameters = {3: (np.random.random((2, 3)), np.random.random((3, 4))), 1: (np.eye(2), np.ones((1, 1)))}
+        decoded, version = decode_parameters(encode_parameters(parameters, 7))
+        self.assertEqual(version, 7)
+        for conn_id, (weight_a, weight_b) in parameters.items():
+            self.assertTrue(np.array_equal(decoded[conn_id][0], weight_a))
+            self.assertTrue(np.array_equal(decoded[conn_id][1], weight_b))
+        decoded, _ = decode_parameters(encode_parameters(parameters, 7, "float32", True))
+        self.assertTrue(np.allclose(decoded[3][1], parameters[3][1], atol=1e-6))
+
+    def test_loopback_training_matches_local(self):
+        reference = deepcopy(self.network)
+        server = DNNParameterServer(deepcopy(self.network))
+        client = DNNParameterClient(self.network, DNNLoopbackTransport(server), delta_dtype="float64", compress=True)
+        self.assertTrue(client.train_step([self.in_data], [self.expected]))
+        reference.perform_backpropagation([self.in_data], [self.expected])
+        self.assertEqual(server.version, 1)
+        for connection, reference_connection in zip(self.network.compile_execution_plan().connections,
+                                                    reference.compile_execution_plan().connections):
+            self.assertTrue(np.allclose(connection.weight_a, reference_connection.weight_a))
+            self.assertTrue(np.allclose(connection.weight_b, reference_connection.weight_b))
+            self.assertFalse(connection.change_weight_a.any())
+
+    def test_stale_pushes_rejected(self):
+        server = DNNParameterServer(self.network, max_staleness=1)
+        slow_client = DNNParameterClient(deepcopy(self.network), DNNLoopbackTransport(server))
+        fast_client = DNNParameterClient(deepcopy(self.network), DNNLoopbackTransport(server))
+        slow_client.pull()
+        fast_client.train_step([self.in_data], [self.expected])
+        fast_client.train_step([self.in_data], [self.expected])
+        slow_client.network.compute_weight_changes([self.in_data], [self.expected])
+        self.assertFalse(slow_client.push())
+        self.assertEqual((server.accepted_pushes, server.rejected_pushes), (2, 1))
+
+    def test_malformed_push_changes_nothing(self):
+        server = DNNParameterServer(self.network)
+        weights = {conn_id: (weight_a.copy(), weight_b.copy())
+                   for conn_id, (weight_a, weight_b) in server.weights.items()}
+        first_id = min(weights)
+        bad_shape = {first_id: (np.ones(weights[first_id][0].shape), np.ones((1, 1)))}
+        unknown_id = {first_id: (np.ones(weights[first_id][0].shape), np.ones(weights[first_id][1].shape)),
+                      max(weights) + 1: (np.ones((1, 1)), np.ones((1, 1)))}
+        for deltas in (bad_shape, unknown_id):
+            with self.assertRaises(ValueError):
+                server.push(encode_parameters(deltas, 0))
+        self.assertEqual(server.version, 0)
+        for conn_id, (weight_a, weight_b) in weights.items():
+            self.assertTrue(np.array_equal(server.weights[conn_id][0], weight_a))
+            self.assertTrue(np.array_equal(server.weights[conn_id][1], weight_b))
+
+    def test_malformed_payloads_rejected(self):
+        header = json.dumps({"version": 0, "dtype": "float64", "entries": []}).encode("utf-8")
+        compressed = json.dumps({"version": 0, "dtype": "float64", "compressed": True, "entries": []})
+        compressed = compressed.encode("utf-8")
+        for payload in (b"\x00\x01", frame_header.pack(100) + b"{}", frame_header.pack(len(header)) + header,
+                        frame_header.pack(len(compressed)) + compressed + b"not zlib"):
+            with self.assertRaises(ValueError):
+                decode_parameters(payload)
+        self.assertEqual(decode_parameters(frame_header.pack(len(compressed)) + compressed + zlib.compress(b"")),
+                         ({}, 0))
+
+    def test_tcp_answers_malformed_requests(self):
+        server = DNNParameterServer(deepcopy(self.network))
+        host, port = server.serve_tcp()
+        transport = DNNTcpTransport(host, port)
+        try:
+            for kind, payload in ((request_push, b"\x00\x01"), (b"X", b"")):
+                with self.assertRaises(ValueError):
+                    transport.request(kind, payload)
+            # The connection survives, and still serves well formed requests
+            self.assertEqual(decode_parameters(transport.request(request_pull, b""))[1], 0)
+        finally:
+            transport.close()
+            server.shutdown()
+
+    def test_tcp_refuses_oversized_frames(self):
+        server = DNNParameterServer(deepcopy(self.network), max_frame_size=1024)
+        host, port = server.serve_tcp()
+        sock = socket.create_connection((host, port))
+        try:
+            sock.settimeout(5)
+            sock.sendall(request_push + frame_header.pack(0xFFFFFFF0))
+            response = sock.makefile("rb").read()
+            self.assertEqual(response[:1], b"\x01")
+            self.assertIn(b"exceeds the limit", response)
+        finally:
+            sock.close()
+            server.shutdown()
+
+    def test_tcp_transport(self):
+        server = DNNParameterServer(deepcopy(self.network))
+        host, port = server.serve_tcp()
+        transport = DNNTcpTransport(host, port)
+        try:
+            client = DNNParameterClient(self.network, transport)
+            self.assertTrue(client.train_step([self.in_data], [self.expected]))
+            for connection in self.network.compile_execution_plan().connections:
+                self.assertTrue(np.array_equal(connection.weight_a, server.weights[connection.connection_id][0]))
+        finally:
+            transport.close()
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
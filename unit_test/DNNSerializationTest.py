@@ -0,0 +1,102 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from components.DNNNetwork import DynamicNeuralNetwork
+from components.DNNSerialization import save_network, load_network, read_network_header, weight_alignment, \
+    network_magic, preamble
+
+
+class DNNSerializationTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.network = DynamicNeuralNetwork([(1, 2), (3, 4)], [(2, 3)],
+                                            input_node_connectivity=1.0, output_node_connectivity=1.0)
+        self.in_data = [np.random.random((5, 1, 2)), np.random.random((5, 3, 4))]
+        handle, self.path = tempfile.mkstemp(suffix=".dnn")
+        os.close(handle)
+        save_network(self.network, self.path)
+
+    def tearDown(self) -> None:
+        os.remove(self.path)
+
+    def assertSameNetwork(self, loaded: 'DynamicNeuralNetwork'):
+        plan = self.network.compile_execution_plan()
+        loaded_plan = loaded.compile_execution_plan()
+        self.assertEqual([c.connection_id for c in loaded_plan.connections],
+                         [c.connection_id for c in plan.connections])
+        self.assertTrue(np.array_equal(loaded.weight_arena().weights, self.network.weight_arena().weights))
+        self.network.add_input_data(self.in_data)
+        self.network.propagate_inputs()
+        loaded.add_input_data(self.in_data)
+        loaded.propagate_inputs()
+        self.assertTrue(np.allclose(loaded.extract_output_data()[0], self.network.extract_output_data()[0]))
+
+    def test_weights_are_aligned(self):
+        header = read_network_header(self.path)
+        self.assertEqual(header["data_offset"] % weight_alignment, 0)
+        self.assertEqual(os.path.getsize(self.path) - header["data_offset"], header["num_weights"] * 8)
+
+    def test_load_round_trip(self):
+        loaded = load_network(self.path)
+        self.assertSameNetwork(loaded)
+        loaded.perform_backpropagation(self.in_data, [np.random.random((5, 2, 3))])
+
+    def test_memory_mapped_load(self):
+        loaded = load_network(self.path, "r")
+        self.assertSameNetwork(loaded)
+        weights = loaded.weight_arena().weights
+        self.assertIsInstance(weights, np.memmap)
+        self.assertFalse(weights.flags.writeable)
+        connection = loaded.compile_execution_plan().connections[0]
+        self.assertTrue(np.shares_memory(connection.weight_a, weights))
+        self.assertEqual(loaded.evaluate_outputs(self.in_data, [0])[0].shape, (5, 2, 3))
+
+    def test_copy_on_write_load_trains(self):
+        loaded = load_network(self.path, "c")
+        loaded.perform_backpropagation(self.in_data, [np.random.random((5, 2, 3))])
+        self.assertFalse(np.array_equal(loaded.weight_arena().weights, self.network.weight_arena().weights))
+        self.assertSameNetwork(load_network(self.path, "r"))
+
+    def test_read_only_load_refuses_training(self):
+        loaded = load_network(self.path, "r")
+        with self.assertRaisesRegex(ValueError, "inference only"):
+            loaded.perform_backpropagation(self.in_data, [np.random.random((5, 2, 3))])
+        with self.assertRaisesRegex(ValueError, "inference only"):
+            loaded.restore_weights(self.network.weight_arena().snapshot())
+        self.assertSameNetwork(loaded)
+
+    def test_rejects_other_files(self):
+        with open(self.path, "wb") as out_file:
+            out_file.write(b"not a network")
+        with self.assertRaises(ValueError):
+            load_network(self.path)
+
+    def test_rejects_mismatched_layout(self):
+        # Connections listed out of plan order rebuild a plan whose layout differs from the saved weights
+        header = read_network_header(self.path)
+        with open(self.path, "rb") as in_file:
+            weights = in_file.read()[header["data_offset"]:]
+        header["topology"]["connections"].reverse()
+        encoded = json.dumps(header).encode("utf-8")
+        with open(self.path, "wb") as out_file:
+            out_file.write(preamble.pack(network_magic, len(encoded)) + encoded + weights)
+        with self.assertRaises(ValueError):
+            load_network(self.path)
+
+    def test_rejects_truncated_files(self):
+        with open(self.path, "rb") as in_file:
+            saved = in_file.read()
+        header = read_network_header(self.path)
+        for length in (2, header["data_offset"] - 1, len(saved) - 8):
+            with open(self.path, "wb") as out_file:
+                out_file.write(saved[:length])
+            with self.assertRaises(ValueError):
+                load_network(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
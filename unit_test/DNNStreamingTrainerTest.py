@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+from copy import deepcopy
+
+import numpy as np
+
+from components.DNNStreamingTrainer import DNNStreamingTrainer, iterate_batches, prefetch
+from unit_test.helpers import build_linear_network
+
+
+class DNNStreamingTrainerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.network = build_linear_network([(4, 4), (4, 4), (4, 4)])
+        self.directory = tempfile.mkdtemp()
+        self.samples = []
+        self.shards = []
+        for shard_idx, num_samples in enumerate((5, 3)):
+            arrays = [np.random.random((num_samples, 4, 4)) + np.eye(4), np.random.random((num_samples, 4, 4))]
+            paths = [os.path.join(self.directory, str(shard_idx) + "_" + str(i) + ".npy") for i in range(2)]
+            for path, array in zip(paths, arrays):
+                np.save(path, array)
+            self.samples.append(arrays)
+            self.shards.append((paths[:1], paths[1:]))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_batches_follow_shards(self):
+        batches = list(prefetch(iterate_batches(self.network, self.shards, 4), 1))
+        self.assertEqual([batch[0][0].shape[0] for batch in batches], [4, 1, 3])
+        self.assertTrue(np.array_equal(batches[1][1][0], self.samples[0][1][4:]))
+        self.assertFalse(isinstance(batches[0][0][0], np.memmap))
+
+    def test_prefetch_stops_early(self):
+        produced = []
+
+        def batches():
+            for i in range(10):
+                produced.append(i)
+                yield i
+
+        prefetched = prefetch(batches(), 2)
+        self.assertEqual(next(prefetched), 0)
+        prefetched.close()
+        self.assertLess(len(produced), 10)
+        for item in prefetch(iter([1, 2, 3]), 1):
+            if item == 1:
+                break
+
+    def test_streaming_matches_in_memory_training(self):
+        reference = deepcopy(self.network)
+        steps = []
+        trainer = DNNStreamingTrainer(self.network, self.shards, batch_size=4, on_step=lambda: steps.append(1))
+        self.assertEqual(trainer.train_epoch(), 8)
+        self.assertEqual(len(steps), 3)
+        for arrays in self.samples:
+            for start in range(0, arrays[0].shape[0], 4):
+                reference.perform_backpropagation([arrays[0][start:start + 4]], [arrays[1][start:start + 4]])
+        self.assertTrue(np.array_equal(self.network.weight_arena().weights, reference.weight_arena().weights))
+
+    def test_shard_shapes_are_checked(self):
+        np.save(self.shards[1][1][0], np.zeros((3, 4, 3)))
+        trainer = DNNStreamingTrainer(self.network, self.shards, batch_size=4)
+        with self.assertRaises(ValueError):
+            trainer.train_epoch()
+        # The first shard still trained before the second was opened
+        self.assertEqual(trainer.steps, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import gc
+import unittest
+import weakref
+
+import numpy as np
+
+from components.DNNInputNode import DNNInputNode
+from components.DNNNode import DNNNode
+from components.DNNNodeConnection import factorization_cache
+from matrix import MatrixMultiplicationSolver as mms
+from matrix.FactorizationCache import FactorizationCache
+
+
+class FactorizationCacheTest(unittest.TestCase):
+
+    def test_factorization_reused_until_evicted(self):
+        cache = FactorizationCache(2)
+        mat_a = np.array([[2, 1], [1, 3]], float)
+        mat_b = np.array([[4, 1], [2, 5]], float)
+        mat_c = np.array([[1, 2], [3, 1]], float)
+        first = cache.get("a", mat_a)
+        self.assertIs(first, cache.get("a", mat_a))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache.get("b", mat_b)
+        cache.get("a", mat_a)
+        # "b" is now the least recently used entry
+        cache.get("c", mat_c)
+        self.assertEqual(len(cache), 2)
+        self.assertTrue("a" in cache)
+        self.assertFalse("b" in cache)
+        cache.invalidate("a")
+        self.assertFalse("a" in cache)
+
+    def test_entries_die_with_their_owner(self):
+        class Owner:
+            pass
+
+        cache = FactorizationCache(4)
+        owner = Owner()
+        owner_ref = weakref.ref(owner)
+        cache.get("a", np.array([[2, 1], [1, 3]], float), owner)
+        self.assertTrue(cache.contains("a", owner))
+        self.assertFalse(cache.contains("a"))
+        del owner
+        gc.collect()
+        self.assertIsNone(owner_ref())
+        self.assertEqual(len(cache), 0)
+
+    def test_factored_solve_matches_direct_solve(self):
+        test_mat = np.array([[5, 3, 9], [-2, 3, -1], [-1, -4, 5]], float)
+        res_mat = np.array([[-1, 2], [-4, 0], [1, 3]], float)
+        factorization = FactorizationCache(1).get("mat", test_mat)
+        factored = mms.solveEquation(test_mat, res_mat, known_factorization=factorization)
+        self.assertTrue(np.allclose(test_mat @ factored, res_mat))
+        self.assertTrue(np.allclose(factored, mms.solveEquation(test_mat, res_mat)))
+
+    def test_connection_invalidates_on_update(self):
+        input_node = DNNInputNode((4, 4))
+        internal_node = DNNNode((4, 4))
+        output_node = DNNNode((4, 4))
+        input_node.add_outgoing_connection(internal_node)
+        internal_node.add_outgoing_connection(output_node)
+        connection = internal_node.outgoing_connections[0]
+
+        input_node.add_input_data(np.random.random((4, 4)) + np.eye(4))
+        input_node.transmit_data()
+        internal_node.transmit_data()
+        err_msg = output_node.incoming_messages[0]
+        connection.perform_err_transmit(err_msg)
+        self.assertTrue(factorization_cache.contains("weight_a", connection))
+        self.assertTrue(factorization_cache.contains("weight_b.T", connection))
+        connection.update_weights()
+        self.assertFalse(factorization_cache.contains("weight_a", connection))
+        self.assertFalse(factorization_cache.contains("weight_b.T", connection))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,7 @@ from multiprocessing import Pool
 import numpy as np
 
 import matrix.GaussianEliminator as ge
+import matrix.SharedMemoryBackend as smb
 
 
 class GaussianEliminationTest(unittest.TestCase):
@@ -89,6 +90,45 @@ class GaussianEliminationTest(unittest.TestCase):
         self.assertTrue(np.array_equiv(arr_cpy, np.array([[1, 0, 1/3], [0, 1, 0]], float)))
         multi_pool.close()
 
+    def test_RankDeficientElimination(self):
+        # Round off left by the elimination must not be mistaken for a pivot
+        test_arr = np.array([[1, 2, 3], [4, 5, 6], [7, 8, 9]], float) / 9
+        expected = np.array([[1, 0, -1], [0, 1, 2], [0, 0, 0]], float)
+        arr_cpy = test_arr.copy()
+        ge.gaussian_elimination(arr_cpy)
+        self.assertTrue(np.allclose(arr_cpy, expected))
+        self.assertTrue(np.all(arr_cpy[2] == 0))
+
+    def test_HistoryReplaysOntoOtherMatrices(self):
+        test_arr = np.random.random((6, 6)) + np.eye(6)
+        arr_cpy = test_arr.copy()
+        res = ge.gaussian_elimination(arr_cpy)
+        # Replaying the history onto the identity yields the row operations as a matrix
+        row_ops = np.eye(6)
+        ge.execute_history(res, row_ops, False)
+        self.assertTrue(np.allclose(row_ops @ test_arr, arr_cpy))
+        self.assertTrue(np.allclose(arr_cpy, np.eye(6)))
+
+    def test_SharedMemoryWorkersMatchSerial(self):
+        # Drop the size threshold so every block is split across the pool's workers
+        multi_pool = Pool(3)
+        ge.enableMultiprocessing(multi_pool, 3)
+        threshold = smb.min_parallel_elements
+        smb.min_parallel_elements = 0
+        try:
+            test_arr = np.random.random((12, 14)) + np.eye(12, 14)
+            serial = test_arr.copy()
+            serial_history = ge.gaussian_elimination(serial)
+            shared = test_arr.copy()
+            ge.gaussian_elimination(shared, True)
+            self.assertTrue(np.allclose(shared, serial))
+            replayed = test_arr.copy()
+            ge.execute_history(serial_history, replayed, True)
+            self.assertTrue(np.allclose(replayed, serial))
+        finally:
+            smb.min_parallel_elements = threshold
+            multi_pool.close()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -4,6 +4,8 @@ import numpy as np
 
 from matrix import GaussianEliminator as ge
 from matrix import MatrixMultiplicationSolver as mms
+from matrix import SolverStrategy as ss
+from matrix.MatrixUtils import getPivotPositions
 
 
 class LinearEquationSolverTest(unittest.TestCase):
@@ -65,6 +67,92 @@ class LinearEquationSolverTest(unittest.TestCase):
         mul_res = np.around(mul_res, 5)  # rounding is necessary due to floating point arithmetic inaccuracies
         self.assertTrue(np.array_equiv(res_mat, mul_res))
 
+    def test_classifyColumnsTogether(self):
+        test_mat = np.array([[2, 3], [2, 3]], float)
+        res_mat = np.array([[10, 10], [12, 10]], float)
+        hist = ge.gaussian_elimination(test_mat)
+        ge.execute_history(hist, res_mat, False)
+        pivot_positions = getPivotPositions(test_mat)
+        status = mms.classifySolveStatus(test_mat, res_mat, pivot_positions)
+        self.assertEqual(list(status), [2, 1])
+        for col in range(res_mat.shape[1]):
+            self.assertEqual(mms.systemSolveStatus(test_mat, res_mat[:, [col]])[0] == 2, status[col] == 2)
+
+    def test_solveMixedConsistency(self):
+        # The first column lies in the column space of test_mat, the second does not
+        test_mat = np.array([[1, 0], [0, 1], [1, 1]], float)
+        res_mat = np.array([[1, 1], [2, 0], [3, 0]], float)
+        multiplicand = mms.solveEquation(test_mat, res_mat)
+        self.assertTrue(np.allclose(test_mat @ multiplicand[:, [0]], res_mat[:, [0]]))
+        # The inconsistent column is solved in the least squares sense
+        self.assertTrue(np.allclose(test_mat.T @ test_mat @ multiplicand[:, [1]], test_mat.T @ res_mat[:, [1]]))
+
+    def test_solveBatchMatchesSingleSolves(self):
+        test_mats = np.random.random((50, 4, 4)) + np.eye(4)
+        expected = np.random.random((50, 4, 3))
+        multiplicands = mms.solveEquationBatch(test_mats, test_mats @ expected)
+        self.assertEqual(multiplicands.shape, (50, 4, 3))
+        self.assertTrue(np.allclose(multiplicands, expected))
+        for sample in range(3):
+            single = mms.solveEquation(test_mats[sample], test_mats[sample] @ expected[sample])
+            self.assertTrue(np.allclose(multiplicands[sample], single))
+
+    def test_solveBatchGroupsMixedSystems(self):
+        infinite_mat = np.array([[1, 2, 3], [4, 5, 6], [7, 8, 9]], float)
+        infinite_res = np.array([[14, 32, 50], [32, 77, 122], [50, 122, 194]], float)
+        mixed_mat = np.array([[1, 0], [0, 1], [1, 1]], float)
+        mixed_res = np.array([[1, 1], [2, 0], [3, 0]], float)
+        unique_mat = np.array([[2, 1], [1, 3]], float)
+        unique_res = np.array([[3], [4]], float)
+        multiplicands = mms.solveEquationBatch([infinite_mat, mixed_mat, unique_mat, infinite_mat],
+                                               [infinite_res, mixed_res, unique_res, infinite_res])
+        self.assertEqual(len(multiplicands), 4)
+        self.assertTrue(np.allclose(infinite_mat @ multiplicands[0], infinite_res))
+        self.assertTrue(np.allclose(infinite_mat @ multiplicands[3], infinite_res))
+        self.assertTrue(np.allclose(multiplicands[1], mms.solveEquation(mixed_mat, mixed_res)))
+        self.assertTrue(np.allclose(multiplicands[2], [[1], [1]]))
+
+    def test_strategyDispatchIsReported(self):
+        full_rank_mat = np.array([[5, 3, 9], [-2, 3, -1], [-1, -4, 5]], float)
+        deficient_mat = np.array([[1, 2, 3], [4, 5, 6], [7, 8, 9]], float)
+        res_mat = np.array([[14, 32, 50], [32, 77, 122], [50, 122, 194]], float)
+        tall_mat = np.array([[1, 0], [0, 1], [1, 1]], float)
+        tall_res = np.array([[1, 1], [2, 0], [3, 0]], float)
+        try:
+            ss.setSolverStrategy(ss.STRATEGY_GAUSSIAN)
+            gaussian_full = mms.solveEquation(full_rank_mat, res_mat)
+            self.assertEqual(ss.solver_statistics.last_path(), ss.PATH_GAUSSIAN)
+            gaussian_tall = mms.solveEquation(tall_mat, tall_res)
+
+            ss.setSolverStrategy(ss.STRATEGY_AUTO)
+            ss.solver_statistics.reset()
+            self.assertTrue(np.allclose(mms.solveEquation(full_rank_mat, res_mat), gaussian_full))
+            self.assertEqual(ss.solver_statistics.last_path(), ss.PATH_LAPACK_SOLVE)
+            self.assertTrue(np.allclose(mms.solveEquation(tall_mat, tall_res), gaussian_tall))
+            self.assertEqual(ss.solver_statistics.last_path(), ss.PATH_QR_LEAST_SQUARES)
+            self.assertTrue(np.allclose(deficient_mat @ mms.solveEquation(deficient_mat, res_mat), res_mat))
+            self.assertEqual(ss.solver_statistics.last_path(), ss.PATH_GAUSSIAN)
+            self.assertEqual(ss.solver_statistics.snapshot(),
+                             {ss.PATH_LAPACK_SOLVE: 1, ss.PATH_QR_LEAST_SQUARES: 1, ss.PATH_GAUSSIAN: 1})
+
+            ss.setSolverStrategy(ss.STRATEGY_LAPACK)
+            self.assertTrue(np.allclose(deficient_mat @ mms.solveEquation(deficient_mat, res_mat), res_mat))
+            self.assertEqual(ss.solver_statistics.last_path(), ss.PATH_LAPACK_LSTSQ)
+            with self.assertRaises(ValueError):
+                ss.setSolverStrategy("cholesky")
+        finally:
+            ss.setSolverStrategy(ss.STRATEGY_AUTO)
+
+    def test_factoredSystemFollowsStrategy(self):
+        test_mat = np.array([[5, 3, 9], [-2, 3, -1], [-1, -4, 5]], float)
+        res_mat = np.array([[-1, 2], [-4, 0], [1, 3]], float)
+        factorization = mms.factorSystem(test_mat)
+        self.assertFalse(factorization.is_eliminated())
+        self.assertTrue(np.allclose(test_mat @ mms.solveEquation(test_mat, res_mat, known_factorization=factorization),
+                                    res_mat))
+        deficient_mat = np.array([[1, 2, 3], [4, 5, 6], [7, 8, 9]], float)
+        self.assertTrue(mms.factorSystem(deficient_mat).is_eliminated())
+
 
 if __name__ == '__main__':
     unittest.main()
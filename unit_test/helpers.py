@@ -0,0 +1,11 @@
+from components.DNNNetwork import DynamicNeuralNetwork
+
+
+def build_linear_network(shapes):
+    """
+        Builds a network whose single input feeds a single chain of nodes with the given shapes into a
+        single output.
+    """
+    connections = [(node_idx, node_idx + 1, node_idx) for node_idx in range(len(shapes) - 1)]
+    return DynamicNeuralNetwork.from_topology([shapes[0]], [shapes[-1]], shapes, [0], [len(shapes) - 1], connections,
+                                              num_chains=1)